@@ -68,11 +68,13 @@ class SourceCodeFileUpload(forms.Form):
         if all(field in cleaned_data for field in ['source_code_parameter',
                                                    'buids']):
             # TODO: Detect if the file already contains parameters
+            rejected = []
             cleaned_data['source_codes'] = process_spreadsheet(
                 cleaned_data['source_code_file'],
                 cleaned_data['buids'],
                 cleaned_data['source_code_parameter'],
-                add_codes=False)
+                add_codes=False, rejected=rejected)
+            cleaned_data['rejected_rows'] = rejected
         return cleaned_data
 
     def save(self):
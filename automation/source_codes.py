@@ -1,9 +1,18 @@
 import re
 from django.db import transaction
 
-import xlrd
-
+from redirect.lazy import LazyModule
 from redirect.models import DestinationManipulation
+from redirect.registry import manipulation_table
+
+
+# Imported by the urlconf through automation.views, so by every worker
+xlrd = LazyModule('xlrd')
+
+
+# Number of buids, view sources or new manipulations handled per query. Two
+# __in lookups of this size stay under SQLite's limit of 999 parameters.
+BATCH_SIZE = 450
 
 
 def get_book(location):
@@ -24,9 +33,15 @@ def get_book(location):
     return book
 
 
-def get_values(sheet, source_name, view_source_column=2, source_code_column=1):
+def get_values(sheet, source_name, view_source_column=2, source_code_column=1,
+               rejected=None):
     """
-    Parse source codes from an Excel worksheet, returning the result
+    Parse source codes from an Excel worksheet, yielding them one at a time
+
+    Rows are read in a single pass. Rows where both cells are blank are
+    ignored and the first remaining row is treated as a header. A view
+    source cell may contain several view sources separated by slashes
+    (e.g. "12 / 34"), each of which receives that row's source code.
 
     Inputs:
     :sheet: Excel worksheet that contains source codes
@@ -36,68 +51,13 @@ def get_values(sheet, source_name, view_source_column=2, source_code_column=1):
         default: 2
     :source_code_column: Column containing source codes; 0-based in xlrd,
         default: 1
+    :rejected: Optional list; each row that is skipped because of a missing
+        or invalid value is appended to it as a (row number, reason) tuple,
+        with row numbers starting at 1 as in Excel
 
     Outputs:
-        List of tuples: [(view_source_1, source_code), (view_source_2,...)]
+        Generator of tuples: (view_source_1, source_code), (view_source_2,...)
     """
-    view_sources = [vs.value for vs in sheet.col(view_source_column)]
-    source_parts = [cell.value for cell in sheet.col(source_code_column)]
-
-    # Finds and returns all blank entries in a list
-    get_blanks = lambda list_: [index for index, element
-                                in enumerate(list_)
-                                if element == '']
-
-    # Pops blank indices from the view_sources and source_parts lists
-    pop_blanks = lambda blanks: [(view_sources.pop(blank),
-                                  source_parts.pop(blank))
-                                 for blank in blanks[::-1]]
-
-    for list_ in [view_sources, source_parts]:
-        pop_blanks(get_blanks(list_))
-
-    # The first row is a header; skip it
-    view_sources = view_sources[1:]
-    source_parts = source_parts[1:]
-
-    if isinstance(source_parts[0], float):
-        source_parts = [int(part) for part in source_parts]
-
-    # Make a list of cell indices that contain multiple view sources
-    multiple_view_sources = [view_sources.index(vs)
-                             for vs in view_sources
-                             if isinstance(vs, (str, unicode)) and '/' in vs]
-
-    for index in multiple_view_sources:
-        # For each entry that contains multiple view sources, split it into
-        # its components,
-        split = view_sources[index].split('/')
-
-        # replace the cell containing multiple view sources with one view source
-        view_sources[index] = split.pop(0).strip()
-
-        # append the remaining view sources to the end of the list
-        # and duplicate the relevant source code for each
-        for additional in split:
-            view_sources.append(additional.strip())
-            source_parts.append(source_parts[index])
-
-    parsed_view_sources = []
-    bad_view_sources = []
-    for index, value in enumerate(view_sources):
-        try:
-            # Ensure all elements in the view source list are integers
-            parsed_view_sources.append(int(value))
-        except ValueError:
-            # The current element is not an integer; add it to the list of
-            # elements to be removed
-            bad_view_sources.append(index)
-
-    for index in bad_view_sources[::-1]:
-        # Discard all source codes that correspond to a non-integer view source
-        source_parts.pop(index)
-    view_sources = parsed_view_sources
-
     # Some files already contain query parameters; in those cases, we don't
     # need to do any additional handling.
     if source_name:
@@ -108,11 +68,63 @@ def get_values(sheet, source_name, view_source_column=2, source_code_column=1):
     else:
         source_name = ''
 
-    # Construct source codes from the parameter we were passed (if any)
-    # and the values we parsed from the spreadsheet
-    source_codes = ['%s%s' % (source_name, part) for part in source_parts]
+    if rejected is None:
+        rejected = []
+    last_column = max(view_source_column, source_code_column)
+    seen_header = False
+    for row_index in xrange(sheet.nrows):
+        row = sheet.row_values(row_index)
+        if len(row) <= last_column:
+            row.extend([''] * (last_column + 1 - len(row)))
+        view_source = row[view_source_column]
+        source_part = row[source_code_column]
+
+        if view_source == '' or source_part == '':
+            if view_source != source_part:
+                rejected.append((row_index + 1, 'missing %s' % (
+                    'view source' if view_source == '' else 'source code')))
+            continue
+
+        if not seen_header:
+            # The first row is a header; skip it
+            seen_header = True
+            continue
+
+        # xlrd converts integer values to floating point
+        if isinstance(source_part, float):
+            source_part = int(source_part)
+        source_code = '%s%s' % (source_name, source_part)
+
+        if isinstance(view_source, basestring):
+            view_sources = view_source.split('/')
+        else:
+            view_sources = [view_source]
+        for view_source in view_sources:
+            try:
+                view_source = int(view_source)
+            except ValueError:
+                rejected.append((row_index + 1,
+                                 'invalid view source %r' % view_source))
+            else:
+                yield view_source, source_code
+
+
+def make_batches(values, size=None):
+    """
+    Splits a list of query parameters into lists that are small enough to
+    use in an __in lookup
+
+    Inputs:
+    :values: List of values to split
+    :size: Maximum batch size; default: BATCH_SIZE
 
-    return zip(view_sources, source_codes)
+    Outputs:
+        Generator of lists containing at most :size: values each
+    """
+    size = size or BATCH_SIZE
+    values = list(values)
+    for index in xrange(0, len(values), size):
+        yield values[index:index + size]
 
 
 def add_source_codes(buids, codes):
@@ -122,7 +134,8 @@ def add_source_codes(buids, codes):
 
     Inputs:
     :buids: List of buids that we are going to add source codes to
-    :codes: List of tuples returned by get_values
+    :codes: Iterable of (view source, source code) tuples, as yielded by
+        get_values
 
     Outputs:
     :stats: Dictionary describing what happened in this method; contains the
@@ -137,7 +150,7 @@ def add_source_codes(buids, codes):
     # operations between the two, these need to be ints as well
     buids = [int(buid) for buid in buids]
 
-    all_view_sources = [code[0] for code in codes]
+    all_view_sources = code_dict.keys()
     all_manipulations = set((buid, vs) for buid in buids
                             for vs in all_view_sources)
     existing = set(DestinationManipulation.objects.filter(
@@ -151,36 +164,42 @@ def add_source_codes(buids, codes):
         'total': len(all_manipulations)
     }
 
-    # Bulk create manipulations that don't exist yet
-    new_list = []
-    for new_info in new:
-        manipulation_info = code_dict[new_info[1]]
-        new_list.append(DestinationManipulation(
-            action_type=1, buid=new_info[0], view_source=manipulation_info[0],
-            action='sourcecodetag', value_1=manipulation_info[1]))
-    DestinationManipulation.objects.bulk_create(new_list)
-
-    # Committing manually after all of this is supposed to be faster than
-    # after each individual operation. Found originally at the first link,
-    # new 1.6 functionality at the second. This still does one query per update
-    # http://voorloopnul.com/blog/doing-bulk-update-and-bulk-create-with-django-orm/
-    # https://docs.djangoproject.com/en/1.6/topics/db/transactions/#id5
-    transaction.set_autocommit(False)
-    try:
-        for existing_info in existing:
-            manipulation_info = code_dict[existing_info[1]]
-            DestinationManipulation.objects.filter(
-                buid=existing_info[0], view_source=manipulation_info[0],
-                action='sourcecodetag').update(
-                    value_1=manipulation_info[1])
-    finally:
-        transaction.set_autocommit(True)
+    # Existing manipulations that receive the same source code can all be
+    # updated at once, so group them by value rather than by view source.
+    updates = {}
+    for view_source in set(vs for _, vs in existing):
+        updates.setdefault(code_dict[view_source][1], []).append(view_source)
+
+    with transaction.atomic():
+        # Bulk create manipulations that don't exist yet
+        new_list = []
+        for new_info in new:
+            manipulation_info = code_dict[new_info[1]]
+            new_list.append(DestinationManipulation(
+                action_type=1, buid=new_info[0],
+                view_source=manipulation_info[0], action='sourcecodetag',
+                value_1=manipulation_info[1]))
+        DestinationManipulation.objects.bulk_create(
+            new_list, batch_size=BATCH_SIZE)
+
+        # One UPDATE per distinct source code (and batch of buids and view
+        # sources) instead of one per buid/view source pair
+        for value_1, view_sources in updates.items():
+            for buid_batch in make_batches(buids):
+                for vs_batch in make_batches(view_sources):
+                    DestinationManipulation.objects.filter(
+                        buid__in=buid_batch, view_source__in=vs_batch,
+                        action='sourcecodetag').update(value_1=value_1)
+
+    # bulk_create and update don't send signals; rebuild the routing table
+    # ourselves
+    manipulation_table.invalidate()
 
     return stats
 
 
 def process_spreadsheet(location, buids, source_name, view_source_column=2,
-                        source_code_column=1, add_codes=True):
+                        source_code_column=1, add_codes=True, rejected=None):
     """
     Chains get_book and get_values, optionally executes add_source_codes
 
@@ -192,14 +211,15 @@ def process_spreadsheet(location, buids, source_name, view_source_column=2,
     :source_code_column: Column of worksheet that contains source codes
     :add_codes: Boolean denoting whether we should add source codes;
         Default: True
+    :rejected: Optional list to collect rows skipped by get_values
 
     Outputs:
         If add_codes==True, returns summary of operations
         Else, returns source codes to be added
     """
     book = get_book(location)
-    codes = get_values(book.source_code_sheet, source_name, view_source_column,
-                       source_code_column)
+    codes = list(get_values(book.source_code_sheet, source_name,
+                            view_source_column, source_code_column, rejected))
     if add_codes:
         return add_source_codes(buids, codes)
     else:
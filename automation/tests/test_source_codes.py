@@ -1,8 +1,13 @@
 from django.core.urlresolvers import reverse
-from django.test import TransactionTestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from myjobs.models import User
 from redirect.models import DestinationManipulation
 
+from automation.source_codes import get_book, get_values
+from automation.tests.workbooks import benchmark, make_workbook
+
 
 class SourceCodeUploadTests(TransactionTestCase):
     def setUp(self):
@@ -76,3 +81,72 @@ class SourceCodeUploadTests(TransactionTestCase):
 
         # If this is parsed as a float, int(value) will raise a ValueError
         int_value = int(value)
+
+
+class BulkSourceCodeTests(TestCase):
+    def test_generated_workbook(self):
+        """
+        200 view sources for 50 business units are added and then modified
+        with a number of queries that depends on the number of distinct
+        source codes rather than the number of manipulations.
+        """
+        buids = range(1, 51)
+        with CaptureQueriesContext(connection) as queries:
+            results = benchmark(buids, num_view_sources=200, num_codes=10)
+
+        added, _ = results['add']
+        modified, _ = results['modify']
+        self.assertEqual(added, {'added': 10000, 'modified': 0,
+                                 'total': 10000})
+        self.assertEqual(modified, {'added': 0, 'modified': 10000,
+                                    'total': 10000})
+        self.assertTrue(len(queries) < 100)
+
+        manipulation = DestinationManipulation.objects.get(buid=50,
+                                                           view_source=123)
+        self.assertEqual(manipulation.value_1, '?src=JB-3')
+        self.assertEqual(
+            DestinationManipulation.objects.filter(
+                value_1__startswith='?src=JB').count(), 10000)
+
+
+class GetValuesTests(TestCase):
+    def get_values(self, rows, rejected=None):
+        book = get_book(make_workbook(rows))
+        return list(get_values(book.source_code_sheet, 'src',
+                               rejected=rejected))
+
+    def test_multiple_view_sources(self):
+        rows = [['Name', 'Code', 'View Source'],
+                ['a', 'one', '12 / 34'],
+                ['b', 'two', 56],
+                ['c', 'three', '12 / 34']]
+        self.assertEqual(self.get_values(rows),
+                         [(12, '?src=one'), (34, '?src=one'),
+                          (56, '?src=two'),
+                          (12, '?src=three'), (34, '?src=three')])
+
+    def test_header_is_first_non_blank_row(self):
+        rows = [['', '', ''],
+                ['Name', 'Code', 'View Source'],
+                ['a', 1000.0, 1.0]]
+        self.assertEqual(self.get_values(rows), [(1, '?src=1000')])
+
+    def test_rejected_rows(self):
+        rejected = []
+        with open('automation/tests/spreadsheets/bad/invalid_rows.xlsx') as fp:
+            book = get_book(fp)
+            values = list(get_values(book.source_code_sheet, 'src',
+                                     rejected=rejected))
+        self.assertEqual(values, [])
+        self.assertEqual([row for row, _ in rejected], [2, 3, 4])
+        self.assertTrue('view source' in rejected[0][1])
+        self.assertTrue('source code' in rejected[1][1])
+
+    def test_partially_invalid_cell(self):
+        rejected = []
+        rows = [['Name', 'Code', 'View Source'],
+                ['a', 'one', '1/x/3']]
+        self.assertEqual(self.get_values(rows, rejected),
+                         [(1, '?src=one'), (3, '?src=one')])
+        self.assertEqual([row for row, _ in rejected], [2])
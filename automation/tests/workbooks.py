@@ -0,0 +1,131 @@
+"""
+Builds source code spreadsheets on the fly so tests can exercise sizes that
+would be impractical to check in.
+
+Only what xlrd needs to read a single worksheet is written; cells use inline
+strings so no shared string table is required.
+"""
+from cStringIO import StringIO
+from time import time
+from xml.sax.saxutils import escape
+import zipfile
+
+from automation.source_codes import add_source_codes, get_book, get_values
+
+
+# Namespaces and content types, which are too long to write out inline
+PACKAGE = 'http://schemas.openxmlformats.org/package/2006'
+RELATIONSHIPS = ('http://schemas.openxmlformats.org/officeDocument/2006/'
+                 'relationships')
+SPREADSHEETML = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+SPREADSHEET_TYPE = ('application/vnd.openxmlformats-officedocument.'
+                    'spreadsheetml')
+NAMES = {'package': PACKAGE, 'relationships': RELATIONSHIPS,
+         'spreadsheetml': SPREADSHEETML, 'spreadsheet': SPREADSHEET_TYPE}
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="%(package)s/content-types">
+<Default Extension="rels" \
+ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" \
+ContentType="%(spreadsheet)s.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" \
+ContentType="%(spreadsheet)s.worksheet+xml"/>
+</Types>''' % NAMES
+
+RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="%(package)s/relationships">
+<Relationship Id="rId1" Type="%(relationships)s/officeDocument" \
+Target="xl/workbook.xml"/>
+</Relationships>''' % NAMES
+
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="%(spreadsheetml)s" xmlns:r="%(relationships)s">
+<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>''' % NAMES
+
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="%(package)s/relationships">
+<Relationship Id="rId1" Type="%(relationships)s/worksheet" \
+Target="worksheets/sheet1.xml"/>
+</Relationships>''' % NAMES
+
+SHEET = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetData>%s</sheetData>
+</worksheet>'''
+
+
+def make_cell(column, row, value):
+    reference = '%s%d' % ('ABCDEFGHIJKLMNOPQRSTUVWXYZ'[column], row)
+    if isinstance(value, (int, long, float)):
+        return '<c r="%s"><v>%s</v></c>' % (reference, value)
+    return '<c r="%s" t="inlineStr"><is><t>%s</t></is></c>' % (
+        reference, escape(value))
+
+
+def make_workbook(rows):
+    """
+    Creates an .xlsx workbook with one worksheet
+
+    Inputs:
+    :rows: List of rows, each a list of cell values (strings or numbers)
+
+    Outputs:
+    :workbook: File-like object containing the workbook, positioned at the
+        start
+    """
+    sheet_rows = []
+    for row_number, row in enumerate(rows, start=1):
+        cells = ''.join(make_cell(column, row_number, value)
+                        for column, value in enumerate(row))
+        sheet_rows.append('<row r="%d">%s</row>' % (row_number, cells))
+
+    workbook = StringIO()
+    archive = zipfile.ZipFile(workbook, 'w', zipfile.ZIP_DEFLATED)
+    archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+    archive.writestr('_rels/.rels', RELS)
+    archive.writestr('xl/workbook.xml', WORKBOOK)
+    archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+    archive.writestr('xl/worksheets/sheet1.xml', SHEET % ''.join(sheet_rows))
+    archive.close()
+    workbook.seek(0)
+    return workbook
+
+
+def make_source_code_workbook(num_view_sources, num_codes, code_prefix='DE'):
+    """
+    Creates a source code spreadsheet laid out like the ones users upload:
+    a header row followed by (name, source code, view source) rows
+
+    Inputs:
+    :num_view_sources: Number of view sources (1 through num_view_sources)
+    :num_codes: Number of distinct source codes to spread across them
+    :code_prefix: Prefix for generated source codes
+    """
+    rows = [['Name', 'Source Code', 'View Source']]
+    for view_source in range(1, num_view_sources + 1):
+        rows.append(['View source %d' % view_source,
+                     '%s-%d' % (code_prefix, view_source % num_codes),
+                     view_source])
+    return make_workbook(rows)
+
+
+def benchmark(buids, num_view_sources=200, num_codes=10):
+    """
+    Times add_source_codes for a generated spreadsheet, once when every
+    manipulation is new and once when every manipulation already exists
+
+    Outputs:
+    :results: Dictionary mapping 'add' and 'modify' to (stats, seconds)
+    """
+    results = {}
+    for run, prefix in [('add', 'DE'), ('modify', 'JB')]:
+        book = get_book(make_source_code_workbook(num_view_sources, num_codes,
+                                                  prefix))
+        codes = get_values(book.source_code_sheet, 'src')
+        start = time()
+        stats = add_source_codes(buids, codes)
+        results[run] = (stats, time() - start)
+    return results
@@ -13,6 +13,7 @@ def source_code_upload(request):
         form = SourceCodeFileUpload(post, request.FILES)
         if form.is_valid():
             context['stats'] = form.save()
+            context['rejected_rows'] = form.cleaned_data['rejected_rows']
     else:
         form = SourceCodeFileUpload()
     context['form'] = form
@@ -68,6 +68,7 @@ TEMPLATE_CONTEXT_PROCESSORS += (
 )
 
 # List of callables that know how to import templates from various sources.
+# Production and staging wrap these in the cached loader (see deploy/).
 TEMPLATE_LOADERS = (
     'django.template.loaders.filesystem.Loader',
     'django.template.loaders.app_directories.Loader',
@@ -75,6 +76,8 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'redirect.middleware.TimingMiddleware',
+    'redirect.middleware.QueryBudgetMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,6 +88,15 @@ MIDDLEWARE_CLASSES = (
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+# The only middleware job clicks go through (redirect.handlers); views.home
+# has no use for sessions, CSRF protection, users or messages
+REDIRECT_MIDDLEWARE_CLASSES = (
+    'redirect.middleware.TimingMiddleware',
+    'redirect.middleware.QueryBudgetMiddleware',
+    'redirect.middleware.AllowedHostMiddleware',
+    'redirect.middleware.ExcludedViewSourceMiddleware',
+)
+
 ROOT_URLCONF = 'urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -153,6 +165,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'redirect': {
+            'handlers': ['file', 'mail_admins'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     }
 }
 
@@ -164,9 +181,100 @@ CACHES = {
 
 NEW_RELIC_TRACKING = False
 
-EXCLUDED_VIEW_SOURCE_CACHE_KEY = 'excluded_view_sources'
-
-CUSTOM_EXCLUSION_CACHE_KEY = 'custom_excluded_view_sources'
+EXCLUSION_GENERATION_CACHE_KEY = 'exclusion_generation'
+
+POLICY_GENERATION_CACHE_KEY = 'business_unit_policy_generation'
+
+CAMPAIGN_GENERATION_CACHE_KEY = 'campaign_generation'
+
+MANIPULATION_GENERATION_CACHE_KEY = 'manipulation_generation'
+
+# Maximum number of seconds a process keeps using its in-memory lookup tables
+# (redirect.registry) before checking whether another process changed them
+REGISTRY_CHECK_INTERVAL = 5
+
+# Per-process GUID lookup caches (redirect.resolver). Timeouts are in seconds;
+# GUID_LOOKUP_THREADS is the number of threads used to query the archive
+# database alongside the main one (0 queries them one after the other), and
+# GUID_ARCHIVE_TIMEOUT the most a click missing from the main one waits for
+# the archive.
+GUID_CACHE_SIZE = 10000
+
+GUID_CACHE_TIMEOUT = 60
+
+GUID_NEGATIVE_CACHE_TIMEOUT = 30
+
+GUID_LOOKUP_THREADS = 1
+
+GUID_ARCHIVE_TIMEOUT = 1
+
+# Moving expired redirects to the archive (redirect.tasks); rows are moved
+# ARCHIVE_BATCH_SIZE at a time, at no more than ARCHIVE_ROWS_PER_SECOND
+# (0 for no limit), with progress recorded in ARCHIVE_CHECKPOINT_FILE so an
+# interrupted run can resume. The deploy settings keep the checkpoint under
+# DATA_DIR; None disables it.
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_ROWS_PER_SECOND = 0
+ARCHIVE_CHECKPOINT_FILE = None
+
+# Job details from Solr (redirect.solr) are cached per process for
+# SOLR_CACHE_TIMEOUT seconds; lookups taking longer than SOLR_TIMEOUT seconds
+# fall back to what the Redirect table has
+SOLR_CACHE_SIZE = 10000
+SOLR_CACHE_TIMEOUT = 300
+SOLR_TIMEOUT = 2
+
+# Rendered OpenGraph/Twitter cards (redirect.cards) are served from the cache
+# for CARD_CACHE_TIMEOUT seconds, then re-rendered in the background while
+# the old card is served for up to CARD_CACHE_STALE seconds more; a card
+# rendered on the spot waits at most CARD_SOLR_TIMEOUT seconds for Solr
+CARD_CACHE_TIMEOUT = 600
+CARD_CACHE_STALE = 3600
+CARD_SOLR_TIMEOUT = 0.5
+
+# Per-stage timing of redirects (redirect.timing), reported by the stats
+# view; SERVER_TIMING_HEADER also sends each request's timings back to the
+# client in a Server-Timing header. With REQUEST_TIMING off, TimingMiddleware
+# removes itself from the middleware chain; the deploy settings turn it on.
+REQUEST_TIMING = False
+SERVER_TIMING_HEADER = False
+
+# Compare each redirect's queries and cache round-trips with its branch's
+# budget (redirect.budgets): None to skip, 'warn' to log overruns or 'raise'
+# to fail the request. Counting queries turns on the debug cursor, which
+# records every query's SQL, so neither is meant for production; 'warn' is
+# for development and staging, 'raise' for tests. With None,
+# QueryBudgetMiddleware removes itself from the middleware chain.
+QUERY_BUDGET_CHECK = None
+
+# Worker warm-up (redirect.warmup) can preload the most clicked GUIDs from a
+# file written by the write_hot_guids command
+WARMUP_HOT_GUIDS_FILE = None
+WARMUP_HOT_GUIDS = 1000
+
+# Structured click events (redirect.clicklog) are buffered in memory, up to
+# CLICK_LOG_BUFFER of them, and written to CLICK_LOG_DIR every
+# CLICK_LOG_FLUSH_INTERVAL seconds; None turns the click log off
+CLICK_LOG_DIR = None
+CLICK_LOG_BUFFER = 10000
+CLICK_LOG_FLUSH_INTERVAL = 5
+
+# Most (guid, view source) pairs one post to the resolve_batch view may hold
+BATCH_RESOLVE_MAX_PAIRS = 100000
+
+# Seconds between writes of each worker's click counts per business unit and
+# view source (redirect.clickcounts) to the ClickRollup table, e.g. 60;
+# None turns the counts off
+CLICK_COUNTS_FLUSH_INTERVAL = None
+
+# Seconds a rendered expired job page is kept in the cache for reuse
+EXPIRED_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Emails posted to the email redirect webhook are queued here until the
+# process_email_queue command handles them (redirect.mail_queue); must be
+# writable by both the web server and the worker, and should be a data
+# directory that survives deploys and reboots. Set per deploy.
+EMAIL_QUEUE_DIR = None
 
 COMPRESS_PRECOMPILERS = (
     ('text/less', 'lessc {infile} {outfile}'),
@@ -40,3 +40,11 @@ SOLR = {
 # With COMPRESS_ENABLED = True, you must run ./manage.py compress for each
 # css change and then restart runserver
 COMPRESS_ENABLED = False
+
+# Data that has to survive restarts; production keeps this outside the
+# checkout
+DATA_DIR = join(ROOT_PATH, 'data')
+
+EMAIL_QUEUE_DIR = join(DATA_DIR, 'email_queue')
+
+ARCHIVE_CHECKPOINT_FILE = join(DATA_DIR, 'transfer_redirects.json')
@@ -4,6 +4,13 @@ from default_settings import *
 DEBUG = False
 TEMPLATE_DEBUG = DEBUG
 
+# Keep templates compiled for the life of the process; redirect.warmup
+# compiles the ones clicks use before any traffic arrives. Template edits
+# need a restart, so this is left off in development.
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.mysql',
@@ -38,3 +45,13 @@ CACHES = {
 SOLR = {
     'default': 'http://ec2-54-225-127-98.compute-1.amazonaws.com:8983/solr'
 }
+
+# Data that has to survive deploys and reboots lives outside the checkout
+DATA_DIR = '/var/lib/redirect'
+
+EMAIL_QUEUE_DIR = join(DATA_DIR, 'email_queue')
+
+# Stage timings for the stats view
+REQUEST_TIMING = True
+
+ARCHIVE_CHECKPOINT_FILE = join(DATA_DIR, 'transfer_redirects.json')
@@ -1,11 +1,11 @@
-from django.conf import settings
 from django.contrib import admin
 from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 
-from redirect.models import (CanonicalMicrosite, CompanyEmail,
+from redirect.models import (CanonicalMicrosite, ClickRollup, CompanyEmail,
     CustomExcludedViewSource, DestinationManipulation, EmailRedirectLog,
     ExcludedViewSource, ViewSource)
+from redirect.registry import exclusion_table
 
 
 #
@@ -119,7 +119,8 @@ class ExcludedViewSourceFilter(admin.SimpleListFilter):
             param = 'view_source_id'
         else:
             param = 'view_source'
-        filter_dict = {'%s__in' % param: settings.EXCLUDED_VIEW_SOURCES}
+        excluded = exclusion_table.get()
+        filter_dict = {'%s__in' % param: excluded}
         if self.value() == 'Yes':
             return queryset.filter(**filter_dict)
         elif self.value() == 'No':
@@ -138,6 +139,24 @@ class CanonicalMicrositeAdmin(admin.ModelAdmin):
     search_fields = ['buid', 'canonical_microsite_url']
 
 
+class ClickRollupAdmin(admin.ModelAdmin):
+    """
+    Click volumes are written by the redirect workers and the
+    merge_click_rollups command, so they can only be viewed here.
+    """
+    list_display = ['start', 'period', 'buid', 'view_source', 'clicks']
+    list_filter = ['period', 'start']
+    search_fields = ['=buid', '=view_source']
+    ordering = ['-start', 'buid', 'view_source']
+    readonly_fields = list_display
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 class CompanyEmailAdmin(admin.ModelAdmin):
     list_display = ['buid', 'email']
     search_fields = ['=buid', 'email']
@@ -185,6 +204,7 @@ class ViewSourceAdmin(admin.ModelAdmin):
 
 
 admin.site.register(CanonicalMicrosite, CanonicalMicrositeAdmin)
+admin.site.register(ClickRollup, ClickRollupAdmin)
 admin.site.register(CompanyEmail, CompanyEmailAdmin)
 admin.site.register(CustomExcludedViewSource, CustomExcludedViewSourceAdmin)
 admin.site.register(DestinationManipulation, DestinationManipulationAdmin)
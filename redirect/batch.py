@@ -0,0 +1,152 @@
+"""
+Resolves the final destination of many (guid, view source) pairs at once.
+
+Feed generators and link audits need to know where a click would go for
+large lists of jobs. Rather than requesting and following one redirect per
+pair, they post the pairs to the resolve_batch view, or run the
+resolve_redirects command, and read back one result per pair.
+
+Input and output are both JSON lines. Each input line holds {"guid": ...,
+"vsid": ...}, where vsid defaults to "0". Each output line repeats the
+guid and vsid and adds either:
+
+    {"url": ..., "buid": ..., "expired": ...}
+
+or, if the pair could not be resolved:
+
+    {"error": "invalid" | "not found"}
+
+Lines that aren't pairs at all come back as {"line": ..., "error":
+"invalid"}.
+
+GUIDs are looked up BATCH_SIZE at a time with one query per redirect table
+(see GuidResolver.resolve_many). Each pair then goes through the same
+microsite, exclusion and manipulation logic as views.home, minus the parts
+that depend on the click itself: syndication site ids, custom query
+parameters, social media bots, cookies and headers.
+"""
+import copy
+import json
+import re
+import uuid
+
+from django.http import HttpRequest, QueryDict
+
+from redirect import helpers
+from redirect.registry import exclusion_table
+from redirect.resolver import guid_resolver
+
+
+# Pairs resolved per round of bulk lookups
+BATCH_SIZE = 1000
+
+# View source ids; unlike unicode.isdigit(), only ASCII digits, and unlike
+# '$', no trailing newline
+VSID_RE = re.compile(r'^[0-9]+\Z')
+
+
+def parse_pairs(lines):
+    """
+    Inputs:
+    :lines: Iterable of JSON lines
+
+    Outputs:
+    :pairs: Generator of (guid, vsid) tuples, or the line itself (stripped)
+        in place of a tuple when it can't be parsed; blank lines are skipped
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            pair = json.loads(line)
+            yield (unicode(pair['guid']), unicode(pair.get('vsid', '0')))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            yield line
+
+
+def make_request():
+    """
+    Outputs:
+    :request: Request standing in for a plain click with no query string
+    """
+    request = HttpRequest()
+    request.GET = QueryDict('')
+    request.REQUEST = request.GET
+    request.META['QUERY_STRING'] = ''
+    request.exclusions = exclusion_table.get()
+    return request
+
+
+def resolve_pair(request, redirect, vsid):
+    """
+    Outputs:
+    :result: Dictionary of the url a click from view source :vsid: on
+        :redirect: would be sent to, the job's buid and whether it has
+        expired
+    """
+    guid = helpers.clean_guid(redirect.guid).upper()
+    destination = helpers.get_destination(request, redirect, vsid, guid)
+    return {'url': destination['redirect_url'],
+            'buid': redirect.buid,
+            'expired': bool(destination.get('expired'))}
+
+
+def resolve(pairs, batch_size=BATCH_SIZE):
+    """
+    Inputs:
+    :pairs: Iterable of (guid, vsid) tuples as produced by parse_pairs
+
+    Outputs:
+    :results: Generator of one result dictionary per pair, in order
+    """
+    request = make_request()
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) >= batch_size:
+            for result in resolve_chunk(request, batch):
+                yield result
+            batch = []
+    for result in resolve_chunk(request, batch):
+        yield result
+
+
+def resolve_chunk(request, pairs):
+    keys = []
+    for pair in pairs:
+        key = None
+        if isinstance(pair, tuple) and VSID_RE.match(pair[1]):
+            try:
+                key = '{%s}' % uuid.UUID(pair[0])
+            except ValueError:
+                pass
+        keys.append(key)
+    redirects = guid_resolver.resolve_many([guid for guid in keys if guid])
+
+    for pair, key in zip(pairs, keys):
+        if key is None:
+            if isinstance(pair, tuple):
+                yield {'guid': pair[0], 'vsid': pair[1], 'error': 'invalid'}
+            else:
+                yield {'line': pair, 'error': 'invalid'}
+            continue
+        result = {'guid': pair[0], 'vsid': pair[1]}
+        redirect = redirects.get(key)
+        if redirect is None:
+            result['error'] = 'not found'
+        else:
+            # Manipulations rewrite redirect.url, and the same job may be
+            # paired with several view sources
+            result.update(resolve_pair(request, copy.copy(redirect),
+                                       pair[1]))
+        yield result
+
+
+def format_results(results):
+    """
+    Outputs:
+    :lines: Generator of JSON lines, one per result
+    """
+    for result in results:
+        yield json.dumps(result, sort_keys=True) + '\n'
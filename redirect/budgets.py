@@ -0,0 +1,82 @@
+"""
+Query and cache round-trip budgets for each branch a redirect can take.
+
+BUDGETS is the most queries (over every database) and cache round-trips a
+request taking that branch may make. The numbers are for a request whose
+GUID isn't in the resolver's cache and that checks every registry's
+generation, which is as bad as it gets once the process is warm. Requests
+that rebuild a registry are not checked, since the rebuild is shared with
+every other request until the next edit.
+
+QueryBudgetMiddleware does the checking when settings.QUERY_BUDGET_CHECK is
+'warn' (log a warning, in development or staging) or 'raise' (raise
+BudgetExceeded, for tests). Counting queries records every one of them
+through the debug cursor, so leave the check off in production. Cache
+round-trips are counted through the 'cache' stage of redirect.timing, so
+settings.REQUEST_TIMING must be on as well.
+"""
+from collections import namedtuple
+
+from redirect import timing
+
+
+Budget = namedtuple('Budget', ['queries', 'cache'])
+
+BUDGETS = {
+    # Every job lookup queries the redirect table, and the archive too if
+    # the job isn't there. Every request reads the exclusions' generation;
+    # the microsite, manipulation, campaign and card caches are read (and
+    # card caches written) only by the branches that need them.
+    'microsite': Budget(queries=1, cache=3),
+    'manipulations': Budget(queries=1, cache=3),
+    'archive': Budget(queries=2, cache=5),
+    # Plus the Site the feed wants to send this click to
+    'syndication': Budget(queries=2, cache=2),
+    'opengraph': Budget(queries=1, cache=3),
+    # Checking the webhook's credentials
+    'email_redirect': Budget(queries=1, cache=1),
+    # Moving one microsite and two manipulations; every further
+    # manipulation costs one more query, which is worth a warning
+    'update_buid': Budget(queries=7, cache=1),
+}
+
+# Stage redirect.registry times table rebuilds under
+REBUILD = 'rebuild'
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def set_branch(name):
+    """
+    Records which branch the current request took, so that it is held to
+    that branch's budget
+    """
+    timer = timing.current()
+    if timer is not None:
+        timer.branch = name
+
+
+def get_overruns(branch, queries, cache_calls):
+    """
+    Inputs:
+    :branch: Key of BUDGETS
+    :queries: Number of queries the request made
+    :cache_calls: Number of cache round-trips the request made
+
+    Outputs:
+    :overruns: List of descriptions of what exceeded the budget; empty if
+        nothing did or the branch has no budget
+    """
+    budget = BUDGETS.get(branch)
+    if budget is None:
+        return []
+    overruns = []
+    if queries > budget.queries:
+        overruns.append('%s: %d queries > %d' % (branch, queries,
+                                                 budget.queries))
+    if cache_calls > budget.cache:
+        overruns.append('%s: %d cache round-trips > %d' % (
+            branch, cache_calls, budget.cache))
+    return overruns
@@ -0,0 +1,158 @@
+"""
+Rendered OpenGraph and Twitter card pages for social media bots.
+
+Bots re-fetch the same job many times shortly after it is shared. Rendered
+cards are kept in the shared cache, keyed by guid and bot view source, for
+CARD_CACHE_TIMEOUT seconds. After that they are stale but still served for
+up to CARD_CACHE_STALE seconds more while one thread per process renders a
+replacement in the background, so a bot is never kept waiting on Solr for a
+card we already have.
+
+When there is no card at all, it is rendered on the spot. The Solr lookup
+for Twitter descriptions is then limited to CARD_SOLR_TIMEOUT seconds; if it
+fails, the card falls back to the title and location stored on the Redirect
+and is treated as stale, so the next fetch picks up the full description.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from redirect import timing
+from redirect.solr import job_cache
+
+
+logger = logging.getLogger(__name__)
+
+# User agent substring (lowercase) -> view source we attribute the fetch to
+BOT_VIEW_SOURCES = [('facebookexternalhit', '1593'),
+                    ('twitterbot', '1596'),
+                    ('linkedinbot', '1548')]
+
+TWITTER_VIEW_SOURCE = '1596'
+
+
+def get_bot_view_source(user_agent):
+    """
+    Outputs:
+    :view_source: View source for the social media bot making this request,
+        or None if :user_agent: isn't one of those bots
+    """
+    user_agent = user_agent.lower()
+    for name, view_source in BOT_VIEW_SOURCES:
+        if name in user_agent:
+            return view_source
+    return None
+
+
+def start_thread(function, *args):
+    thread = threading.Thread(target=function, args=args)
+    thread.daemon = True
+    thread.start()
+
+
+class CardCache(object):
+    """
+    Rendered card bodies, shared between processes through the Django cache
+    """
+    def __init__(self, timeout, stale, solr_timeout):
+        self.timeout = timeout
+        self.stale = stale
+        self.solr_timeout = solr_timeout
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def get_key(self, guid, view_source):
+        return 'redirect_card:%s:%s' % (guid, view_source)
+
+    def get(self, redirect, guid, view_source):
+        """
+        Retrieves the card for one job and bot, rendering it if needed
+
+        Inputs:
+        :redirect: Redirect instance for this job
+        :guid: 32-character job guid, as it appears in card urls
+        :view_source: Bot view source from get_bot_view_source
+
+        Outputs:
+        :body: Rendered card page
+        """
+        with timing.stage('cache'):
+            entry = cache.get(self.get_key(guid, view_source))
+        if entry is None:
+            return self.render(redirect, guid, view_source, self.solr_timeout)
+        fresh_until, body = entry
+        if fresh_until <= time.time():
+            self.refresh(redirect, guid, view_source)
+        return body
+
+    def render(self, redirect, guid, view_source, solr_timeout=None):
+        """
+        Renders a card and stores it in the cache
+
+        Inputs:
+        :solr_timeout: Seconds to wait for the Twitter description; default:
+            settings.SOLR_TIMEOUT
+
+        Outputs:
+        :body: Rendered card page
+        """
+        # redirect.helpers imports this module
+        from redirect.helpers import quote_string
+
+        data = {'title': redirect.job_title,
+                'company': quote_string(redirect.company_name),
+                'guid': guid,
+                'vs': view_source}
+        complete = True
+        if view_source == TWITTER_VIEW_SOURCE:
+            template = 'redirect/twitter.html'
+            job = job_cache.get_job(guid, timeout=solr_timeout)
+            if job is not None:
+                # Twitter cards already truncates descriptions to the closest
+                # word under 200 characters
+                data['description'] = job.get('description', '')
+                data['company_raw'] = job.get('company_exact', '')
+            else:
+                data['description'] = '%s in %s' % (redirect.job_title,
+                                                    redirect.job_location)
+                data['company_raw'] = redirect.company_name
+                complete = False
+        else:
+            template = 'redirect/opengraph.html'
+        body = render_to_string(template, data)
+
+        now = time.time()
+        fresh_until = now + self.timeout if complete else now
+        with timing.stage('cache'):
+            cache.set(self.get_key(guid, view_source), (fresh_until, body),
+                      self.timeout + self.stale)
+        return body
+
+    def refresh(self, redirect, guid, view_source):
+        """
+        Renders a replacement for a stale card in the background, unless
+        this process is already doing so
+        """
+        key = self.get_key(guid, view_source)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        start_thread(self._refresh, key, redirect, guid, view_source)
+
+    def _refresh(self, key, redirect, guid, view_source):
+        try:
+            self.render(redirect, guid, view_source)
+        except Exception:
+            logger.exception('Refreshing card %s failed', key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+card_cache = CardCache(settings.CARD_CACHE_TIMEOUT, settings.CARD_CACHE_STALE,
+                       settings.CARD_SOLR_TIMEOUT)
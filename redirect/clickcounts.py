@@ -0,0 +1,295 @@
+"""
+Click volumes per business unit and view source, counted in memory.
+
+views.home counts each click it redirects (or shows an expired page for)
+against the current UTC hour. Every CLICK_COUNTS_FLUSH_INTERVAL seconds a
+background thread adds the counts gathered since the last flush to the
+ClickRollup table in one transaction, so a worker writes once per interval
+rather than once per click. The merge_click_rollups command later folds
+past hours into daily totals, which the admin lists.
+
+Counts still in memory when a worker is killed are lost. When a flush
+fails, its counts are written one row at a time; rows that still fail are
+kept for the next flush, up to MAX_FLUSH_ATTEMPTS times, and then dropped.
+"""
+import atexit
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from redirect.models import ClickRollup
+
+
+logger = logging.getLogger(__name__)
+
+STAT_KEYS = ['clicks', 'flushes', 'written', 'errors', 'dropped']
+
+# Largest value ClickRollup's integer columns hold on every database
+MAX_INTEGER = 2 ** 31 - 1
+
+# View source counted for clicks whose view source doesn't fit the column;
+# real view sources are never negative
+OUT_OF_RANGE_VIEW_SOURCE = -1
+
+# Failed flushes a row of counts is kept for before it is dropped
+MAX_FLUSH_ATTEMPTS = 5
+
+# Merged hourly rows deleted per query; SQLite allows at most 999 variables
+DELETE_BATCH_SIZE = 999
+
+
+def get_hour(when=None):
+    """
+    Outputs:
+    :hour: Start of the UTC hour containing :when: (default: now)
+    """
+    when = when or datetime.utcnow()
+    return datetime(when.year, when.month, when.day, when.hour,
+                    tzinfo=timezone.utc)
+
+
+def get_day(when):
+    """
+    Outputs:
+    :day: Start of the UTC day containing :when:
+    """
+    when = when.astimezone(timezone.utc) if timezone.is_aware(when) else when
+    return datetime(when.year, when.month, when.day, tzinfo=timezone.utc)
+
+
+class ClickCounter(object):
+    """
+    Counts clicks per (hour, buid, view source) and periodically adds them
+    to the ClickRollup table
+    """
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Serializes writers: the flusher thread, flush() and atexit
+        self._write_lock = threading.Lock()
+        self._counts = {}
+        # Failed flushes per key in _counts, for keys that have failed
+        self._attempts = {}
+        self._wake = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+    @property
+    def enabled(self):
+        return bool(self.flush_interval)
+
+    def increment(self, buid, view_source, when=None):
+        """
+        Counts one click
+
+        Inputs:
+        :buid: Business unit of the job clicked
+        :view_source: View source the click came from; ones too large to
+            store are counted under OUT_OF_RANGE_VIEW_SOURCE
+        :when: Naive UTC datetime of the click; default: now
+        """
+        if not 0 <= view_source <= MAX_INTEGER:
+            view_source = OUT_OF_RANGE_VIEW_SOURCE
+        key = (get_hour(when), buid, view_source)
+        with self._lock:
+            if self._pid != os.getpid():
+                # First click in this process (threads don't survive a fork)
+                self._pid = os.getpid()
+                self._start()
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self.stats['clicks'] += 1
+
+    def _start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing click counts failed')
+            finally:
+                # This thread's connections would otherwise stay open
+                # between flushes
+                for connection in connections.all():
+                    connection.close()
+
+    def flush(self):
+        """
+        Adds the counts gathered since the last flush to the database
+
+        Outputs:
+        :rows: Number of rows written, or None if there was nothing to write
+            or nothing could be written (failed rows are kept for the next
+            flush, up to MAX_FLUSH_ATTEMPTS times)
+        """
+        with self._write_lock:
+            with self._lock:
+                counts = self._counts
+                if not counts:
+                    return None
+                self._counts = {}
+            failed = {}
+            try:
+                add_clicks(ClickRollup.HOUR, counts)
+            except Exception:
+                logger.exception('Could not write %d click counts; trying '
+                                 'them one at a time', len(counts))
+                # Keeps one bad row from holding up all the others
+                for key, clicks in counts.items():
+                    try:
+                        add_clicks(ClickRollup.HOUR, {key: clicks})
+                    except Exception:
+                        failed[key] = clicks
+            written = len(counts) - len(failed)
+            with self._lock:
+                for key in counts:
+                    if key not in failed:
+                        self._attempts.pop(key, None)
+                for key, clicks in failed.items():
+                    attempts = self._attempts.pop(key, 0) + 1
+                    if attempts >= MAX_FLUSH_ATTEMPTS:
+                        logger.error('Dropped %d clicks for %r after %d '
+                                     'failed flushes', clicks, key, attempts)
+                        self.stats['dropped'] += 1
+                        continue
+                    self._attempts[key] = attempts
+                    self._counts[key] = self._counts.get(key, 0) + clicks
+                if failed:
+                    self.stats['errors'] += 1
+                if written:
+                    self.stats['flushes'] += 1
+                    self.stats['written'] += written
+            return written or None
+
+    def stop(self):
+        """
+        Stops this process's flusher thread, if it has one, and writes out
+        whatever is still counted
+        """
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._stopped = True
+            self._thread = None
+            self._pid = None
+        if thread is not None:
+            self._wake.set()
+            thread.join()
+        self.flush()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._counts)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._counts = {}
+            self._attempts = {}
+            self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+
+def add_clicks(period, counts):
+    """
+    Adds click counts to the ClickRollup rows they belong to, creating any
+    that don't exist yet, in one transaction
+
+    Inputs:
+    :period: ClickRollup.HOUR or ClickRollup.DAY
+    :counts: Dictionary of (start, buid, view source) -> clicks
+    """
+    try:
+        _add_clicks(period, counts)
+    except IntegrityError:
+        # Another worker created some of the same rows first; they exist now
+        _add_clicks(period, counts)
+
+
+def _add_clicks(period, counts):
+    starts = set(key[0] for key in counts)
+    buids = set(key[1] for key in counts)
+    with transaction.atomic():
+        existing = set(ClickRollup.objects.filter(
+            period=period, start__in=starts, buid__in=buids).values_list(
+                'start', 'buid', 'view_source'))
+        new = []
+        for key, clicks in counts.items():
+            start, buid, view_source = key
+            if key in existing:
+                ClickRollup.objects.filter(
+                    period=period, start=start, buid=buid,
+                    view_source=view_source).update(
+                        clicks=F('clicks') + clicks)
+            else:
+                new.append(ClickRollup(period=period, start=start, buid=buid,
+                                       view_source=view_source,
+                                       clicks=clicks))
+        ClickRollup.objects.bulk_create(new)
+
+
+def merge_days(before):
+    """
+    Folds hourly counts into daily totals
+
+    Inputs:
+    :before: Merge hours that start before this; should be the start of a
+        UTC day so that no day is left partly merged
+
+    Outputs:
+    :hours: Number of hourly rows merged (and deleted)
+    :days: Number of daily rows they were added to
+    """
+    hours = ClickRollup.objects.filter(period=ClickRollup.HOUR,
+                                       start__lt=before)
+    with transaction.atomic():
+        totals = {}
+        merged = []
+        # Locking keeps flushes from adding to these rows until they're
+        # gone; rows a flush inserts meanwhile aren't read, so only the
+        # rows that were read are deleted
+        for pk, start, buid, view_source, clicks in (
+                hours.select_for_update().values_list(
+                    'pk', 'start', 'buid', 'view_source', 'clicks')):
+            key = (get_day(start), buid, view_source)
+            totals[key] = totals.get(key, 0) + clicks
+            merged.append(pk)
+        if totals:
+            add_clicks(ClickRollup.DAY, totals)
+            for index in xrange(0, len(merged), DELETE_BATCH_SIZE):
+                ClickRollup.objects.filter(
+                    pk__in=merged[index:index + DELETE_BATCH_SIZE]).delete()
+    return len(merged), len(totals)
+
+
+def get_merge_cutoff(keep_days=0, now=None):
+    """
+    Outputs:
+    :before: Start of the UTC day :keep_days: days before the one
+        containing :now: (default: now)
+    """
+    return get_day(now or timezone.now()) - timedelta(days=keep_days)
+
+
+click_counter = ClickCounter(settings.CLICK_COUNTS_FLUSH_INTERVAL)
+
+
+def stop_at_exit():
+    if click_counter.enabled:
+        click_counter.stop()
+
+
+atexit.register(stop_at_exit)
@@ -0,0 +1,225 @@
+"""
+Structured log of redirect clicks, written by the application itself.
+
+views.home records one event per click: the job, view source, visitor
+cookies, referer, where the click was sent, whether the job had expired,
+which social media bot (if any) fetched it, and how long the view took.
+Events go into a bounded in-process buffer; a background thread writes them
+out every CLICK_LOG_FLUSH_INTERVAL seconds, or sooner once the buffer is
+half full, as a gzipped JSON-lines segment in CLICK_LOG_DIR.
+
+Recording a click never waits on the disk. If the flusher falls behind and
+the buffer fills up, new events are dropped and counted instead.
+
+Segments are named clicks-<UTC time>-<pid>-<sequence>.jsonl.gz and are
+written under a temporary name first, so anything matching that pattern is
+complete. read_events() reads them back.
+"""
+from collections import deque
+import atexit
+from datetime import datetime
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+STAT_KEYS = ['recorded', 'dropped', 'written', 'segments', 'errors']
+
+SEGMENT_PATTERN = 'clicks-*.jsonl.gz'
+
+
+class ClickLog(object):
+    """
+    Bounded buffer of click events with a background thread that writes
+    them to disk
+    """
+    def __init__(self, directory, capacity, flush_interval):
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Serializes writers: the flusher thread, flush() and atexit
+        self._write_lock = threading.Lock()
+        self._events = deque()
+        self._wake = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+        self._sequence = 0
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def record(self, event):
+        """
+        Adds a click event to the buffer, or drops it if the buffer is full
+
+        Inputs:
+        :event: JSON-serializable dictionary
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # First event in this process (threads don't survive a fork)
+                self._pid = os.getpid()
+                self._start()
+            if len(self._events) >= self.capacity:
+                self.stats['dropped'] += 1
+                return
+            self._events.append(event)
+            self.stats['recorded'] += 1
+            if len(self._events) * 2 >= self.capacity:
+                self._wake.set()
+
+    def _start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing click events failed')
+
+    def flush(self):
+        """
+        Writes every buffered event to a new segment
+
+        Outputs:
+        :path: Path of the segment written, or None if there was nothing to
+            write or writing failed (the events are then lost)
+        """
+        with self._write_lock:
+            with self._lock:
+                events = self._events
+                if not events:
+                    return None
+                self._events = deque()
+                self._sequence += 1
+                sequence = self._sequence
+            name = 'clicks-%s-%d-%d.jsonl.gz' % (
+                datetime.utcnow().strftime('%Y%m%dT%H%M%S'), os.getpid(),
+                sequence)
+            path = os.path.join(self.directory, name)
+            temporary = os.path.join(self.directory, '.%s.tmp' % name)
+            try:
+                output = gzip.open(temporary, 'wb')
+                try:
+                    for event in events:
+                        output.write(json.dumps(event, sort_keys=True))
+                        output.write('\n')
+                finally:
+                    output.close()
+                os.rename(temporary, path)
+            except (IOError, OSError, TypeError, ValueError):
+                logger.exception('Could not write %d click events to %s',
+                                 len(events), path)
+                with self._lock:
+                    self.stats['errors'] += 1
+                return None
+            with self._lock:
+                self.stats['written'] += len(events)
+                self.stats['segments'] += 1
+            return path
+
+    def stop(self):
+        """
+        Stops this process's flusher thread, if it has one, and writes out
+        whatever is still buffered
+        """
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._stopped = True
+            self._thread = None
+            self._pid = None
+        if thread is not None:
+            self._wake.set()
+            thread.join()
+        self.flush()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['buffered'] = len(self._events)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+
+def make_event(request, redirect, guid, view_source, response, url, expired,
+               bot_view_source, start):
+    """
+    Builds the event views.home records for a click
+
+    Inputs:
+    :request: Request for the click
+    :redirect: Redirect or RedirectArchive that was clicked
+    :guid: Cleaned, uppercase GUID of that job
+    :view_source: View source from the url
+    :response: Response being returned
+    :url: Where the click was sent, if known; defaults to the response's
+        Location header
+    :expired: Whether the job had expired
+    :bot_view_source: View source of the social media bot making the
+        request, if any
+    :start: time.time() when the view started
+    """
+    aguid = request.COOKIES.get('aguid', '')
+    if 'aguid' in response.cookies:
+        aguid = response.cookies['aguid'].value
+    return {'time': round(start, 3),
+            'guid': guid,
+            'buid': redirect.buid,
+            'vsid': view_source,
+            'aguid': aguid,
+            'myguid': request.COOKIES.get('myguid', ''),
+            'referer': request.META.get('HTTP_REFERER', ''),
+            'url': url or response.get('Location', ''),
+            'status': response.status_code,
+            'expired': bool(expired),
+            'bot': bot_view_source,
+            'latency': round((time.time() - start) * 1000, 3)}
+
+
+def read_events(paths):
+    """
+    Streams click events out of segments, which may be given as directories
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            segments = sorted(glob.glob(os.path.join(path, SEGMENT_PATTERN)))
+        else:
+            segments = [path]
+        for segment in segments:
+            with gzip.open(segment) as f:
+                for line in f:
+                    yield json.loads(line)
+
+
+click_log = ClickLog(settings.CLICK_LOG_DIR, settings.CLICK_LOG_BUFFER,
+                     settings.CLICK_LOG_FLUSH_INTERVAL)
+
+
+def stop_at_exit():
+    if click_log.enabled:
+        click_log.stop()
+
+
+atexit.register(stop_at_exit)
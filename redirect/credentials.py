@@ -0,0 +1,78 @@
+"""
+Verifies the Basic auth credentials SendGrid sends with every webhook post.
+
+Checking a password means running the full password hasher, which is by
+design the most expensive thing the webhook does. Once a pair of credentials
+has been accepted, this process remembers an HMAC of them together with the
+primary key and password hash of the account they belong to. Later posts with
+the same credentials only need to confirm that the account's password hash
+has not changed since, which is a single primary key lookup.
+"""
+from collections import namedtuple
+import threading
+
+from django.contrib.auth import authenticate
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from myjobs.models import User
+
+
+# Only this account may post to the webhook
+WEBHOOK_USER_EMAIL = 'accounts@my.jobs'
+
+Verified = namedtuple('Verified', ['digest', 'user_pk', 'password'])
+
+
+def get_digest(username, password):
+    # Keyed with SECRET_KEY, so a memory dump does not reveal anything that
+    # can be checked against guessed passwords elsewhere
+    return salted_hmac('redirect.credentials',
+                       '%s\0%s' % (username, password)).hexdigest()
+
+
+class CredentialCache(object):
+    """
+    Remembers the most recently accepted webhook credentials
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._verified = None
+
+    def verify(self, username, password):
+        """
+        Determines if these credentials belong to the webhook account
+
+        Inputs:
+        :username: Email address from the Authorization header
+        :password: Password from the Authorization header
+
+        Outputs:
+        :authorized: True if the credentials are valid for the webhook user
+        """
+        digest = get_digest(username, password)
+        verified = self._verified
+        if verified is not None:
+            current = list(User.objects.filter(
+                pk=verified.user_pk).values_list('password', flat=True))
+            if current and current[0] == verified.password:
+                if constant_time_compare(digest, verified.digest):
+                    return True
+            else:
+                # The password was changed or the account removed
+                self.clear()
+
+        user = authenticate(username=username, password=password)
+        if user is None or user.email != WEBHOOK_USER_EMAIL:
+            return False
+        with self._lock:
+            # authenticate() upgrades outdated hashes, so user.password is
+            # what is stored now
+            self._verified = Verified(digest, user.pk, user.password)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._verified = None
+
+
+credential_cache = CredentialCache()
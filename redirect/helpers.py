@@ -1,33 +1,40 @@
 import base64
 from datetime import datetime, timedelta
 from email.utils import getaddresses
-import urllib
+import hashlib
+import json
+import re
 import urllib2
-import urlparse
-import markdown
-
-from jira.client import JIRA
-from jira.exceptions import JIRAError
-import pysolr
-import requests
+import uuid
 
 from django.conf import settings
-from django.contrib.auth import authenticate
 from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.core.mail import EmailMessage
-from django.http import HttpResponsePermanentRedirect, Http404
-from django.shortcuts import render_to_response
-from django.template import RequestContext
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.http import HttpResponse, HttpResponsePermanentRedirect, Http404
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.html import escape
 from django.utils.http import urlquote_plus
 
-from myjobs.models import User
-import redirect.actions
-from redirect.models import (CanonicalMicrosite, DestinationManipulation,
-                             Redirect, ViewSource)
+from redirect.cards import card_cache, get_bot_view_source
+from redirect.credentials import credential_cache
+from redirect.lazy import LazyModule
+from redirect.models import EmailRedirectLog
+from redirect.querystring import get_merge, merge_query
+from redirect.registry import (campaign_table, exclusion_table,
+                               manipulation_table, policy_table)
+from redirect.resolver import guid_resolver
+from redirect.solr import job_cache
+from redirect import budgets, timing
+
+# Only used when forwarding email; see redirect.lazy
+jira_client = LazyModule('jira.client')
+jira_exceptions = LazyModule('jira.exceptions')
+markdown = LazyModule('markdown')
+requests = LazyModule('requests')
 
 
 STATE_MAP = {
@@ -47,23 +54,57 @@ STATE_MAP = {
             'site': 'guam.us.jobs'},
 }
 
+# Stands in for the view source when rendering expired pages for the cache
+EXPIRED_VIEW_SOURCE_MARKER = '__expired_view_source__'
+
+# Query strings made up only of key=value pairs that replace_or_add_query
+# would write back unchanged
+ENCODED_QUERY_RE = re.compile(r'^[\w.,-]+=[\w.,-]*(&[\w.,-]+=[\w.,-]*)*$')
+
 
 def add_view_source_group(url, view_source):
     """
     Add Google Analytics campaigns to the given url, if applicable.
     """
-    vs = ViewSource.objects.filter(
-        view_source_id=view_source).prefetch_related(
-        'viewsourcegroup_set').first()
-    if (vs is not None and vs.include_ga_params
-            and vs.viewsourcegroup_set.exists()):
-        url = replace_or_add_query(
-            url, '&utm_source={source}-DE'
-                 '&utm_medium={group}'
-                 '&utm_campaign={source}'.format(
-                     source=vs.name,
-                     group=vs.viewsourcegroup_set.first().name))
-    return url
+    with timing.stage('campaign'):
+        try:
+            campaign = campaign_table.get().get(int(view_source))
+        except ValueError:
+            return url
+        if campaign is None:
+            return url
+        return (append_campaign(url, campaign) or
+                replace_or_add_query(url, campaign.query))
+
+
+def append_campaign(url, campaign):
+    """
+    Appends a campaign's pre-encoded parameters to a url, provided that
+    doing so gives the same result as replace_or_add_query
+
+    That holds for absolute urls without a fragment or path parameters whose
+    query string, if any, is already in the form replace_or_add_query
+    writes and contains none of the campaign's keys, which covers the urls
+    we build for microsite and syndication redirects.
+
+    Outputs:
+    :url: Url with campaign parameters added, or None if the url has to go
+        through replace_or_add_query instead
+    """
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    if (not url.startswith(('http://', 'https://')) or '#' in url or
+            ';' in url):
+        return None
+    base, _, query = url.partition('?')
+    if not query:
+        return '%s?%s' % (base, campaign.suffix)
+    if not ENCODED_QUERY_RE.match(query):
+        return None
+    for pair in query.split('&'):
+        if pair.split('=', 1)[0].lower() in campaign.keys:
+            return None
+    return '%s?%s&%s' % (base, query, campaign.suffix)
 
 
 def clean_guid(guid):
@@ -81,14 +122,14 @@ def clean_guid(guid):
     return cleaned_guid.replace("-", "")
 
 
-def do_manipulations(guid_redirect, manipulations,
+def do_manipulations(guid_redirect, pipeline,
                      return_dict, debug_content=None):
     """
-    Performs the manipulations denoted by :manipulations:
+    Runs the url for this job through the compiled manipulation pipeline
 
     Inputs:
     :guid_redirect: Redirect object for this job
-    :manipulations: List of DestinationManipulation objects
+    :pipeline: Pipeline instance returned by get_manipulations, or None
     :return_dict: Dictionary of values used in all levels of the
         main redirect view
     :debug_content: List of strings that will be output on the debug page
@@ -97,89 +138,31 @@ def do_manipulations(guid_redirect, manipulations,
     :return_dict: Potentially modifies the redirect_url key
     :debug_content: Potentially adds new debug strings
     """
-    if manipulations and not return_dict['redirect_url']:
-        for manipulation in manipulations:
-            method_name = manipulation.action
-            if debug_content:
-                debug_content.append(
-                    'ActionTypeID=%s Action=%s' %
-                    (manipulation.action_type,
-                     manipulation.action))
-
-            try:
-                redirect_method = getattr(redirect.actions, method_name)
-            except AttributeError:
-                pass
-            else:
-
-                if manipulation.action in [
-                        'doubleclickwrap', 'replacethenaddpre',
-                        'sourceurlwrap', 'sourceurlwrapappend',
-                        'sourceurlwrapunencoded',
-                        'sourceurlwrapunencodedappend']:
-                    # These actions all result in our final url being
-                    # appended, usually as a query string, to a value
-                    # determined by the manipulation object; due to
-                    # this, we should add any custom query parameters
-                    # before doing the manipulation.
-                    if return_dict['enable_custom_queries']:
-                        guid_redirect.url = replace_or_add_query(
-                            guid_redirect.url,
-                            '&%s' % return_dict.get('qs'),
-                            exclusions=['vs', 'z'])
-                    redirect_url = redirect_method(guid_redirect,
-                                                   manipulation)
-                else:
-                    redirect_url = redirect_method(guid_redirect,
-                                                   manipulation)
-
-                    # manipulations is a QuerySet, which doesn't
-                    # support negative indexing; reverse the set and
-                    # take the first element to get the last
-                    # DestinationManipulation object.
-                    if manipulation == manipulations.reverse()[:1][0]:
-                        # Only add custom query parameters after
-                        # processing the final DestinationManipulation
-                        # object to ensure we're not needlessly
-                        # replacing them on each iteration.
-                        if return_dict['enable_custom_queries']:
-                            redirect_url = replace_or_add_query(
-                                redirect_url,
-                                '&%s' % return_dict.get('qs'),
-                                exclusions=['vs', 'z'])
-                return_dict['redirect_url'] = redirect_url
-
-                if debug_content:
-                    debug_content.append(
-                        'ActionTypeID=%s ManipulatedLink=%s VSID=%s' %
-                        (manipulation.action_type,
-                         return_dict['redirect_url'],
-                         manipulation.view_source))
-
-                guid_redirect.url = return_dict['redirect_url']
+    if pipeline and not return_dict['redirect_url']:
+        custom_query = None
+        if return_dict['enable_custom_queries']:
+            custom_query = '&%s' % return_dict.get('qs')
+        redirect_url = pipeline.run(guid_redirect.url, custom_query,
+                                    debug_content)
+        if redirect_url is not None:
+            return_dict['redirect_url'] = redirect_url
+            guid_redirect.url = redirect_url
 
 
 def get_manipulations(guid_redirect, vs_to_use):
     """
-    Retrieves the set of DestinationManipulation objects, if any, for this
-    GUID and view source
+    Retrieves the compiled manipulations, if any, for this GUID and view
+    source from the in-memory manipulation table
 
     Inputs:
     :guid_redirect: Redirect object for this job
     :vs_to_use: View source to retrieve manipulations for
 
     Outputs:
-    :manipulations: List of DestinationManipulation objects, or None if none
-        exist
+    :pipeline: Pipeline instance, falling back to the one for view source 0;
+        None if neither exists
     """
-    manipulations = DestinationManipulation.objects.filter(
-        buid=guid_redirect.buid,
-        view_source=vs_to_use).order_by('action_type')
-    if not manipulations and vs_to_use != 0:
-        manipulations = DestinationManipulation.objects.filter(
-            buid=guid_redirect.buid,
-            view_source=0).order_by('action_type')
-    return manipulations
+    return manipulation_table.get_pipeline(guid_redirect.buid, vs_to_use)
 
 
 def get_redirect_url(request, guid_redirect, vsid, guid, debug_content=None):
@@ -209,7 +192,7 @@ def get_redirect_url(request, guid_redirect, vsid, guid, debug_content=None):
         return_dict['redirect_url'] = 'http://apps.facebook.com/us-jobs/?jvid=%s%s' % \
                                       (guid, vsid)
     else:
-        manipulations = None
+        pipeline = None
         # Check for a 'vs' request parameter. If it exists, this is an
         # apply click and vs should be used in place of vsid
         apply_vs = request.REQUEST.get('vs')
@@ -225,14 +208,12 @@ def get_redirect_url(request, guid_redirect, vsid, guid, debug_content=None):
         new_job = (guid_redirect.new_date + timedelta(minutes=30)) > \
             datetime.now(tz=timezone.utc)
 
-        try:
-            microsite = CanonicalMicrosite.objects.get(
-                buid=guid_redirect.buid)
-        except CanonicalMicrosite.DoesNotExist:
-            microsite = None
+        with timing.stage('microsite'):
+            policy = policy_table.get_policy(guid_redirect.buid)
+        microsite_url = policy.microsite_url
 
-        if microsite and return_dict.get('expired'):
-            return_dict['browse_url'] = microsite.canonical_microsite_url
+        if microsite_url and return_dict.get('expired'):
+            return_dict['browse_url'] = microsite_url
 
         try:
             vs_to_use = int(vs_to_use)
@@ -242,11 +223,12 @@ def get_redirect_url(request, guid_redirect, vsid, guid, debug_content=None):
             # shouldn't with links, which is apparently quite common
             pass
         else:
-            # vs_to_use in settings.EXCLUDED_VIEW_SOURCES or
-            # (buid, vs_to_use) in settings.CUSTOM_EXCLUSIONS
+            # The view source this click is attributed to
+            return_dict['view_source'] = vs_to_use
+            # policy.is_excluded(vs_to_use, exclusions)
             #     The given view source should not redirect to a
             #     microsite
-            # microsite is None
+            # microsite_url is None
             #     This business unit has no associated microsite
             # skip_microsite:
             #     Prevents microsite loops when the vs= parameter
@@ -254,16 +236,20 @@ def get_redirect_url(request, guid_redirect, vsid, guid, debug_content=None):
             # new_job
             #     This job is new and may not have propagated to
             #     microsites yet; skip microsite redirects
+            exclusions = getattr(request, 'exclusions', None)
+            if exclusions is None:
+                exclusions = exclusion_table.get()
             try_manipulations = (
-                (vs_to_use in settings.EXCLUDED_VIEW_SOURCES or
-                 (guid_redirect.buid, vs_to_use) in settings.CUSTOM_EXCLUSIONS
-                 or microsite is None) or skip_microsite or new_job)
+                (policy.is_excluded(vs_to_use, exclusions)
+                 or microsite_url is None) or skip_microsite or new_job)
             if try_manipulations:
-                manipulations = get_manipulations(guid_redirect,
-                                                  vs_to_use)
-            elif microsite:
+                budgets.set_branch('manipulations')
+                with timing.stage('manipulations'):
+                    pipeline = get_manipulations(guid_redirect, vs_to_use)
+            elif microsite_url:
+                budgets.set_branch('microsite')
                 redirect_url = '%s%s/job/?vs=%s' % \
-                               (microsite.canonical_microsite_url,
+                               (microsite_url,
                                 guid,
                                 vs_to_use)
                 redirect_url = add_view_source_group(redirect_url, vs_to_use)
@@ -278,57 +264,101 @@ def get_redirect_url(request, guid_redirect, vsid, guid, debug_content=None):
 
             return_dict['enable_custom_queries'] = request.REQUEST.get('z') == '1'
             return_dict['qs'] = request.META['QUERY_STRING']
-            do_manipulations(guid_redirect, manipulations,
-                             return_dict, debug_content)
+            with timing.stage('manipulations'):
+                do_manipulations(guid_redirect, pipeline,
+                                 return_dict, debug_content)
 
     return return_dict
 
 
-def get_opengraph_redirect(request, redirect, guid):
-    response = None
-    user_agent_vs = None
-    user_agent = request.META.get('HTTP_USER_AGENT', '').lower()
+def get_destination(request, guid_redirect, vsid, guid, debug_content=None):
+    """
+    Determines the final url for a click on this job, other than for
+    syndication feeds and social media bots
 
-    # open graph bot redirect
-    if 'facebookexternalhit' in user_agent:
-        user_agent_vs = '1593'
+    Inputs:
+    :request: The current request
+    :guid_redirect: Redirect object for the current job
+    :vsid: View source for the current request
+    :guid: GUID cleared of all undesired characters
+    debug_content: List of strings that will be output on the debug page
+
+    Outputs:
+    :return_dict: Dictionary as returned by get_redirect_url, but with
+        redirect_url always set; view_source, when present, is the view
+        source the click is attributed to (the vs= parameter of apply
+        clicks)
 
-    elif 'twitterbot' in user_agent:
-        user_agent_vs = '1596'
+    Modifies:
+    :debug_content: Potentially adds new debug strings
+    """
+    if vsid == '1604':
+        # msccn redirect
+        return_dict = {'redirect_url': (
+            'http://us.jobs/msccn-referral.asp?gi=%s%s&cp=%s' %
+            (guid, vsid, quote_string(guid_redirect.company_name))),
+            'expired': False,
+            'facebook': False}
+    else:
+        return_dict = get_redirect_url(request, guid_redirect, vsid, guid,
+                                       debug_content)
+
+    redirect_url = return_dict['redirect_url']
+    if not redirect_url:
+        redirect_url = guid_redirect.url
+        if debug_content is not None:
+            debug_content.append(
+                'ManipulatedLink(No Manipulation)=%s' % redirect_url)
+        if request.REQUEST.get('z') == '1':
+            redirect_url = add_custom_queries(request, redirect_url,
+                                              debug_content, exclude=True)
+    return_dict['redirect_url'] = get_hosted_state_url(guid_redirect,
+                                                       redirect_url)
+    return return_dict
 
-    elif 'linkedinbot' in user_agent:
-        user_agent_vs = '1548'
 
+def get_opengraph_redirect(request, redirect, guid):
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    user_agent_vs = get_bot_view_source(user_agent)
+    response = None
     if user_agent_vs:
-        company_name = redirect.company_name
-        company_name = quote_string(company_name)
-        data = {'title': redirect.job_title,
-                'company': company_name,
-                'guid': guid,
-                'vs': user_agent_vs}
-        if user_agent_vs == '1596':
-            template = 'redirect/twitter.html'
-            solr = pysolr.Solr(settings.SOLR['default'])
-            results = solr.search(q='guid:%s' % guid)
-            if results.hits > 0:
-                doc = results.docs[0]
-
-                # Twitter cards already truncates descriptions to the closest
-                # word under 200 characters
-                data['description'] = doc['description']
-                data['company_raw'] = doc['company_exact']
-            else:
-                data['description'] = '%s in %s' % (redirect.job_title,
-                                                    redirect.job_location)
-                data['company_raw'] = redirect.company_name
-        else:
-            template = 'redirect/opengraph.html'
-        response = render_to_response(template,
-                                      data,
-                                      context_instance=RequestContext(request))
+        response = HttpResponse(card_cache.get(redirect, guid, user_agent_vs))
     return user_agent_vs, response
 
 
+def get_expired_page(job, expired_url, browse_url, view_source):
+    """
+    Renders the page shown for expired jobs
+
+    Pages are kept in the shared cache per guid and browse url for
+    EXPIRED_PAGE_CACHE_TIMEOUT seconds; only the view source is filled in
+    on each request.
+
+    Inputs:
+    :job: Redirect or RedirectArchive instance for the expired job
+    :expired_url: Url the job used to redirect to
+    :browse_url: Url of the company's other jobs
+    :view_source: View source of this request
+
+    Outputs:
+    :body: Rendered page
+    """
+    key = 'expired_page:%s' % hashlib.md5(
+        (u'%s %s' % (job.guid, browse_url)).encode('utf-8')).hexdigest()
+    with timing.stage('cache'):
+        parts = cache.get(key)
+    if parts is None:
+        data = {'job': job,
+                'expired_url': expired_url,
+                'browse_url': browse_url,
+                'view_source': EXPIRED_VIEW_SOURCE_MARKER}
+        parts = render_to_string('redirect/expired.html', data).split(
+            EXPIRED_VIEW_SOURCE_MARKER)
+        with timing.stage('cache'):
+            cache.set(key, parts, settings.EXPIRED_PAGE_CACHE_TIMEOUT)
+    return escape(view_source).join(parts)
+
+
 def replace_or_add_query(url, query, exclusions=None):
     """
     Adds field/value pair to the provided url as a query string if the
@@ -345,50 +375,7 @@ def replace_or_add_query(url, query, exclusions=None):
     Outputs:
     :url: Input url with query string appended
     """
-    if not exclusions:
-        exclusions = []
-    if len(query) > 1 and query[0] in ['?', '&']:
-        query = query[1:]
-        query = query.encode('utf-8')
-        url = url.encode('utf-8')
-        url = urlparse.urlparse(url)
-        old_query = urlparse.parse_qsl(url.query, keep_blank_values=True)
-        old_keys = [q[0] for q in old_query]
-        # make a lower-case copy of old_keys so we can do some comparisons
-        insensitive_keys = map(str.lower, old_keys)
-
-        new_query = urlparse.parse_qsl(query, keep_blank_values=True)
-
-        # For each source code that we are going to add
-        for new_index in range(len(new_query)):
-            # Make sure we are not adding a source code that should be excluded
-            if new_query[new_index][0] not in exclusions:
-                try:
-                    # Case-insensitively determine if the new source code
-                    # is already applied
-                    old_index = insensitive_keys.index(
-                        new_query[new_index][0].lower())
-                except ValueError:
-                    # The current source code is not applied; apply it
-                    old_query.append(new_query[new_index])
-                else:
-                    # The current source code is already applied; replace its
-                    # value, keeping the case of the old parameter
-                    old_query[old_index] = (old_query[old_index][0],
-                                            new_query[new_index][1])
-
-        # parse_qsl unencodes the query that you pass it; Re-encode the query
-        # parameters when reconstructing the string.
-        old_query = '&'.join(['='.join([urllib.quote(k, safe=','),
-                                        urllib.quote(v, safe=',')])
-                             for k, v in old_query])
-        url = url._replace(query=old_query)
-        url = urlparse.urlunparse(url)
-    else:
-        parts = url.split('#')
-        parts[0] += query
-        url = '#'.join(parts)
-    return url
+    return merge_query(url, [get_merge(query, exclusions)])
 
 
 def get_hosted_state_url(redirect, url):
@@ -509,7 +496,7 @@ def add_part(body, part, value, join_str):
     return body
 
 
-def log_failure(post, subject):
+def log_failure(post, subject, connection=None):
     """
     Logs failures in redirecting job@my.jobs emails. This does not mean literal
     failure, but the email in question is not a guid@my.jobs email and should
@@ -517,15 +504,17 @@ def log_failure(post, subject):
 
     Inputs:
     :post: copy of request.POST QueryDict
+    :connection: Mail connection to send with, if a new one should not be
+        opened
     """
 
     if settings.DEBUG or hasattr(mail, 'outbox'):
         jira = []
     else:
         try:
-            jira = JIRA(options=settings.JIRA_OPTIONS,
-                        basic_auth=settings.JIRA_AUTH)
-        except JIRAError:
+            jira = jira_client.JIRA(options=settings.JIRA_OPTIONS,
+                                    basic_auth=settings.JIRA_AUTH)
+        except jira_exceptions.JIRAError:
             jira = []
 
     # Pop from and headers from the post dict; from is used in a few places
@@ -566,7 +555,8 @@ def log_failure(post, subject):
             subject=subject,
             body=body,
             from_email=from_,
-            to=[settings.EMAIL_TO_ADMIN])
+            to=[settings.EMAIL_TO_ADMIN],
+            connection=connection)
         email.send()
 
 
@@ -578,17 +568,15 @@ def get_job_from_solr(guid):
     :guid: job guid to search for in Solr
 
     Outputs:
-    Job dict or None
+    Job dict (title, description and company_exact) or None
     """
     if len(guid) == 32:
-        solr = pysolr.Solr(settings.SOLR['default'])
-        results = solr.search(q='guid:%s' % guid.upper())
-        if results.hits == 1:
-            return results.docs[0]
+        return job_cache.get_job(guid, unique=True)
     return None
 
 
-def send_response_to_sender(new_to, old_to, email_type, guid='', job=None):
+def send_response_to_sender(new_to, old_to, email_type, guid='', job=None,
+                            connection=None):
     """
     Send response to guid@my.jobs emails
 
@@ -597,13 +585,15 @@ def send_response_to_sender(new_to, old_to, email_type, guid='', job=None):
     :old_to:
     :email_type:
     :guid:
+    :connection: Mail connection to send with, if a new one should not be
+        opened
     """
     if not isinstance(new_to, (list, set)):
         new_to = [new_to]
     if isinstance(old_to, (list, set)):
         old_to = old_to[0]
     email = EmailMessage(from_email=settings.DEFAULT_FROM_EMAIL,
-                         to=new_to)
+                         to=new_to, connection=connection)
     if email_type == 'no_job':
         email.subject = 'Email forward failure'
         email.body = render_to_string('redirect/email/no_job.html',
@@ -652,6 +642,160 @@ def repost_to_mj(post, files):
         r = requests.post(mj_url, data=post, files=new_files)
 
 
+def process_email(post, attachments, connection=None, done=None):
+    """
+    Forwards an email received by the email redirect webhook to the company
+    contact for the job it was sent to, replying to the sender either way
+
+    Inputs:
+    :post: QueryDict of fields posted by SendGrid
+    :attachments: Dictionary mapping attachment field names (attachment1,
+        ...) to (name, content, content type) tuples
+    :connection: Mail connection to send with, if a new one should not be
+        opened for each message
+    :done: Set-like collection of the steps ('log_failure', 'repost',
+        'reply', 'forward', 'log') already done for this email by an earlier
+        attempt; those are skipped, and each step is added once it is done
+
+    Modifies:
+    :done: Adds each step as it finishes
+
+    Outputs:
+    :outcome: String describing how the email was handled; one of
+        'ignored', 'attachment_failure', 'reposted', 'no_job', 'no_contact'
+        or 'forwarded'
+    """
+    if done is None:
+        done = set()
+    try:
+        to_email = post.get('to', None)
+        if to_email and type(to_email) != list:
+            to_email = [to_email]
+        elif not to_email:
+            to_email = []
+        body = post.get('text', '')
+        html_body = post.get('html', '')
+        from_email = post.get('from', '')
+        cc = post.get('cc', None)
+        if cc and type(cc) != list:
+            cc = [cc]
+        elif not cc:
+            cc = []
+        subject = post.get('subject', '')
+        num_attachments = int(post['attachments'])
+    except (KeyError, ValueError):
+        # KeyError: key was not in POST dict
+        # ValueError: num_attachments could not be cast
+        #     to int
+        return 'ignored'
+
+    attachment_data = []
+    for file_number in range(1, num_attachments+1):
+        try:
+            attachment_data.append(attachments['attachment%s' % file_number])
+        except KeyError:
+            # Upload problem?
+            if 'log_failure' not in done:
+                log_failure(post.copy(), 'My.jobs Attachment Failure',
+                            connection=connection)
+                done.add('log_failure')
+            return 'attachment_failure'
+
+    addresses = getaddresses(to_email + cc)
+    addresses = [addr[1].lower() for addr in addresses]
+
+    prm_bcc = False
+    try:
+        # prm@my.jobs appears in the 'envelope' parameter
+        # posted from SendGrid if prm@my.jobs was added
+        # via BCC
+        envelope = json.loads(post.get('envelope', ''))
+    except ValueError:
+        # envelope was not valid JSON or was not provided
+        pass
+    else:
+        if 'prm@my.jobs' in [env_email.lower()
+                             for env_email
+                             in envelope.get('to', [])]:
+            prm_bcc = True
+
+    if prm_bcc or 'prm@my.jobs' in addresses:
+        # post to my.jobs
+        if 'repost' not in done:
+            repost_to_mj(post.copy(), attachment_data)
+            done.add('repost')
+        return 'reposted'
+    if len(addresses) != 1:
+        # >1 recipients
+        # or 0 recipients (everyone is bcc)
+        # Probably not a guid@my.jobs email
+        return 'ignored'
+    hex_guid = addresses[0].split('@')[0]
+
+    # shouldn't happen, but if someone somehow sends an
+    # email with a view source attached, we should
+    # remove it
+    hex_guid = hex_guid[:32]
+
+    email_dict = {'new_to': from_email,
+                  'old_to': to_email,
+                  'guid': hex_guid,
+                  'connection': connection}
+
+    try:
+        to_guid = '{%s}' % uuid.UUID(hex_guid)
+        job = guid_resolver.resolve(to_guid)
+    except ValueError:
+        # Not a guid
+        return 'ignored'
+    except ObjectDoesNotExist:
+        if 'reply' not in done:
+            email_dict['email_type'] = 'no_job'
+            send_response_to_sender(**email_dict)
+            done.add('reply')
+        return 'no_job'
+
+    email_dict['job'] = job
+
+    new_to = policy_table.get_policy(job.buid).contact_email
+    if not new_to:
+        if 'reply' not in done:
+            email_dict['email_type'] = 'no_contact'
+            send_response_to_sender(**email_dict)
+            done.add('reply')
+        return 'no_contact'
+
+    if 'reply' not in done:
+        email_dict['email_type'] = 'contact'
+        send_response_to_sender(**email_dict)
+        done.add('reply')
+
+    sg_headers = {
+        'X-SMTPAPI': '{"category": "My.jobs email redirect"}'
+    }
+
+    # We reached this point; the data should be good
+    if 'forward' not in done:
+        email = EmailMultiAlternatives(
+            to=[new_to], from_email=from_email, subject=subject,
+            body=body, cc=cc, headers=sg_headers, connection=connection)
+        email.attach_alternative(html_body, 'text/html')
+        for attachment in attachment_data:
+            email.attach(*attachment)
+        email.send()
+        done.add('forward')
+
+    if 'log' not in done:
+        log = {'from_addr': from_email,
+               'to_guid': to_guid,
+               'buid': job.buid,
+               'to_addr': new_to}
+        EmailRedirectLog.objects.create(**log)
+        done.add('log')
+
+    return 'forwarded'
+
+
 def is_authorized(request):
     if request.method == 'POST':
         if 'HTTP_AUTHORIZATION' in request.META:
@@ -660,11 +804,7 @@ def is_authorized(request):
                 login_info = base64.b64decode(details).split(':')
                 if len(login_info) == 2:
                     login_info[0] = urllib2.unquote(login_info[0])
-                    user = authenticate(username=login_info[0],
-                                        password=login_info[1])
-                    target = User.objects.get(email='accounts@my.jobs')
-                    if user is not None and user == target:
-                        return True
+                    return credential_cache.verify(*login_info)
     return False
 
 
@@ -747,8 +887,8 @@ def add_custom_queries(request, url, debug_content=None,
     return redirect_url
 
 
-def get_redirect_or_404(*args, **kwargs):
+def get_redirect_or_404(guid):
     try:
-        return Redirect.objects.get_any(*args, **kwargs)
+        return guid_resolver.resolve(guid)
     except(ObjectDoesNotExist, MultipleObjectsReturned):
-        raise Http404
\ No newline at end of file
+        raise Http404
@@ -0,0 +1,170 @@
+"""
+Measures what each module costs a new worker process to import.
+
+ImportProfiler wraps __import__ and times every import that loads a module
+for the first time, both including and excluding the imports it triggers
+in turn. Run as a script, this module profiles starting a redirect worker
+(see load_worker) in a fresh interpreter and prints the results as JSON;
+the profile_imports command does that and reports the most expensive
+modules.
+"""
+import __builtin__
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# Libraries that only rare code paths use (see redirect.lazy); a worker
+# should be able to start without importing any of them
+DEFERRED_LIBRARIES = ['jira', 'markdown', 'pysolr', 'requests', 'xlrd']
+
+
+class ImportProfiler(object):
+    """
+    Records the time taken by imports that load new modules
+
+    :times: Dictionary of module name -> [inclusive seconds, self seconds],
+        where self seconds leave out nested imports that loaded modules
+    """
+    def __init__(self):
+        self.times = {}
+        self._stack = []
+        self._import = None
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self.profile_import
+
+    def uninstall(self):
+        __builtin__.__import__ = self._import
+
+    def profile_import(self, name, globals=None, locals=None, fromlist=None,
+                       level=-1):
+        names = [candidate for candidate in get_names(name, globals)
+                 if sys.modules.get(candidate) is None]
+        # Time spent in nested imports, taken out of this one's self time
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            seconds = time.time() - start
+            nested = self._stack.pop()
+            loaded = [candidate for candidate in names
+                      if sys.modules.get(candidate) is not None]
+            if loaded:
+                self.times.setdefault(loaded[0],
+                                      [seconds, seconds - nested])
+                if self._stack:
+                    self._stack[-1] += seconds
+
+
+def get_names(name, globals):
+    """
+    Outputs:
+    :names: Names the module imported as :name: may be found under; Python
+        2 tries implicit relative imports inside the importing package first
+    """
+    names = [name]
+    if globals:
+        package = globals.get('__package__') or \
+            globals.get('__name__', '').rpartition('.')[0]
+        if package:
+            names.insert(0, '%s.%s' % (package, name))
+    return names
+
+
+def load_worker():
+    """
+    Does what a new redirect worker does before it can serve a click:
+    loads settings, both WSGI handlers' middleware and the urlconf
+    """
+    from django.conf import settings
+    from django.core import urlresolvers
+
+    from redirect.handlers import RedirectDispatcher
+
+    settings.INSTALLED_APPS
+    dispatcher = RedirectDispatcher()
+    dispatcher.redirect_handler.load_middleware()
+    dispatcher.handler.load_middleware()
+    urlresolvers.get_resolver(None).url_patterns
+
+
+def main(modules):
+    """
+    Profiles importing :modules:, or load_worker() if there are none, and
+    writes the results to stdout as JSON
+    """
+    profiler = ImportProfiler()
+    start = time.time()
+    profiler.install()
+    try:
+        if modules:
+            for module in modules:
+                __import__(module)
+        else:
+            load_worker()
+    finally:
+        profiler.uninstall()
+    json.dump({'total': time.time() - start, 'modules': profiler.times,
+               'loaded': sorted(name for name, module in sys.modules.items()
+                                if module is not None)},
+              sys.stdout)
+
+
+def profile(modules=None):
+    """
+    Runs main() in a new interpreter so that nothing is imported already
+
+    Inputs:
+    :modules: Module names to import instead of starting a worker
+
+    Outputs:
+    :results: Dictionary of total seconds, module name -> [inclusive
+        seconds, self seconds] for each module loaded, and the names of all
+        loaded modules
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'redirect.importprofile'] + list(modules or []),
+        stdout=subprocess.PIPE, env=env)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError('Profiling imports failed with status %s' %
+                           process.returncode)
+    return json.loads(output)
+
+
+def get_deferred(results):
+    """
+    Outputs:
+    :libraries: Libraries from DEFERRED_LIBRARIES that were imported anyway
+    """
+    loaded = set(name.split('.', 1)[0] for name in results['loaded'])
+    return [name for name in DEFERRED_LIBRARIES if name in loaded]
+
+
+def format_profile(results, limit=25, key='inclusive'):
+    """
+    Outputs:
+    :report: Text table of the :limit: modules costing the most, sorted by
+        inclusive or self time
+    """
+    index = 0 if key == 'inclusive' else 1
+    modules = sorted(results['modules'].items(),
+                     key=lambda item: item[1][index], reverse=True)
+    lines = ['Imported %d modules in %.1fms' % (
+                 len(results['modules']), results['total'] * 1000),
+             '%-50s %12s %12s' % ('module', 'inclusive ms', 'self ms')]
+    for name, (inclusive, own) in modules[:limit]:
+        lines.append('%-50s %12.2f %12.2f' % (name, inclusive * 1000,
+                                              own * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
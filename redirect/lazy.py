@@ -0,0 +1,52 @@
+"""
+Deferred imports for libraries that only rare code paths need.
+
+Worker processes are recycled every few thousand requests, and each new one
+pays for its imports before it serves a click. Libraries used only when
+forwarding email, rendering cards or uploading source codes are bound to a
+LazyModule instead, which imports the real module on first attribute access:
+
+    requests = LazyModule('requests')
+    ...
+    requests.post(url, data=data)
+
+Anything that patches the library (e.g. testfixtures' Replacer with
+'pysolr.Solr.search') still works, since attributes are always looked up on
+the real module.
+"""
+from importlib import import_module
+import threading
+
+
+class LazyModule(object):
+    """
+    Stands in for a module until one of its attributes is first used
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def load(self):
+        """
+        Outputs:
+        :module: The real module, imported now if it hasn't been
+        """
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    module = import_module(self._name)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __repr__(self):
+        return '<LazyModule %r%s>' % (
+            self._name, '' if self._module is None else ' (loaded)')
@@ -0,0 +1,248 @@
+"""
+Durable on-disk queue for emails received by the email redirect webhook.
+
+The webhook only writes what SendGrid posted to settings.EMAIL_QUEUE_DIR and
+returns; the process_email_queue management command does the slow part
+(Solr lookups, replies, forwarding, reposting) later. Each message is a
+directory holding message.json (the posted fields plus attachment names and
+content types) and one file per attachment. Messages are laid out like a
+maildir:
+
+    tmp/     messages still being written
+    new/     messages waiting to be processed, oldest first by name
+    failed/  messages that raised an error while being processed; requeue()
+             moves them back to new/
+
+Messages are written to tmp/ and renamed into new/, so the worker never sees
+a partial message. A message is only removed from new/ once it has been
+handled, so a crash at any point results in a retry rather than a lost
+email. Each step of helpers.process_email that sends mail or posts
+elsewhere is recorded in the message's progress.json as it finishes, and a
+retry skips the steps already done.
+"""
+from contextlib import contextmanager
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import smtplib
+import socket
+import time
+import uuid
+
+from django.conf import settings
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.http import QueryDict
+
+from redirect import helpers
+
+
+logger = logging.getLogger(__name__)
+
+MESSAGE = 'message.json'
+
+PROGRESS = 'progress.json'
+
+
+def get_dir(name):
+    """
+    Retrieves the path of one of the queue's subdirectories, creating it if
+    needed
+    """
+    if not settings.EMAIL_QUEUE_DIR:
+        raise ImproperlyConfigured('EMAIL_QUEUE_DIR must be set to queue '
+                                   'webhook emails')
+    path = os.path.join(settings.EMAIL_QUEUE_DIR, name)
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+
+def write_json(path, data):
+    """
+    Writes :data: to :path: as JSON, replacing any existing file atomically
+    """
+    temp_path = '%s.tmp' % path
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temp_path, path)
+
+
+def enqueue(post, files):
+    """
+    Stores an email posted to the webhook for later processing
+
+    Inputs:
+    :post: request.POST QueryDict
+    :files: request.FILES MultiValueDict
+
+    Outputs:
+    :path: Location of the queued message
+    """
+    # Names sort by arrival time; the uuid keeps them unique across
+    # processes
+    name = '%.6f-%s' % (time.time(), uuid.uuid4().hex)
+    temp_path = os.path.join(get_dir('tmp'), name)
+    os.mkdir(temp_path)
+    attachments = {}
+    for index, (key, file_) in enumerate(sorted(files.items())):
+        # Field names come from the sender, so they don't name the files
+        filename = 'attachment-%d' % index
+        with open(os.path.join(temp_path, filename), 'wb') as f:
+            for chunk in file_.chunks():
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        attachments[key] = {'name': file_.name,
+                            'content_type': file_.content_type,
+                            'file': filename}
+    write_json(os.path.join(temp_path, MESSAGE),
+               {'post': dict(post.lists()), 'attachments': attachments})
+    path = os.path.join(get_dir('new'), name)
+    os.rename(temp_path, path)
+    return path
+
+
+def load(path):
+    """
+    Reads a queued message
+
+    Outputs:
+    :post, attachments: Arguments for helpers.process_email
+    """
+    with open(os.path.join(path, MESSAGE)) as f:
+        message = json.load(f)
+    post = QueryDict('', mutable=True)
+    for key, values in message['post'].items():
+        post.setlist(key, values)
+    attachments = {}
+    for key, attachment in message['attachments'].items():
+        with open(os.path.join(path, attachment['file']), 'rb') as f:
+            attachments[key] = (attachment['name'], f.read(),
+                                attachment['content_type'])
+    return post, attachments
+
+
+class Progress(object):
+    """
+    Steps of helpers.process_email already done for one queued message,
+    saved as each one is added
+    """
+    def __init__(self, path):
+        self.path = os.path.join(path, PROGRESS)
+        try:
+            with open(self.path) as f:
+                self.steps = set(json.load(f))
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.steps = set()
+
+    def __contains__(self, step):
+        return step in self.steps
+
+    def add(self, step):
+        self.steps.add(step)
+        write_json(self.path, sorted(self.steps))
+
+
+def get_queued(limit=None):
+    """
+    Lists paths of waiting messages, oldest first
+    """
+    directory = get_dir('new')
+    names = sorted(os.listdir(directory))
+    if limit:
+        names = names[:limit]
+    return [os.path.join(directory, name) for name in names]
+
+
+def requeue():
+    """
+    Moves every failed message back to the queue; steps they had finished
+    are still skipped
+
+    Outputs:
+    :count: Number of messages requeued
+    """
+    failed = get_dir('failed')
+    names = sorted(os.listdir(failed))
+    for name in names:
+        os.rename(os.path.join(failed, name),
+                  os.path.join(get_dir('new'), name))
+    return len(names)
+
+
+@contextmanager
+def worker_lock():
+    """
+    Ensures only one worker processes the queue at a time
+
+    Outputs:
+    :locked: True if this process holds the lock, False if another worker
+        already does
+    """
+    with open(os.path.join(get_dir('tmp'), '.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            yield False
+        else:
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def process_queue(limit=None):
+    """
+    Handles waiting messages, sending all resulting mail over a single
+    connection
+
+    Stops at the first error talking to the mail server (raising it),
+    leaving that message queued.
+
+    Inputs:
+    :limit: Maximum number of messages to handle; default: all of them
+
+    Outputs:
+    :stats: Dictionary mapping each outcome returned by
+        helpers.process_email (plus 'failed') to the number of messages
+        with that outcome
+    """
+    stats = {}
+    paths = get_queued(limit)
+    if not paths:
+        return stats
+
+    connection = mail.get_connection()
+    connection.open()
+    try:
+        for path in paths:
+            try:
+                outcome = helpers.process_email(*load(path),
+                                                connection=connection,
+                                                done=Progress(path))
+            except (smtplib.SMTPException, socket.error):
+                # The mail server is the problem, not the message; leave it
+                # and everything after it for the next run
+                raise
+            except Exception:
+                logger.exception('Could not process queued email %s', path)
+                outcome = 'failed'
+                os.rename(path, os.path.join(get_dir('failed'),
+                                             os.path.basename(path)))
+            else:
+                shutil.rmtree(path)
+            stats[outcome] = stats.get(outcome, 0) + 1
+    finally:
+        connection.close()
+    return stats
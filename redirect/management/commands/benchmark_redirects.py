@@ -0,0 +1,89 @@
+import json
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from south.management.commands import patch_for_test_db_setup
+
+from redirect.tests import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Times the redirect view for each kind of request against a '
+            'test database filled with synthetic jobs')
+    option_list = BaseCommand.option_list + (
+        make_option('--redirects', type='int', dest='redirects',
+                    default=1000000, help='Number of redirects to create'),
+        make_option('--archived', type='int', dest='archived',
+                    default=100000,
+                    help='Number of archived redirects to create'),
+        make_option('--buids', type='int', dest='buids', default=2000,
+                    help='Number of business units to spread jobs over'),
+        make_option('--iterations', type='int', dest='iterations',
+                    default=200, help='Requests to time per branch'),
+        make_option('--baseline', dest='baseline',
+                    help='JSON file of earlier results to compare against'),
+        make_option('--margin', type='float', dest='margin', default=0.25,
+                    help='Fraction by which latencies may exceed the '
+                         'baseline'),
+        make_option('--save-baseline', dest='save_baseline',
+                    help='Write these results to a JSON file'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        setup_test_environment()
+        # Build the test databases the way manage.py test does
+        patch_for_test_db_setup()
+        runner = DiscoverRunner(verbosity=verbosity, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            start = time.time()
+            dataset = benchmarks.build_dataset(
+                redirects=options['redirects'],
+                archived=options['archived'], buids=options['buids'])
+            if verbosity > 0:
+                self.stdout.write('Created test data in %.1fs' % (
+                    time.time() - start))
+            results = benchmarks.run_benchmark(dataset,
+                                               options['iterations'])
+            results.update(benchmarks.time_handlers(dataset,
+                                                    options['iterations']))
+            results.update(benchmarks.time_query_merges(
+                options['iterations']))
+            results.update(benchmarks.time_authorization(
+                options['iterations']))
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        if verbosity > 0:
+            self.stdout.write(benchmarks.format_results(results))
+            self.stdout.write(
+                'Redirect handler saves %.2fms per click at p50' % (
+                    results['handler_full']['p50'] -
+                    results['handler_fast']['p50']))
+            if results['querystring_new']['p50']:
+                self.stdout.write(
+                    'Query merging is %.1fx as fast as before at p50' % (
+                        results['querystring_old']['p50'] /
+                        results['querystring_new']['p50']))
+            if results['authorization_new']['p50']:
+                self.stdout.write(
+                    'Authorization is %.1fx as fast as before at p50' % (
+                        results['authorization_old']['p50'] /
+                        results['authorization_new']['p50']))
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            failures = benchmarks.compare(results, baseline,
+                                          options['margin'])
+            if failures:
+                raise CommandError('Baseline exceeded:\n%s' %
+                                   '\n'.join(failures))
@@ -0,0 +1,20 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from redirect import clickcounts
+
+
+class Command(BaseCommand):
+    help = ('Merges hourly click counts from before today (UTC) into daily '
+            'totals')
+    option_list = BaseCommand.option_list + (
+        make_option('--keep-days', type='int', dest='keep_days', default=0,
+                    help='Number of days before today to leave hourly'),
+    )
+
+    def handle(self, *args, **options):
+        before = clickcounts.get_merge_cutoff(options['keep_days'])
+        hours, days = clickcounts.merge_days(before)
+        self.stdout.write('Merged %d hourly counts from before %s into %d '
+                          'daily counts' % (hours, before.isoformat(), days))
@@ -0,0 +1,70 @@
+import logging
+from optparse import make_option
+import smtplib
+import socket
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from redirect import mail_queue
+
+
+logger = logging.getLogger('redirect.mail_queue')
+
+# Longest wait, in seconds, between attempts while the mail server is down
+MAX_BACKOFF = 300
+
+
+class Command(BaseCommand):
+    help = 'Forwards emails queued by the email redirect webhook'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=100,
+                    help='Number of emails to send per SMTP connection'),
+        make_option('--poll', type='float', dest='poll',
+                    help='Keep running, checking for new emails this '
+                         'many seconds after the queue empties'),
+        make_option('--requeue', action='store_true', dest='requeue',
+                    default=False,
+                    help='Move emails that failed back into the queue '
+                         'first'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        with mail_queue.worker_lock() as locked:
+            if not locked:
+                if verbosity > 0:
+                    self.stdout.write('Another worker is processing the queue')
+                return
+            if options['requeue']:
+                count = mail_queue.requeue()
+                if verbosity > 0:
+                    self.stdout.write('Requeued %d failed emails' % count)
+            backoff = None
+            while True:
+                start = time.time()
+                try:
+                    stats = mail_queue.process_queue(options['batch_size'])
+                except (smtplib.SMTPException, socket.error) as e:
+                    if options['poll'] is None:
+                        raise CommandError('Could not send mail: %s' % e)
+                    # Keep the worker alive through mail server outages,
+                    # trying less often the longer one lasts
+                    backoff = min((backoff or options['poll'] or 1) * 2,
+                                  MAX_BACKOFF)
+                    logger.exception('Could not send mail; retrying in %ds',
+                                     backoff)
+                    time.sleep(backoff)
+                    continue
+                backoff = None
+                if stats and verbosity > 0:
+                    self.stdout.write('Processed %d emails in %.1fs: %s' % (
+                        sum(stats.values()), time.time() - start,
+                        ', '.join('%s=%s' % item
+                                  for item in sorted(stats.items()))))
+                if sum(stats.values()) < options['batch_size']:
+                    # The queue is empty
+                    if options['poll'] is None:
+                        break
+                    time.sleep(options['poll'])
@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from redirect import importprofile
+
+
+class Command(BaseCommand):
+    args = '[<module> ...]'
+    help = ('Reports what each module costs a new redirect worker to import, '
+            'or what importing the given modules costs')
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', type='int', dest='limit', default=25,
+                    help='Number of modules to list'),
+        make_option('--sort', dest='sort', default='inclusive',
+                    choices=['inclusive', 'self'],
+                    help='Sort by time including or excluding nested '
+                         'imports'),
+        make_option('--target', type='float', dest='target',
+                    help='Fail if importing takes more milliseconds than '
+                         'this'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            results = importprofile.profile(args)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(importprofile.format_profile(
+            results, options['limit'], options['sort']))
+
+        failures = []
+        deferred = importprofile.get_deferred(results)
+        if deferred and not args:
+            failures.append('Deferred libraries were imported: %s' %
+                            ', '.join(deferred))
+        milliseconds = results['total'] * 1000
+        if options['target'] is not None and milliseconds > options['target']:
+            failures.append('Imports took %.1fms, over the %.1fms target' % (
+                milliseconds, options['target']))
+        if failures:
+            raise CommandError('\n'.join(failures))
@@ -0,0 +1,38 @@
+from datetime import timedelta
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from redirect.cards import BOT_VIEW_SOURCES, card_cache
+from redirect.helpers import clean_guid
+from redirect.models import Redirect
+
+
+class Command(BaseCommand):
+    help = ('Renders OpenGraph and Twitter cards for new jobs ahead of the '
+            'first bot fetch')
+    option_list = BaseCommand.option_list + (
+        make_option('--hours', type='float', dest='hours', default=24,
+                    help='Render cards for jobs added in the last this many '
+                         'hours'),
+    )
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        redirects = Redirect.objects.filter(
+            new_date__gte=since, expired_date__isnull=True).only(
+            'guid', 'job_title', 'job_location', 'company_name')
+
+        start = time.time()
+        jobs = 0
+        for redirect in redirects.iterator():
+            guid = clean_guid(redirect.guid).upper()
+            for _, view_source in BOT_VIEW_SOURCES:
+                card_cache.render(redirect, guid, view_source)
+            jobs += 1
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Rendered cards for %d jobs in %.1fs' % (
+                jobs, time.time() - start))
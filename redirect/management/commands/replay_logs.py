@@ -0,0 +1,37 @@
+from itertools import islice
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from redirect import replay
+
+
+class Command(BaseCommand):
+    args = '<log file> [<log file> ...]'
+    help = ('Replays clicks from w3c_extended Apache logs against this '
+            'application and compares the results with what was logged')
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=1, help='Number of requests to run at once'),
+        make_option('--limit', type='int', dest='limit',
+                    help='Stop after replaying this many clicks'),
+        make_option('--examples', type='int', dest='examples', default=20,
+                    help='Number of differences to list'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Give at least one log file to replay')
+        skipped = {}
+        clicks = replay.read_clicks(args, skipped)
+        if options['limit'] is not None:
+            clicks = islice(clicks, options['limit'])
+        report = replay.replay(
+            clicks, concurrency=options['concurrency'],
+            report=replay.Report(max_examples=options['examples']),
+            logger=logging.getLogger('redirect.replay'))
+        self.stdout.write(report.format())
+        if skipped:
+            self.stdout.write('Skipped: %s' % ', '.join(
+                '%s=%s' % item for item in sorted(skipped.items())))
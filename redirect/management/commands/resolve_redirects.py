@@ -0,0 +1,34 @@
+import fileinput
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from redirect import batch
+
+
+class Command(BaseCommand):
+    args = '[<pairs file> ...]'
+    help = ('Resolves the final destination of each (guid, view source) '
+            'pair in JSON lines files, or standard input, and writes one '
+            'JSON line per pair')
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output',
+                    help='File to write; default: standard output'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=batch.BATCH_SIZE,
+                    help='Pairs to look up at once'),
+    )
+
+    def handle(self, *args, **options):
+        lines = fileinput.input(args or ['-'])
+        results = batch.format_results(batch.resolve(
+            batch.parse_pairs(lines), options['batch_size']))
+        try:
+            if options['output']:
+                with open(options['output'], 'w') as f:
+                    f.writelines(results)
+            else:
+                for line in results:
+                    self.stdout.write(line, ending='')
+        finally:
+            lines.close()
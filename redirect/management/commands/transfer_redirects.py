@@ -1,3 +1,5 @@
+from optparse import make_option
+
 from django.core.mail import send_mail
 from django.core.management.base import BaseCommand
 from django.db import Error
@@ -7,10 +9,18 @@ from redirect.tasks import expired_to_archive_table
 
 class Command(BaseCommand):
     help = 'Moves expired jobs from Redirect to RedirectArchive'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+                    help='Number of redirects to move at a time'),
+        make_option('--rate', type='int', dest='rows_per_second',
+                    help='Maximum number of redirects to move per second'),
+    )
 
     def handle(self, *args, **options):
         try:
-            expired_to_archive_table()
+            stats = expired_to_archive_table(
+                batch_size=options.get('batch_size'),
+                rows_per_second=options.get('rows_per_second'))
         except Error, e:
             # Error is the parent to all of Django's database-related
             # exceptions.
@@ -19,3 +29,8 @@ class Command(BaseCommand):
                       'monitoring@my.jobs',
                       ['aws@directemployers.org'],
                       fail_silently=False)
+        else:
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write(
+                    'Moved %(rows)d redirects in %(batches)d batches '
+                    '(%(seconds).1fs, %(rows_per_second).1f/s)' % stats)
@@ -0,0 +1,31 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from redirect import replay, warmup
+
+
+class Command(BaseCommand):
+    args = '<log file> [<log file> ...]'
+    help = ('Lists the most clicked GUIDs in w3c_extended Apache logs, for '
+            'workers to preload (see settings.WARMUP_HOT_GUIDS_FILE)')
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', type='int', dest='limit',
+                    default=settings.WARMUP_HOT_GUIDS,
+                    help='Number of GUIDs to list'),
+        make_option('--output', dest='output',
+                    help='File to write; default: standard output'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Give at least one log file to read')
+        guids = warmup.count_hot_guids(replay.read_clicks(args),
+                                       options['limit'])
+        lines = ''.join('%s %d\n' % item for item in guids)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(lines)
+        else:
+            self.stdout.write(lines, ending='')
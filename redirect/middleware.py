@@ -1,8 +1,16 @@
+import logging
+
 from django.conf import settings
-from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from django.http import HttpResponsePermanentRedirect
+from django.test.utils import CaptureQueriesContext
+
+from redirect import budgets, timing
+from redirect.registry import exclusion_table
+
 
-from redirect.models import ExcludedViewSource, CustomExcludedViewSource
+logger = logging.getLogger(__name__)
 
 
 class MyJobsRedirectMiddleware(object):
@@ -17,28 +25,91 @@ class MyJobsRedirectMiddleware(object):
                 'http://my.jobs' + request.get_full_path())
 
 
+class AllowedHostMiddleware(object):
+    """
+    Rejects requests for hosts missing from settings.ALLOWED_HOSTS, which
+    CommonMiddleware otherwise does; see redirect.handlers
+    """
+    def process_request(self, request):
+        request.get_host()
+
+
 class ExcludedViewSourceMiddleware:
     """
-    Caches excluded view sources (both global and custom) if they are not
-    cached already.
+    Attaches the current set of globally excluded view sources to each
+    request as request.exclusions.
+    """
+    def process_request(self, request):
+        with timing.stage('exclusions'):
+            request.exclusions = exclusion_table.get()
+
+
+class TimingMiddleware(object):
+    """
+    Times the stages of redirect requests (see redirect.timing), adding
+    them to this process's histograms and, if settings.SERVER_TIMING_HEADER
+    is set, to a Server-Timing response header.
+    """
+    def __init__(self):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        timing.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match.url_name not in timing.TIMED_URL_NAMES:
+            timing.stop()
+
+    def process_response(self, request, response):
+        timer = timing.stop()
+        # Requests that never reached a view (e.g. unknown urls) aren't timed
+        if timer is not None and request.resolver_match is not None:
+            timing.histograms.record(timer)
+            if settings.SERVER_TIMING_HEADER:
+                response['Server-Timing'] = timing.get_header(timer)
+        return response
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Holds timed requests to the query and cache budget of the branch they
+    took (see redirect.budgets) when settings.QUERY_BUDGET_CHECK is 'warn'
+    or 'raise'. Must come after TimingMiddleware.
+
+    Queries are counted with CaptureQueriesContext, which turns on the
+    debug cursor for the request, so this is not meant for production.
     """
+    def __init__(self):
+        if not settings.QUERY_BUDGET_CHECK:
+            raise MiddlewareNotUsed
+
     def process_request(self, request):
-        # Globally excluded view sources
-        global_cache_key = settings.EXCLUDED_VIEW_SOURCE_CACHE_KEY
-        excluded = cache.get(global_cache_key)
-        if not excluded:
-            excluded = set(
-                ExcludedViewSource.objects.all().values_list('view_source',
-                                                             flat=True))
-            cache.set(global_cache_key, excluded)
-        settings.EXCLUDED_VIEW_SOURCES = excluded
-
-        # BUID-specific excluded view sources
-        custom_cache_key = settings.CUSTOM_EXCLUSION_CACHE_KEY
-        custom = cache.get(custom_cache_key)
-        if not custom:
-            custom = set(
-                CustomExcludedViewSource.objects.all().values_list('buid',
-                                                                   'view_source'))
-            cache.set(custom_cache_key, custom)
-        settings.CUSTOM_EXCLUSIONS = custom
+        if settings.QUERY_BUDGET_CHECK and timing.current() is not None:
+            request.query_budget_contexts = [
+                CaptureQueriesContext(connection)
+                for connection in connections.all()]
+            for context in request.query_budget_contexts:
+                context.__enter__()
+
+    def process_response(self, request, response):
+        contexts = getattr(request, 'query_budget_contexts', None)
+        if contexts is None:
+            return response
+        for context in contexts:
+            context.__exit__(None, None, None)
+        timer = timing.current()
+        if (timer is None or request.resolver_match is None or
+                timer.get_calls(budgets.REBUILD)):
+            return response
+        branch = timer.branch or request.resolver_match.url_name
+        overruns = budgets.get_overruns(
+            branch, sum(len(context) for context in contexts),
+            timer.get_calls('cache'))
+        if overruns:
+            message = '%s over budget: %s' % (request.path,
+                                              ', '.join(overruns))
+            if settings.QUERY_BUDGET_CHECK == 'raise':
+                raise budgets.BudgetExceeded(message)
+            logger.warning(message)
+        return response
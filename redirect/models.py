@@ -1,9 +1,6 @@
-from django.conf import settings
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.db import models
 from django.db.models.query import QuerySet
-from django.db.models.signals import post_save
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -42,6 +39,9 @@ class DestinationManipulation(models.Model):
             self.buid, self.action_type, self.action, self.view_source)
 
     def get_view_source_name(self):
+        # redirect.registry loads its tables from these models
+        from redirect.registry import exclusion_table
+
         vs = None
         try:
             vs = ViewSource.objects.get(view_source_id=self.view_source)
@@ -55,7 +55,7 @@ class DestinationManipulation(models.Model):
             tag = str(self.view_source)
 
         tag += '<br><span class="float-right">Excluded <img src="/static/admin/img/icon-%s.gif" alt=%s></span>'
-        if self.view_source in settings.EXCLUDED_VIEW_SOURCES:
+        if self.view_source in exclusion_table.get():
             tag %= ('yes', 'True')
         else:
             tag %= ('no', 'False')
@@ -66,6 +66,18 @@ class DestinationManipulation(models.Model):
     get_view_source_name.admin_order_field = 'view_source'
 
 
+def get_redirect_models():
+    """
+    Lists every concrete BaseRedirect subclass, with Redirect first.
+
+    """
+    subclasses = BaseRedirect.__subclasses__()
+    # We always want to check the Redirect table first, so make
+    # sure it's first in the list.
+    subclasses.insert(0, subclasses.pop(subclasses.index(Redirect)))
+    return subclasses
+
+
 class RedirectMixin(object):
     def get_any(self, *args, **kwargs):
         """
@@ -73,11 +85,7 @@ class RedirectMixin(object):
         from the first table with a match.
 
         """
-        subclasses = BaseRedirect.__subclasses__()
-        # We always want to check the Redirect table first, so make
-        # sure it's first in the list.
-        subclasses.insert(0, subclasses.pop(subclasses.index(Redirect)))
-        for model in subclasses:
+        for model in get_redirect_models():
             try:
                 return model.objects.get(*args, **kwargs)
             except model.DoesNotExist:
@@ -252,8 +260,10 @@ class ViewSource(models.Model):
         super(ViewSource, self).save(*args, **kwargs)
 
     def is_excluded(self):
+        from redirect.registry import exclusion_table
+
         tag = '<img src="/static/admin/img/icon-%s.gif" alt=%s>'
-        if self.view_source_id in settings.EXCLUDED_VIEW_SOURCES:
+        if self.view_source_id in exclusion_table.get():
             tag %= ('yes', 'True')
         else:
             tag %= ('no', 'False')
@@ -299,16 +309,6 @@ class ExcludedViewSource(models.Model):
     get_vs_cell.allow_tags = True
 
 
-def clear_vs_cache(sender, instance, created, **kwargs):
-    cache_key = settings.EXCLUDED_VIEW_SOURCE_CACHE_KEY
-    cache.delete(cache_key)
-
-
-# Clears excluded view source cache when an instance is saved
-post_save.connect(clear_vs_cache, sender=ExcludedViewSource,
-                  dispatch_uid="clear_vs_cache")
-
-
 class CustomExcludedViewSource(models.Model):
     """
     Some companies want a given view source to not redirect to their microsite
@@ -336,16 +336,6 @@ class CustomExcludedViewSource(models.Model):
     get_vs_name.short_description = 'view source'
 
 
-def clear_custom_vs_cache(sender, instance, created, **kwargs):
-    cache_key = settings.CUSTOM_EXCLUSION_CACHE_KEY
-    cache.delete(cache_key)
-
-
-# Clears excluded view source cache when an instance is saved
-post_save.connect(clear_custom_vs_cache, sender=CustomExcludedViewSource,
-                  dispatch_uid="clear_custom_vs_cache")
-
-
 class CompanyEmail(models.Model):
     buid = models.IntegerField(primary_key=True)
     email = models.EmailField()
@@ -360,3 +350,30 @@ class EmailRedirectLog(models.Model):
     buid = models.IntegerField()
     to_addr = models.EmailField()
     sent = models.DateTimeField(auto_now_add=True)
+
+
+class ClickRollup(models.Model):
+    """
+    Number of clicks on one business unit's jobs from one view source in an
+    hour or a day (UTC). Workers add hourly counts (see redirect.clickcounts)
+    and the merge_click_rollups command folds past hours into days.
+    """
+    HOUR, DAY = 'hour', 'day'
+    PERIOD_CHOICES = ((HOUR, _('Hour')), (DAY, _('Day')))
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES,
+                              default=HOUR)
+    start = models.DateTimeField(help_text=_('Start of the hour or day'))
+    buid = models.IntegerField(help_text=_('Business unit ID of the jobs '
+                                           'clicked'))
+    view_source = models.IntegerField()
+    clicks = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('period', 'start', 'buid', 'view_source')
+        index_together = [['buid', 'view_source']]
+
+    def __unicode__(self):
+        return u'%d clicks for buid %d, view source %d in the %s from %s' % (
+            self.clicks, self.buid, self.view_source, self.period,
+            self.start)
@@ -0,0 +1,258 @@
+"""
+Compiles chains of destination manipulations into pipelines that run over
+plain url strings.
+
+The functions in redirect.actions take Redirect and DestinationManipulation
+instances and re-parse their values on every call. A Pipeline resolves each
+action and parses its values once, when the manipulation table is built,
+leaving a single url -> url callable per step.
+"""
+from collections import namedtuple
+import inspect
+
+import redirect.actions
+import redirect.helpers
+from redirect.querystring import QueryMerge, get_merge, merge_query
+
+
+# These actions all result in our final url being appended, usually as a
+# query string, to a value determined by the manipulation object; due to
+# this, any custom query parameters are added before doing the manipulation.
+WRAP_ACTIONS = frozenset(['doubleclickwrap', 'replacethenaddpre',
+                          'sourceurlwrap', 'sourceurlwrapappend',
+                          'sourceurlwrapunencoded',
+                          'sourceurlwrapunencodedappend'])
+
+CUSTOM_QUERY_EXCLUSIONS = ['vs', 'z']
+
+CFRAME_URL = 'http://directemployers.us.jobs/companyframe/'
+
+
+Step = namedtuple('Step', ['function', 'queries_before', 'queries_after',
+                           'manipulation'])
+
+
+# Stand-in for a Redirect instance when falling back to redirect.actions
+RedirectUrl = namedtuple('RedirectUrl', ['url'])
+
+
+def _unchanged(url):
+    return url
+
+
+def _split_values(value):
+    old, new = value.split('!!!!')
+    return old, new
+
+
+def compile_sourcecodetag(manipulation):
+    query = manipulation.value_1
+    if query and query.find('=') > 0:
+        return QueryMerge(query)
+    return _unchanged
+
+
+def compile_doubleclickwrap(manipulation):
+    prefix = manipulation.value_1
+    return lambda url: prefix + url
+
+
+def compile_doubleclickunwind(manipulation):
+    return lambda url: url.rpartition('?')[2]
+
+
+def compile_anchorredirectissue(manipulation):
+    value = manipulation.value_1
+    return lambda url: url.partition('#')[0] + value
+
+
+def compile_sourcecodeswitch(manipulation):
+    old, new = manipulation.value_1, manipulation.value_2
+    return lambda url: url.replace(old, new)
+
+
+compile_fixurl = compile_sourcecodeswitch
+
+
+def compile_sourcecodeinsertion(manipulation):
+    anchor = '%s#' % manipulation.value_1
+    return lambda url: url.replace('#', anchor)
+
+
+def compile_sourceurlwrap(manipulation):
+    prefix = manipulation.value_1
+    return lambda url: prefix + redirect.helpers.quote_string(url)
+
+
+def compile_sourceurlwrapappend(manipulation):
+    prefix, suffix = manipulation.value_1, manipulation.value_2
+    return lambda url: prefix + redirect.helpers.quote_string(url) + suffix
+
+
+def compile_sourceurlwrapunencoded(manipulation):
+    prefix = manipulation.value_1
+    return lambda url: prefix + url
+
+
+def compile_sourceurlwrapunencodedappend(manipulation):
+    prefix, suffix = manipulation.value_1, manipulation.value_2
+    return lambda url: prefix + url + suffix
+
+
+def compile_urlswap(manipulation):
+    new_url = manipulation.value_1
+    return lambda url: new_url
+
+
+def compile_amptoamp(manipulation):
+    prefix, suffix = manipulation.value_1, manipulation.value_2
+    return lambda url: prefix + url.split('&')[1] + suffix
+
+
+def _switchlast(old, new, suffix=''):
+    return lambda url: new.join(url.rsplit(old, 1)) + suffix
+
+
+def compile_switchlastinstance(manipulation):
+    return _switchlast(manipulation.value_1, manipulation.value_2)
+
+
+def compile_switchlastthenadd(manipulation):
+    old, new = _split_values(manipulation.value_1)
+    # switchlastinstance treats blank values as "use the stored values"
+    return _switchlast(old or manipulation.value_1,
+                       new or manipulation.value_2,
+                       manipulation.value_2)
+
+
+def compile_replace(manipulation):
+    old, new = _split_values(manipulation.value_1)
+    return lambda url: url.replace(old, new)
+
+
+def compile_replacethenadd(manipulation):
+    old, new = _split_values(manipulation.value_1)
+    merge = QueryMerge(manipulation.value_2)
+    return lambda url: merge(url.replace(old, new))
+
+
+def compile_replacethenaddpre(manipulation):
+    old, new = _split_values(manipulation.value_1)
+    prefix = manipulation.value_2
+    return lambda url: prefix + url.replace(old, new)
+
+
+def compile_cframe(manipulation):
+    prefix = CFRAME_URL + '%s?url=' % manipulation.value_1
+    return lambda url: prefix + redirect.helpers.quote_string(url)
+
+
+def get_action(name):
+    """
+    Resolves an action name to its function in redirect.actions
+
+    Outputs:
+    :action: Function, or None if :name: doesn't name an action
+    """
+    if not isinstance(name, basestring):
+        return None
+    action = getattr(redirect.actions, name, None)
+    if (inspect.isfunction(action) and
+            action.__module__ == redirect.actions.__name__):
+        return action
+    return None
+
+
+def compile_action(manipulation):
+    """
+    Turns one manipulation into a function that takes and returns a url
+
+    Actions without a compiler here, and manipulations whose values can't be
+    parsed ahead of time, defer to redirect.actions so that any error
+    happens on the click that uses them, just as it always has.
+
+    Outputs:
+    :function: url -> url callable, or None if the action is unknown
+    """
+    action = get_action(manipulation.action)
+    if action is None:
+        return None
+    compiler = globals().get('compile_%s' % manipulation.action)
+    if compiler is not None:
+        try:
+            return compiler(manipulation)
+        except ValueError:
+            pass
+    return lambda url: action(RedirectUrl(url), manipulation)
+
+
+class Pipeline(object):
+    """
+    A compiled, ordered chain of manipulations for one buid and view source
+    """
+    def __init__(self, manipulations):
+        self.manipulations = tuple(manipulations)
+        last = len(self.manipulations) - 1
+        steps = []
+        for index, manipulation in enumerate(self.manipulations):
+            wrap = manipulation.action in WRAP_ACTIONS
+            steps.append(Step(compile_action(manipulation), wrap,
+                              not wrap and index == last, manipulation))
+        self.steps = tuple(steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def run(self, url, custom_query=None, debug_content=None):
+        """
+        Runs :url: through each step of the pipeline
+
+        Inputs:
+        :url: URL to be manipulated
+        :custom_query: Query string (z=1) to merge into the url before wrap
+            actions or after the final action; None disables this
+        :debug_content: List of strings that will be output on the debug page
+
+        Outputs:
+        :url: Manipulated url, or None if no step had a known action
+
+        Modifies:
+        :debug_content: Potentially adds new debug strings
+        """
+        if custom_query is not None:
+            custom_merge = get_merge(custom_query, CUSTOM_QUERY_EXCLUSIONS)
+        result = None
+        for function, before, after, manipulation in self.steps:
+            if debug_content:
+                debug_content.append('ActionTypeID=%s Action=%s' %
+                                     (manipulation.action_type,
+                                      manipulation.action))
+            if function is None:
+                continue
+
+            merges = []
+            if before and custom_query is not None:
+                merges.append(custom_merge)
+            if isinstance(function, QueryMerge):
+                merges.append(function)
+            else:
+                if merges:
+                    url = merge_query(url, merges)
+                    merges = []
+                url = function(url)
+            if after and custom_query is not None:
+                # Only add custom query parameters after processing the
+                # final manipulation to ensure we're not needlessly
+                # replacing them on each iteration.
+                merges.append(custom_merge)
+            if merges:
+                # Consecutive query merges share one parse of the url
+                url = merge_query(url, merges)
+            result = url
+
+            if debug_content:
+                debug_content.append(
+                    'ActionTypeID=%s ManipulatedLink=%s VSID=%s' %
+                    (manipulation.action_type, url,
+                     manipulation.view_source))
+        return result
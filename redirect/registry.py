@@ -0,0 +1,385 @@
+"""
+In-process lookup tables for data that is read on every redirect but only
+changes when someone edits it through the admin or an upload.
+
+Each table is loaded into memory in full and tagged with a generation number
+that is shared between processes via the Django cache. Saving or deleting a
+relevant model bumps that generation; every process compares its own copy
+against it at most once every settings.REGISTRY_CHECK_INTERVAL seconds and
+rebuilds when the two differ. Edits made inside a transaction bump it again
+once the request finishes, after the transaction has committed, so that a
+process which rebuilt from the old rows in between doesn't keep them.
+"""
+from collections import namedtuple
+import threading
+import time
+import urllib
+import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from redirect.models import (CanonicalMicrosite, CompanyEmail,
+                             CustomExcludedViewSource, DestinationManipulation,
+                             ExcludedViewSource, ViewSource, ViewSourceGroup)
+from redirect import timing
+
+
+REGISTRIES = []
+
+# Registries invalidated by this thread inside a transaction that had not yet
+# committed
+_pending = threading.local()
+
+
+class Registry(object):
+    """
+    Base class for generation-checked, process-local lookup tables.
+
+    Subclasses define :cache_key: and implement build(), which returns the
+    object handed out by get(). That object is replaced wholesale on each
+    rebuild and must be treated as read-only by callers.
+    """
+    cache_key = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+        self._generation = None
+        self._checked = 0
+        REGISTRIES.append(self)
+
+    def build(self):
+        raise NotImplementedError
+
+    def get(self):
+        """
+        Returns the current table, rebuilding it first if it has never been
+        built or if the shared generation has moved on.
+        """
+        table = self._table
+        if (table is None or
+                time.time() - self._checked >=
+                settings.REGISTRY_CHECK_INTERVAL):
+            table = self._refresh()
+        return table
+
+    def get_generation(self):
+        """
+        Retrieves the shared generation for this table, starting a new one if
+        the cache has lost it. A fresh value never matches what any process
+        has loaded, so they all rebuild.
+        """
+        with timing.stage('cache'):
+            generation = cache.get(self.cache_key)
+        if generation is None:
+            with timing.stage('cache'):
+                cache.add(self.cache_key, int(time.time() * 1000), None)
+            with timing.stage('cache'):
+                generation = cache.get(self.cache_key)
+        return generation
+
+    def invalidate(self):
+        """
+        Marks every process's copy of this table as stale. This process
+        rebuilds on its next get(); the rest follow within
+        settings.REGISTRY_CHECK_INTERVAL seconds.
+
+        Signals fire before the surrounding transaction commits, and another
+        process may rebuild from the old rows in the meantime. In that case
+        the generation is bumped a second time by invalidate_pending().
+        """
+        self._bump()
+        if transaction.get_connection().in_atomic_block:
+            if not hasattr(_pending, 'registries'):
+                _pending.registries = set()
+            _pending.registries.add(self)
+        self.reset()
+
+    def _bump(self):
+        try:
+            cache.incr(self.cache_key)
+        except ValueError:
+            # Key is missing; starting a new generation has the same effect
+            self.get_generation()
+
+    def reset(self):
+        """
+        Forgets this process's copy of the table without touching the shared
+        generation.
+        """
+        self._generation = None
+        self._checked = 0
+
+    def _refresh(self):
+        with self._lock:
+            now = time.time()
+            if (self._table is not None and self._generation is not None and
+                    now - self._checked < settings.REGISTRY_CHECK_INTERVAL):
+                # Another thread refreshed while we were waiting on the lock
+                return self._table
+            # Read the generation before building so that an edit made while
+            # we build is picked up on the next check.
+            generation = self.get_generation()
+            if self._table is None or generation != self._generation:
+                with timing.stage('rebuild'):
+                    self._table = self.build()
+                self._generation = generation
+            self._checked = now
+            return self._table
+
+
+def invalidate_pending(**kwargs):
+    """
+    Bumps the generation of every registry this thread invalidated inside a
+    transaction. Runs when each request finishes, by which point the
+    admin's or view's transaction has committed; code that edits these
+    models in a transaction outside of a request should call it once the
+    transaction commits.
+    """
+    registries = getattr(_pending, 'registries', None)
+    if registries:
+        _pending.registries = set()
+        for registry in registries:
+            registry._bump()
+            registry.reset()
+
+
+request_finished.connect(invalidate_pending,
+                         dispatch_uid='redirect.registry.invalidate_pending')
+
+
+def reset_all():
+    """
+    Forgets the local copy of every registry. Mostly useful in tests, where
+    transaction rollbacks change tables without sending any signals.
+    """
+    _pending.registries = set()
+    for registry in REGISTRIES:
+        registry.reset()
+
+
+Manipulation = namedtuple('Manipulation', ['action_type', 'action', 'value_1',
+                                           'value_2', 'view_source'])
+
+
+class ManipulationTable(Registry):
+    """
+    Maps buid -> view source -> Pipeline compiled from that pair's
+    manipulations, ordered by action_type.
+    """
+    cache_key = settings.MANIPULATION_GENERATION_CACHE_KEY
+
+    def build(self):
+        # redirect.pipeline depends on redirect.helpers, which depends on us
+        from redirect.pipeline import Pipeline
+
+        table = {}
+        rows = DestinationManipulation.objects.order_by(
+            'buid', 'view_source', 'action_type').values_list(
+            'buid', 'view_source', 'action_type', 'action', 'value_1',
+            'value_2')
+        for (buid, view_source, action_type, action,
+                value_1, value_2) in rows.iterator():
+            chain = table.setdefault(buid, {}).setdefault(view_source, [])
+            chain.append(Manipulation(action_type, action, value_1, value_2,
+                                      view_source))
+        return dict((buid, dict((view_source, Pipeline(chain))
+                                for view_source, chain in chains.items()))
+                    for buid, chains in table.items())
+
+    def get_pipeline(self, buid, view_source):
+        """
+        Retrieves the pipeline for this buid and view source, falling back to
+        view source 0 if there is none.
+
+        Outputs:
+        :pipeline: Pipeline instance, or None if neither the view source nor
+            the fallback has any manipulations
+        """
+        pipelines = self.get().get(buid)
+        if not pipelines:
+            return None
+        return pipelines.get(view_source) or pipelines.get(0)
+
+
+manipulation_table = ManipulationTable()
+
+
+def clear_manipulation_table(sender, instance, **kwargs):
+    manipulation_table.invalidate()
+
+
+# Rebuilds the manipulation table when an instance is saved or deleted
+post_save.connect(clear_manipulation_table, sender=DestinationManipulation,
+                  dispatch_uid='clear_manipulation_table')
+post_delete.connect(clear_manipulation_table, sender=DestinationManipulation,
+                    dispatch_uid='clear_manipulation_table')
+
+
+class ExclusionTable(Registry):
+    """
+    Holds the current frozenset of globally excluded view sources. Requests
+    keep whichever set they started with, so a rebuild never changes the
+    rules mid-request.
+    """
+    cache_key = settings.EXCLUSION_GENERATION_CACHE_KEY
+
+    def build(self):
+        return frozenset(ExcludedViewSource.objects.values_list(
+            'view_source', flat=True))
+
+
+exclusion_table = ExclusionTable()
+
+
+def clear_exclusion_table(sender, instance, **kwargs):
+    exclusion_table.invalidate()
+
+
+# Rebuilds the exclusion set when an exclusion is saved or deleted
+post_save.connect(clear_exclusion_table, sender=ExcludedViewSource,
+                  dispatch_uid='clear_exclusion_table')
+post_delete.connect(clear_exclusion_table, sender=ExcludedViewSource,
+                    dispatch_uid='clear_exclusion_table')
+
+
+class BusinessUnitPolicy(namedtuple('BusinessUnitPolicy', [
+        'buid', 'microsite_url', 'excluded_view_sources', 'contact_email'])):
+    """
+    Everything the redirect and email paths need to know about a business
+    unit
+
+    :microsite_url: Canonical microsite url, or None if there isn't one
+    :excluded_view_sources: frozenset of view sources that should not
+        redirect to this business unit's microsite
+    :contact_email: Address guid@my.jobs emails are forwarded to, or None
+    """
+    __slots__ = ()
+
+    def is_excluded(self, view_source, exclusions=frozenset()):
+        """
+        Determines if a view source skips the microsite for this business
+        unit, given the set of globally excluded view sources
+        """
+        return (view_source in exclusions or
+                view_source in self.excluded_view_sources)
+
+
+class PolicyTable(Registry):
+    """
+    Maps buid -> BusinessUnitPolicy for every business unit with a
+    microsite, custom exclusion or contact email.
+    """
+    cache_key = settings.POLICY_GENERATION_CACHE_KEY
+
+    def build(self):
+        microsites = dict(CanonicalMicrosite.objects.values_list(
+            'buid', 'canonical_microsite_url'))
+        emails = dict(CompanyEmail.objects.values_list('buid', 'email'))
+        excluded = {}
+        rows = CustomExcludedViewSource.objects.values_list('buid',
+                                                            'view_source')
+        for buid, view_source in rows.iterator():
+            excluded.setdefault(buid, set()).add(view_source)
+
+        buids = set(microsites) | set(emails) | set(excluded)
+        return dict((buid, BusinessUnitPolicy(
+            buid, microsites.get(buid),
+            frozenset(excluded.get(buid, ())), emails.get(buid)))
+            for buid in buids)
+
+    def get_policy(self, buid):
+        """
+        Outputs:
+        :policy: BusinessUnitPolicy for :buid:; business units without any
+            settings get an empty policy
+        """
+        policy = self.get().get(buid)
+        if policy is None:
+            policy = BusinessUnitPolicy(buid, None, frozenset(), None)
+        return policy
+
+
+policy_table = PolicyTable()
+
+
+def clear_policy_table(sender, instance, **kwargs):
+    policy_table.invalidate()
+
+
+# Rebuilds business unit policies when any of their parts is saved or deleted
+for model in [CanonicalMicrosite, CustomExcludedViewSource, CompanyEmail]:
+    post_save.connect(clear_policy_table, sender=model,
+                      dispatch_uid='clear_policy_table_%s' % model.__name__)
+    post_delete.connect(clear_policy_table, sender=model,
+                        dispatch_uid='clear_policy_table_%s' % model.__name__)
+
+
+class Campaign(namedtuple('Campaign', ['query', 'suffix', 'keys'])):
+    """
+    Google Analytics parameters for one view source
+
+    :query: Query string as passed to helpers.replace_or_add_query
+    :suffix: The same parameters already encoded the way
+        replace_or_add_query would write them, ready to be appended
+    :keys: frozenset of lower-cased parameter names in :suffix:
+    """
+    __slots__ = ()
+
+
+def make_campaign(source, group):
+    query = (u'&utm_source={source}-DE'
+             u'&utm_medium={group}'
+             u'&utm_campaign={source}'.format(source=source, group=group))
+    # Parse exactly as replace_or_add_query does so that odd characters in
+    # view source or group names produce the same result
+    pairs = urlparse.parse_qsl(query[1:].encode('utf-8'),
+                               keep_blank_values=True)
+    suffix = '&'.join('='.join([urllib.quote(k, safe=','),
+                                urllib.quote(v, safe=',')])
+                      for k, v in pairs)
+    return Campaign(query, suffix, frozenset(k.lower() for k, v in pairs))
+
+
+class CampaignTable(Registry):
+    """
+    Maps view source id -> Campaign for view sources that include Google
+    Analytics parameters and belong to at least one group
+    """
+    cache_key = settings.CAMPAIGN_GENERATION_CACHE_KEY
+
+    def build(self):
+        table = {}
+        # A view source in several groups uses the first one, as
+        # viewsourcegroup_set.first() did
+        rows = ViewSourceGroup.view_source.through.objects.filter(
+            viewsource__include_ga_params=True).order_by(
+            'viewsourcegroup').values_list(
+            'viewsource', 'viewsource__name', 'viewsourcegroup__name')
+        for view_source, source, group in rows:
+            if view_source not in table:
+                table[view_source] = make_campaign(source, group)
+        return table
+
+
+campaign_table = CampaignTable()
+
+
+def clear_campaign_table(sender, instance, **kwargs):
+    campaign_table.invalidate()
+
+
+# Rebuilds campaigns when view sources, groups or their membership change
+for model in [ViewSource, ViewSourceGroup]:
+    post_save.connect(clear_campaign_table, sender=model,
+                      dispatch_uid='clear_campaign_table_%s' % model.__name__)
+    post_delete.connect(clear_campaign_table, sender=model,
+                        dispatch_uid='clear_campaign_table_%s' %
+                        model.__name__)
+m2m_changed.connect(clear_campaign_table,
+                    sender=ViewSourceGroup.view_source.through,
+                    dispatch_uid='clear_campaign_table_membership')
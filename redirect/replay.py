@@ -0,0 +1,289 @@
+"""
+Replays clicks recorded in Apache's w3c_extended access log (see
+apache/apache2.conf) against the redirect application, in process.
+
+Each log line gives the path, user agent, referer, host, status, response
+time and the X-REDIRECT header we sent. The aguid and myguid cookies are
+recovered from that header so the replayed response can be compared with
+the logged one. The log format doesn't record query strings; if a path
+includes one (for instance because %q was added to the format), it is
+replayed as well.
+
+Requests run through Django's WSGI handler against whatever databases the
+current settings point at, normally a local snapshot of production.
+"""
+from collections import namedtuple
+import gzip
+import math
+import Queue
+import re
+import threading
+import time
+from urlparse import parse_qs
+from wsgiref.util import setup_testing_defaults
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+
+
+LINE_RE = re.compile(
+    r'^(?P<time>\S+ \S+) (?P<local_ip>\S+) (?P<method>\S+) (?P<path>\S+) '
+    r'(?P<redirect>\S+) (?P<port>\S+) (?P<user>\S+) (?P<ip>\S+) '
+    r'(?P<protocol>\S+) "(?P<user_agent>(?:[^"\\]|\\.)*)" (?P<cookie>\S*) '
+    r'(?P<referer>.*?) (?P<host>\S+) (?P<status>\d{3}) (?P<bytes_out>\S+) '
+    r'(?P<bytes_in>\S+) (?P<duration>\d+)$')
+
+# Paths handled by views.home
+HOME_PATH_RE = re.compile(r'^/[0-9A-Fa-f]{32}\d*\+?$')
+
+PERCENTILES = [50, 90, 99]
+
+Click = namedtuple('Click', ['method', 'path', 'query', 'user_agent',
+                             'referer', 'host', 'status', 'duration',
+                             'redirect'])
+
+Result = namedtuple('Result', ['click', 'status', 'seconds', 'redirect'])
+
+
+def unescape(value):
+    # Apache escapes quotes and backslashes in logged headers
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def parse_line(line):
+    """
+    Parses one w3c_extended log line
+
+    Outputs:
+    :click: Click for this line, or None if it isn't in that format
+    """
+    match = LINE_RE.match(line.rstrip('\r\n'))
+    if match is None:
+        return None
+    fields = match.groupdict()
+    path, _, query = fields['path'].partition('?')
+    redirect = {}
+    if fields['redirect'] != '-':
+        redirect = dict((key, values[0]) for key, values in
+                        parse_qs(fields['redirect'],
+                                 keep_blank_values=True).items())
+    return Click(fields['method'], path, query,
+                 unescape(fields['user_agent']),
+                 '' if fields['referer'] == '-' else fields['referer'],
+                 fields['host'], int(fields['status']),
+                 int(fields['duration']) / 1000000.0, redirect)
+
+
+def read_clicks(paths, skipped=None):
+    """
+    Streams clicks for views.home out of log files, which may be gzipped
+
+    Inputs:
+    :paths: Log file paths, read in order
+    :skipped: Optional dictionary counting lines that were not replayed,
+        by reason
+
+    Outputs:
+    :clicks: Generator of Click instances
+    """
+    if skipped is None:
+        skipped = {}
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path) as log:
+            for line in log:
+                click = parse_line(line)
+                if click is None:
+                    reason = 'unparsed'
+                elif click.method != 'GET':
+                    reason = 'method'
+                elif not HOME_PATH_RE.match(click.path):
+                    reason = 'path'
+                else:
+                    yield click
+                    continue
+                skipped[reason] = skipped.get(reason, 0) + 1
+
+
+def get_environ(click):
+    """
+    Outputs:
+    :environ: WSGI environment reproducing the logged request
+    """
+    environ = {'REQUEST_METHOD': click.method,
+               'PATH_INFO': click.path,
+               'QUERY_STRING': click.query,
+               'HTTP_HOST': click.host,
+               'SERVER_NAME': click.host,
+               'HTTP_USER_AGENT': click.user_agent}
+    if click.referer:
+        environ['HTTP_REFERER'] = click.referer
+    cookies = ['%s=%s' % (name, click.redirect['jcnlx.%s' % name])
+               for name in ['aguid', 'myguid']
+               if click.redirect.get('jcnlx.%s' % name)]
+    if cookies:
+        environ['HTTP_COOKIE'] = '; '.join(cookies)
+    setup_testing_defaults(environ)
+    return environ
+
+
+def replay_click(application, click):
+    """
+    Sends one click through the WSGI application
+
+    Outputs:
+    :result: Result with the new status, time taken and X-REDIRECT values
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = dict((name.lower(), value)
+                                   for name, value in headers)
+
+    start = time.time()
+    body = application(get_environ(click), start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    seconds = time.time() - start
+
+    redirect = {}
+    header = response['headers'].get('x-redirect')
+    if header:
+        redirect = dict((key, values[0]) for key, values in
+                        parse_qs(header, keep_blank_values=True).items())
+    return Result(click, response['status'], seconds, redirect)
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class Report(object):
+    """
+    Collects replay results
+    """
+    def __init__(self, max_examples=20):
+        self.max_examples = max_examples
+        self.latencies = []
+        self.logged_latencies = []
+        self.status_differences = 0
+        self.url_differences = 0
+        self.examples = []
+        self.errors = 0
+        self.seconds = 0
+
+    def add(self, result):
+        click = result.click
+        self.latencies.append(result.seconds)
+        self.logged_latencies.append(click.duration)
+        difference = None
+        if result.status != click.status:
+            self.status_differences += 1
+            difference = 'status %s -> %s' % (click.status, result.status)
+        else:
+            old = click.redirect.get('jcnlx.url', '')
+            new = result.redirect.get('jcnlx.url', '')
+            if old != new:
+                self.url_differences += 1
+                difference = 'url %s -> %s' % (old, new)
+        if difference and len(self.examples) < self.max_examples:
+            self.examples.append('%s%s: %s' % (
+                click.path, '?' + click.query if click.query else '',
+                difference))
+
+    def format(self):
+        count = len(self.latencies)
+        lines = ['Replayed %d clicks in %.1fs (%.1f/s), %d errors' % (
+            count, self.seconds, count / self.seconds if self.seconds else 0,
+            self.errors)]
+        if count:
+            for name, latencies in [('replayed', self.latencies),
+                                    ('logged', self.logged_latencies)]:
+                latencies = sorted(latencies)
+                lines.append('%-8s latency: %s, max %.1fms' % (
+                    name, ', '.join(
+                        'p%d %.1fms' % (percent,
+                                        percentile(latencies, percent) * 1000)
+                        for percent in PERCENTILES),
+                    latencies[-1] * 1000))
+        lines.append('%d status differences, %d url differences' % (
+            self.status_differences, self.url_differences))
+        lines.extend('  %s' % example for example in self.examples)
+        return '\n'.join(lines)
+
+
+def replay(clicks, concurrency=1, application=None, report=None,
+           logger=None):
+    """
+    Replays clicks through the WSGI application
+
+    Inputs:
+    :clicks: Iterable of Click instances, e.g. from read_clicks
+    :concurrency: Number of threads sending requests; 1 replays in the
+        calling thread
+    :application: WSGI application; default: a new Django WSGIHandler
+    :report: Report to add results to; default: a new one
+    :logger: Optional logging.Logger for requests that raise
+
+    Outputs:
+    :report: Report of all replayed clicks
+    """
+    if application is None:
+        application = WSGIHandler()
+    if report is None:
+        report = Report()
+    lock = threading.Lock()
+
+    def run(click):
+        try:
+            result = replay_click(application, click)
+        except Exception:
+            if logger is not None:
+                logger.exception('Replaying %s failed', click.path)
+            with lock:
+                report.errors += 1
+        else:
+            with lock:
+                report.add(result)
+
+    start = time.time()
+    if concurrency <= 1:
+        for click in clicks:
+            run(click)
+    else:
+        # Bounded so that huge logs are streamed rather than read up front
+        pending = Queue.Queue(maxsize=concurrency * 10)
+
+        def work():
+            try:
+                while True:
+                    click = pending.get()
+                    if click is None:
+                        break
+                    run(click)
+            finally:
+                for connection in connections.all():
+                    connection.close()
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for click in clicks:
+            pending.put(click)
+        for thread in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+    report.seconds = time.time() - start
+    return report
@@ -0,0 +1,330 @@
+"""
+Resolves job GUIDs to Redirect or RedirectArchive instances.
+
+Lookups go through two per-process caches before touching a database: an LRU
+of recently resolved rows and a short-lived record of GUIDs that matched
+nothing, which is mostly crawlers trying expired or made-up links. When both
+miss, the archive is queried in the background while Redirect is, so that a
+job that only exists in the archive doesn't pay for two round-trips in a
+row. Jobs found in Redirect never wait on the archive. Background lookups
+are only started while a lookup thread is free, so that abandoned ones
+can't pile up in front of jobs that really are archived.
+"""
+from collections import OrderedDict
+import logging
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import (DatabaseError, close_old_connections, connections,
+                       router)
+from django.db.models.signals import post_delete, post_save
+
+from redirect import timing
+from redirect.models import (Redirect, RedirectArchive,
+                             get_redirect_models)
+
+
+logger = logging.getLogger(__name__)
+
+# Field names in the order Redirect.__init__ accepts them positionally
+FIELDS = [field.attname for field in Redirect._meta.fields]
+
+# GUIDs per guid__in query in fetch_rows; SQLite allows 999 parameters
+BULK_QUERY_SIZE = 500
+
+STAT_KEYS = ['hits', 'negative_hits', 'misses', 'found', 'archive_hits',
+             'not_found', 'archive_errors', 'archive_timeouts']
+
+
+def fetch_row(model, guid):
+    """
+    Retrieves the row for this guid as a tuple ordered like FIELDS
+
+    Outputs:
+    :row: Tuple of field values, or None if there is no such row
+    """
+    with timing.stage('db'):
+        rows = list(model.objects.filter(guid=guid).values_list(
+            *FIELDS)[:1])
+    if rows:
+        return rows[0]
+    return None
+
+
+def fetch_rows(model, guids):
+    """
+    Retrieves the rows for many guids, BULK_QUERY_SIZE at a time
+
+    Outputs:
+    :rows: Dictionary of lowercased guid -> tuple ordered like FIELDS, for
+        the guids that have a row
+    """
+    index = FIELDS.index('guid')
+    rows = {}
+    for start in range(0, len(guids), BULK_QUERY_SIZE):
+        with timing.stage('db'):
+            chunk = model.objects.filter(
+                guid__in=guids[start:start + BULK_QUERY_SIZE]).values_list(
+                    *FIELDS)
+            for row in chunk:
+                rows[row[index].lower()] = row
+    return rows
+
+
+def fetch_row_in_thread(model, guid):
+    # Pool threads hold on to their own connections between lookups; throw
+    # them out if they have gone bad in the meantime.
+    close_old_connections()
+    return fetch_row(model, guid)
+
+
+class GuidResolver(object):
+    """
+    Per-process GUID -> redirect lookup with positive and negative caching
+
+    Rows are cached rather than model instances, so callers always get a
+    fresh instance that they are free to modify.
+    """
+    def __init__(self, size, timeout, negative_timeout, threads,
+                 archive_timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.threads = threads
+        self.archive_timeout = archive_timeout
+        self._lock = threading.Lock()
+        self._found = OrderedDict()
+        self._missing = OrderedDict()
+        self._pool = None
+        # Background lookups queued or running, whether or not anything
+        # still waits on them
+        self._in_flight = 0
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+    def resolve(self, guid):
+        """
+        Retrieves the redirect for :guid:, checking Redirect first
+
+        Outputs:
+        :redirect: New Redirect or RedirectArchive instance
+
+        Raises ObjectDoesNotExist if no table has this guid
+        """
+        # Cached under the lowercase guid, so that evict() finds it whatever
+        # case it was asked for or is stored in
+        key = guid.lower()
+        now = time.time()
+        with self._lock:
+            entry = self._found.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # Reinsert to mark this guid as the most recently used
+                self._found[key] = entry
+                self.stats['hits'] += 1
+                return entry[1](*entry[2])
+            expires = self._missing.get(key)
+            if expires is not None:
+                if expires > now:
+                    self.stats['negative_hits'] += 1
+                    raise ObjectDoesNotExist
+                del self._missing[key]
+            self.stats['misses'] += 1
+
+        model, row, complete = self.lookup(guid)
+
+        with self._lock:
+            if row is None:
+                self.stats['not_found'] += 1
+                if complete:
+                    self._store(self._missing, key,
+                                now + self.negative_timeout)
+            else:
+                self.stats['found'] += 1
+                if model is not Redirect:
+                    self.stats['archive_hits'] += 1
+                self._store(self._found, key,
+                            (now + self.timeout, model, row))
+        if row is None:
+            raise ObjectDoesNotExist
+        return model(*row)
+
+    def resolve_many(self, guids):
+        """
+        Retrieves the redirects for many guids, querying each table once per
+        BULK_QUERY_SIZE guids not already cached
+
+        Rows fetched here are not cached, so that a large batch doesn't push
+        out the jobs that are actually being clicked.
+
+        Outputs:
+        :redirects: Dictionary of lowercased guid -> new Redirect or
+            RedirectArchive instance, for the guids that exist
+        """
+        now = time.time()
+        redirects = {}
+        missing = []
+        with self._lock:
+            for guid in set(guid.lower() for guid in guids):
+                entry = self._found.get(guid)
+                if entry is not None and entry[0] > now:
+                    redirects[guid] = entry[1](*entry[2])
+                else:
+                    missing.append(guid)
+        for model in get_redirect_models():
+            if not missing:
+                break
+            rows = fetch_rows(model, missing)
+            for guid, row in rows.items():
+                redirects[guid] = model(*row)
+            missing = [guid for guid in missing if guid not in rows]
+        return redirects
+
+    def lookup(self, guid):
+        """
+        Queries each redirect table for :guid:, starting the archive lookups
+        in the background when possible
+
+        The archive is only waited on (for at most archive_timeout seconds)
+        when Redirect has no row. A background lookup that times out is
+        repeated in this thread; database errors are logged and treated as
+        no row. When every lookup thread is already busy, the archive is
+        queried in this thread after Redirect misses.
+
+        Outputs:
+        :model, row: The first model (in get_redirect_models order) with a
+            matching row, and that row; (None, None) if nothing matched
+        :complete: False if some table could not be checked, in which case
+            the guid should not be remembered as missing
+        """
+        models = get_redirect_models()
+        pool = self.get_pool(models)
+        pending = [None] * (len(models) - 1)
+        if pool is not None:
+            with self._lock:
+                background = self._in_flight < self.threads
+                if background:
+                    self._in_flight += len(pending)
+            if background:
+                pending = [pool.apply_async(self._fetch_in_thread,
+                                            (model, guid))
+                           for model in models[1:]]
+        row = fetch_row(models[0], guid)
+        if row is not None:
+            # Any archive lookups still running are left to finish on their
+            # own; nothing reads their results
+            return models[0], row, True
+
+        complete = True
+        for model, result in zip(models[1:], pending):
+            try:
+                if result is not None:
+                    try:
+                        row = result.get(self.archive_timeout)
+                    except TimeoutError:
+                        # Stuck behind slow lookups; ask directly instead
+                        # of calling a job that exists missing
+                        logger.warning('Timed out looking up %s in %s in '
+                                       'the background', guid,
+                                       model.__name__)
+                        with self._lock:
+                            self.stats['archive_timeouts'] += 1
+                        result = None
+                if result is None:
+                    row = fetch_row(model, guid)
+            except DatabaseError:
+                logger.exception('Could not look up %s in %s', guid,
+                                 model.__name__)
+                with self._lock:
+                    self.stats['archive_errors'] += 1
+                complete = False
+                continue
+            if row is not None:
+                return model, row, True
+        return None, None, complete
+
+    def _fetch_in_thread(self, model, guid):
+        try:
+            return fetch_row_in_thread(model, guid)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get_pool(self, models):
+        """
+        Lazily starts the worker threads used for parallel lookups
+
+        SQLite databases (as used in testing) are not shared between threads,
+        so lookups against them are always sequential.
+        """
+        if self._pool is None and self.threads:
+            aliases = [router.db_for_read(model) or 'default'
+                       for model in models]
+            if any(connections[alias].vendor == 'sqlite'
+                   for alias in aliases):
+                self.threads = 0
+                return None
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.threads)
+        return self._pool
+
+    def evict(self, guid):
+        # Cache keys are lowercase, whatever the case of the stored guid
+        # (or a UUID, for instances created with one)
+        guid = unicode(guid).lower()
+        with self._lock:
+            self._found.pop(guid, None)
+            self._missing.pop(guid, None)
+
+    def clear(self):
+        with self._lock:
+            self._found.clear()
+            self._missing.clear()
+
+    def get_stats(self):
+        """
+        Summarizes cache effectiveness for this process
+
+        Outputs:
+        :stats: Dictionary of counters plus the overall hit ratio (positive
+            and negative hits over all lookups) and the current cache sizes
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached'] = len(self._found)
+            stats['cached_missing'] = len(self._missing)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        if lookups:
+            stats['hit_ratio'] = float(stats['hits'] +
+                                       stats['negative_hits']) / lookups
+        else:
+            stats['hit_ratio'] = 0.0
+        return stats
+
+    def _store(self, entries, guid, value):
+        entries.pop(guid, None)
+        entries[guid] = value
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+
+guid_resolver = GuidResolver(settings.GUID_CACHE_SIZE,
+                             settings.GUID_CACHE_TIMEOUT,
+                             settings.GUID_NEGATIVE_CACHE_TIMEOUT,
+                             settings.GUID_LOOKUP_THREADS,
+                             settings.GUID_ARCHIVE_TIMEOUT)
+
+
+def evict_redirect(sender, instance, **kwargs):
+    guid_resolver.evict(instance.guid)
+
+
+# Drops cached rows for redirects that are saved or deleted in this process
+for model in [Redirect, RedirectArchive]:
+    post_save.connect(evict_redirect, sender=model,
+                      dispatch_uid='evict_redirect_%s' % model.__name__)
+    post_delete.connect(evict_redirect, sender=model,
+                        dispatch_uid='evict_redirect_%s' % model.__name__)
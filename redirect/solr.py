@@ -0,0 +1,152 @@
+"""
+Shared access to job details stored in Solr.
+
+Each thread keeps one pysolr client, and with it one keep-alive HTTP session,
+for its whole life. Results are cached per GUID for a short time, and when
+several threads miss on the same GUID at once only one of them queries Solr.
+Lookups that fail or time out return None; callers fall back to the fields
+stored on the Redirect instead of failing the request.
+"""
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from redirect.lazy import LazyModule
+
+
+logger = logging.getLogger(__name__)
+
+# Only opengraph cards and email forwarding look jobs up in Solr
+pysolr = LazyModule('pysolr')
+requests = LazyModule('requests')
+
+# Fields callers use; everything else is left out of the response
+FIELDS = ['title', 'description', 'company_exact']
+
+STAT_KEYS = ['hits', 'misses', 'coalesced', 'errors']
+
+
+class JobCache(object):
+    """
+    Per-process GUID -> job details lookup backed by Solr
+    """
+    def __init__(self, url, size, timeout, request_timeout):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pending = {}
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+
+    def get_solr(self):
+        solr = getattr(self._local, 'solr', None)
+        if solr is None:
+            solr = pysolr.Solr(self.url, timeout=self.request_timeout)
+            self._local.solr = solr
+        return solr
+
+    def get_job(self, guid, unique=False, timeout=None):
+        """
+        Retrieves title, description and company_exact for a job
+
+        Inputs:
+        :guid: 32-character job guid
+        :unique: Only return a job if exactly one document matches
+        :timeout: Seconds to wait for Solr; default: the value this cache
+            was created with
+
+        Outputs:
+        :job: Dictionary containing whichever of FIELDS Solr has for this
+            job, or None if it isn't in Solr or Solr could not be reached
+        """
+        guid = guid.upper()
+        hits, job = self.lookup(guid, timeout)
+        if not hits or (unique and hits != 1):
+            return None
+        return dict(job)
+
+    def lookup(self, guid, timeout=None):
+        """
+        Outputs:
+        :hits, job: Number of matching documents and the fields of the first
+            one; (0, None) if there were none or the search failed
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._jobs.pop(guid, None)
+            if entry is not None and entry[0] > now:
+                self._jobs[guid] = entry
+                self.stats['hits'] += 1
+                return entry[1]
+            event = self._pending.get(guid)
+            if event is None:
+                event = self._pending[guid] = threading.Event()
+                owner = True
+                self.stats['misses'] += 1
+            else:
+                owner = False
+                self.stats['coalesced'] += 1
+
+        if not owner:
+            # Someone else is already asking Solr; wait for their answer
+            event.wait(timeout or self.request_timeout)
+            with self._lock:
+                entry = self._jobs.get(guid)
+            if entry is None:
+                return 0, None
+            return entry[1]
+
+        try:
+            result = self.search(guid, timeout)
+            if result is not None:
+                with self._lock:
+                    self._jobs[guid] = (now + self.timeout, result)
+                    while len(self._jobs) > self.size:
+                        self._jobs.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[guid]
+            event.set()
+        return result or (0, None)
+
+    def search(self, guid, timeout=None):
+        """
+        Queries Solr for one guid
+
+        Outputs:
+        :hits, job: As for lookup(), or None if the search failed
+        """
+        solr = self.get_solr()
+        solr.timeout = timeout or self.request_timeout
+        try:
+            results = solr.search(q='guid:%s' % guid, fl=','.join(FIELDS))
+        except (pysolr.SolrError, requests.RequestException, ValueError):
+            logger.warning('Solr lookup for %s failed', guid, exc_info=True)
+            with self._lock:
+                self.stats['errors'] += 1
+            return None
+        if not results.hits:
+            return 0, None
+        doc = results.docs[0]
+        return results.hits, tuple((field, doc[field]) for field in FIELDS
+                                   if field in doc)
+
+    def clear(self):
+        with self._lock:
+            self._jobs.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached'] = len(self._jobs)
+        return stats
+
+
+job_cache = JobCache(settings.SOLR['default'], settings.SOLR_CACHE_SIZE,
+                     settings.SOLR_CACHE_TIMEOUT, settings.SOLR_TIMEOUT)
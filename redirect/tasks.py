@@ -1,83 +1,165 @@
 import datetime
+import json
+import os
+import time
 
-from django.db import connection
+from django.conf import settings
+from django.db import connection, connections, router, transaction
 
 from redirect.models import Redirect, RedirectArchive
+from redirect.resolver import guid_resolver
 
 
-def expired_to_archive_table():
+# Field names in the order Redirect.__init__ accepts them positionally
+REDIRECT_FIELDS = [field.attname for field in Redirect._meta.fields]
+
+
+def expired_to_archive_table(batch_size=None, rows_per_second=None,
+                             checkpoint_file=None):
     """
     Moves all redirects that have been expired for more than
     thirty days from Redirect to RedirectArchive.
 
+    Expired rows are read in primary key order, one batch at a time, so
+    memory use and lock time are bounded by the batch size no matter how
+    many rows have expired. Each batch is written to the archive (replacing
+    any existing copies) before exactly those guids are deleted from
+    Redirect, so a crash at any point loses nothing; a rerun picks up from
+    the last completed batch recorded in :checkpoint_file:.
+
+    Inputs:
+    :batch_size: Rows moved per batch; defaults to
+        settings.ARCHIVE_BATCH_SIZE
+    :rows_per_second: Maximum average rate to move rows at, 0 for no limit;
+        defaults to settings.ARCHIVE_ROWS_PER_SECOND
+    :checkpoint_file: Path used to record progress between batches, '' to
+        disable checkpoints; defaults to settings.ARCHIVE_CHECKPOINT_FILE,
+        which disables them when it is None
+
+    Outputs:
+    :stats: Dictionary with the number of rows and batches moved, the
+        number of seconds taken, and the resulting rows per second
     """
+    if batch_size is None:
+        batch_size = settings.ARCHIVE_BATCH_SIZE
+    if rows_per_second is None:
+        rows_per_second = settings.ARCHIVE_ROWS_PER_SECOND
+    if checkpoint_file is None:
+        checkpoint_file = settings.ARCHIVE_CHECKPOINT_FILE
+    batch_size = min(batch_size, get_max_batch_size())
 
     thirty_days_ago = datetime.date.today() - datetime.timedelta(30)
-    expired = Redirect.objects.filter(expired_date__lte=thirty_days_ago)
-
-    # If this isn't turned into a list the query will attempt to join
-    # Redirect and RedirectArchive, which won't work since they're on
-    # different databases.
-    expired_guids = list(expired.values_list('guid', flat=True))
-    for chunk in make_chunks(expired_guids):
-        RedirectArchive.objects.filter(guid__in=chunk).delete()
-
-    add_redirects(RedirectArchive, expired)
-
-    expired.delete()
-
-
-def add_redirects(to_model, redirects):
+    expired = Redirect.objects.filter(
+        expired_date__lte=thirty_days_ago).order_by('guid')
+
+    last_guid = read_checkpoint(checkpoint_file, thirty_days_ago)
+    stats = {'rows': 0, 'batches': 0}
+    start = time.time()
+    while True:
+        batch = expired
+        if last_guid is not None:
+            batch = batch.filter(guid__gt=last_guid)
+        rows = list(batch.values_list(*REDIRECT_FIELDS)[:batch_size])
+        if not rows:
+            break
+
+        move_rows(rows, thirty_days_ago)
+        last_guid = rows[-1][0]
+        write_checkpoint(checkpoint_file, thirty_days_ago, last_guid)
+
+        stats['rows'] += len(rows)
+        stats['batches'] += 1
+        if rows_per_second:
+            # Sleep off whatever time we are ahead of the allowed rate
+            ahead = stats['rows'] / float(rows_per_second) - \
+                (time.time() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    clear_checkpoint(checkpoint_file)
+    stats['seconds'] = time.time() - start
+    if stats['seconds']:
+        stats['rows_per_second'] = stats['rows'] / stats['seconds']
+    else:
+        stats['rows_per_second'] = 0.0
+    return stats
+
+
+def move_rows(rows, cutoff):
     """
-    Adds an iteratble of redirects to to_model.
-
-    :param to_model: A subclass of BaseRedirect (either
-                     Redirect or RedirectArchive) that will
-                     be getting the copies of the redirects.
-    :param redirects: An iterable of redirect objects that should
-                      be added to the to_model table.
+    Copies one batch of rows into RedirectArchive and then removes them
+    from Redirect.
+
+    Inputs:
+    :rows: Tuples of Redirect field values, ordered like REDIRECT_FIELDS
+    :cutoff: Latest expired_date that may be archived; guids that have
+        since moved past it (e.g. reactivated since being read) are left
+        in Redirect
     """
-    new_redirects = []
-    for redirect in redirects:
-        new_redirects.append(copy_redirect(to_model, redirect))
-
-    for chunk in make_chunks(new_redirects):
-        to_model.objects.bulk_create(chunk)
-
-
-def copy_redirect(model, existing_redirect):
+    guids = [row[0] for row in rows]
+    archive_db = router.db_for_write(RedirectArchive)
+    with transaction.atomic(using=archive_db):
+        # An expired job may have been archived before, readded and expired
+        # again; the newer Redirect row wins.
+        RedirectArchive.objects.filter(guid__in=guids).delete()
+        RedirectArchive.objects.bulk_create(
+            [RedirectArchive(*row) for row in rows])
+
+    # Redirect has post_delete receivers, which would make a normal delete()
+    # fetch every row again just to send signals, so delete with plain SQL
+    # and do the receivers' one job, evicting the resolver's copies, here.
+    redirect_db = router.db_for_write(Redirect)
+    redirect_connection = connections[redirect_db]
+    quote_name = redirect_connection.ops.quote_name
+    expired_date = Redirect._meta.get_field('expired_date')
+    cursor = redirect_connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE %s IN (%s) AND %s <= %%s' % (
+        quote_name(Redirect._meta.db_table),
+        quote_name(Redirect._meta.pk.column),
+        ', '.join(['%s'] * len(guids)), quote_name(expired_date.column)),
+        guids + [expired_date.get_db_prep_value(
+            cutoff, redirect_connection)])
+    for guid in guids:
+        guid_resolver.evict(guid)
+
+
+def get_max_batch_size():
     """
-    Makes a new copy of a redirect.
-
-    :param model: A subclass of BaseRedirect (either
-                  Redirect or RedirectArchive) that the new
-                  redirect should be made for.
-    :param existing_redirect: An existing redirect instance that the new
-                              redirect should copy from.
+    Largest batch that can be used in a single guid__in query.
+    """
+    if connection.vendor == 'sqlite':
+        # SQLite has a default maximum number of SQL variables of 999
+        return 999
+    return 10000
 
-    :return: An instace of model with data copied from existing_redirect.
-             This instance has not yet been written to the table
-             for model.
 
+def read_checkpoint(checkpoint_file, cutoff):
     """
-    return model(guid=existing_redirect.guid,
-                 buid=existing_redirect.buid,
-                 uid=existing_redirect.uid,
-                 url=existing_redirect.url,
-                 new_date=existing_redirect.new_date,
-                 expired_date=existing_redirect.expired_date,
-                 job_location=existing_redirect.job_location,
-                 job_title=existing_redirect.job_title,
-                 company_name=existing_redirect.company_name)
-
-
-def make_chunks(l, n=1025):
+    Retrieves the last guid moved by an unfinished run with the same cutoff
+    date, or None if there isn't one.
     """
-    Yield successive n-sized chunks from a list.
-
-    """
-    if connection.vendor == 'sqlite':
-        # SQLite has a default maximum number of SQL variables of 999
-        n = min(n, 999)
-    for i in xrange(0, len(l), n):
-        yield l[i:i+n]
\ No newline at end of file
+    if not checkpoint_file:
+        return None
+    try:
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if checkpoint.get('cutoff') != cutoff.isoformat():
+        return None
+    return checkpoint.get('last_guid')
+
+
+def write_checkpoint(checkpoint_file, cutoff, last_guid):
+    if not checkpoint_file:
+        return
+    # Write then rename so that a crash never leaves a partial checkpoint
+    temp_file = checkpoint_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump({'cutoff': cutoff.isoformat(), 'last_guid': last_guid}, f)
+    os.rename(temp_file, checkpoint_file)
+
+
+def clear_checkpoint(checkpoint_file):
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
@@ -0,0 +1,518 @@
+"""
+Benchmarks for the redirect view.
+
+build_dataset fills the database with synthetic jobs made from the test
+factories: redirects spread over many business units, half of which have a
+microsite while the rest have a two-step manipulation chain, with every
+manipulation action in use. run_benchmark then times views.home for each
+kind of request it handles and counts the SQL queries each one makes.
+time_handlers times whole requests through Django's WSGIHandler and
+through redirect.handlers.RedirectDispatcher, to show what the middleware
+job clicks skip costs. time_query_merges compares redirect.querystring
+against the replace_or_add_query it replaced, and time_authorization
+compares redirect.credentials against hashing the webhook password on
+every post.
+
+The benchmark_redirects command runs this against a test database at
+production-like volumes and compares the results to a saved baseline.
+"""
+from datetime import timedelta
+import math
+import time
+import urllib
+import urlparse
+import uuid
+
+from django.contrib.auth import authenticate
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.http import Http404
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from wsgiref.util import setup_testing_defaults
+
+from myjobs.models import User
+from redirect import models, registry
+from redirect.credentials import WEBHOOK_USER_EMAIL, credential_cache
+from redirect.handlers import RedirectDispatcher
+from redirect.querystring import get_merge, merge_query
+from redirect.resolver import guid_resolver
+from redirect.solr import job_cache
+from redirect.tests.factories import (CanonicalMicrositeFactory,
+                                      DestinationManipulationFactory,
+                                      RedirectArchiveFactory, RedirectFactory)
+from redirect.views import home
+
+
+# Neither globally excluded nor in any group with GA parameters
+VIEW_SOURCE = '20'
+
+# value_1, value_2 for each manipulation action, suited to JOB_URL
+ACTION_VALUES = {
+    'amptoamp': ('http://apply.example.com/?', '&src=de'),
+    'anchorredirectissue': ('#apply', ''),
+    'cframe': ('example.jobs', ''),
+    'doubleclickunwind': ('', ''),
+    'fixurl': ('http://', 'https://'),
+    'replacethenadd': ('lang=en!!!!lang=fr', '&src=de'),
+    'replacethenaddpre': ('lang=en!!!!lang=fr', 'http://ad.example.com/clk?'),
+    'sourcecodeinsertion': ('&src=de', ''),
+    'sourcecodeswitch': ('lang=en', 'lang=fr'),
+    'sourcecodetag': ('&src=JB-DE', ''),
+    'sourceurlwrapappend': ('http://wrap.example.com/?u=', '&src=de'),
+    'sourceurlwrapunencoded': ('http://wrap.example.com/?u=', ''),
+    'sourceurlwrapunencodedappend': ('http://wrap.example.com/?u=',
+                                     '&src=de'),
+    'switchlastinstance': ('lang', 'language'),
+    'switchlastthenadd': ('en!!!!fr', '&src=de'),
+    'urlswap': ('http://swap.example.com/job?id=1&lang=en', ''),
+}
+
+JOB_URL = 'https://jobs.example.com/careers/job/?id=%d&lang=en'
+
+PERCENTILES = [50, 90, 99]
+
+
+def old_replace_or_add_query(url, query, exclusions=None):
+    """
+    replace_or_add_query as implemented before redirect.querystring
+    """
+    if not exclusions:
+        exclusions = []
+    if len(query) > 1 and query[0] in ['?', '&']:
+        query = query[1:]
+        query = query.encode('utf-8')
+        url = url.encode('utf-8')
+        url = urlparse.urlparse(url)
+        old_query = urlparse.parse_qsl(url.query, keep_blank_values=True)
+        old_keys = [q[0] for q in old_query]
+        insensitive_keys = map(str.lower, old_keys)
+
+        new_query = urlparse.parse_qsl(query, keep_blank_values=True)
+
+        for new_index in range(len(new_query)):
+            if new_query[new_index][0] not in exclusions:
+                try:
+                    old_index = insensitive_keys.index(
+                        new_query[new_index][0].lower())
+                except ValueError:
+                    old_query.append(new_query[new_index])
+                else:
+                    old_query[old_index] = (old_query[old_index][0],
+                                            new_query[new_index][1])
+
+        old_query = '&'.join(['='.join([urllib.quote(k, safe=','),
+                                        urllib.quote(v, safe=',')])
+                             for k, v in old_query])
+        url = url._replace(query=old_query)
+        url = urlparse.urlunparse(url)
+    else:
+        parts = url.split('#')
+        parts[0] += query
+        url = '#'.join(parts)
+    return url
+
+
+# Urls and query strings as they show up in job feeds and manipulations
+ATS_URLS = [
+    'https://jobs.example.com/careers/JobDetail.aspx?jobId=12345&src=DE',
+    'http://www.my.jobs/ABCDEF0123456789ABCDEF0123456789/job/?vs=1',
+    'https://recruiting.example.com/ats/job?id=1000&lang=en&SRC=feed',
+    'https://careers.example.com/ShowJob/Id/123456/Sales-Rep/?source=x#apply',
+    'http://example.taleo.net/careersection/2/jobdetail.ftl?job=0016G&src='
+    'JB-10020&lang=en',
+    'https://example.com/jobs/view.php?title=Nurse%20(RN)&loc=Indianapolis'
+    '%2C%20IN&utm_source=DE',
+]
+QUERIES = ['&src=DE-Indeed', '?utm_source=Indeed&utm_medium=Job%20Boards',
+           '&vs=1&z=1&my.jobs.site.id=5', '&Lang=fr', 'src=raw']
+
+
+def get_guid(number):
+    return '{%s}' % uuid.UUID(int=number)
+
+
+def bulk_create(model, rows, batch_size=1000):
+    for start in xrange(0, len(rows), batch_size):
+        model.objects.bulk_create(rows[start:start + batch_size])
+
+
+def build_dataset(redirects=1000000, archived=100000, buids=2000,
+                  expired_every=20, batch_size=1000):
+    """
+    Creates synthetic jobs to benchmark against
+
+    Inputs:
+    :redirects: Number of Redirect rows
+    :archived: Number of RedirectArchive rows
+    :buids: Number of business units; even ones get a microsite and odd
+        ones a manipulation chain
+    :expired_every: Every nth redirect is expired but not yet archived
+    :batch_size: Rows per INSERT
+
+    Outputs:
+    :dataset: Dictionary of guids (without braces or dashes) per kind of
+        job, plus the id of a syndication site
+    """
+    now = timezone.now()
+    new_date = now - timedelta(days=7)
+    expired_date = now - timedelta(days=1)
+    actions = sorted(models.CHOICES)
+
+    bulk_create(models.CanonicalMicrosite, [
+        CanonicalMicrositeFactory.build(
+            buid=buid,
+            canonical_microsite_url='http://%d.jobs.example.com/' % buid)
+        for buid in xrange(0, buids, 2)], batch_size)
+
+    manipulations = []
+    for index, buid in enumerate(xrange(1, buids, 2)):
+        for action_type in [1, 2]:
+            action = actions[(index + action_type - 1) % len(actions)]
+            value_1, value_2 = ACTION_VALUES.get(action, ('', ''))
+            manipulations.append(DestinationManipulationFactory.build(
+                action_type=action_type, action=action, buid=buid,
+                view_source=int(VIEW_SOURCE), value_1=value_1,
+                value_2=value_2))
+    bulk_create(models.DestinationManipulation, manipulations, batch_size)
+
+    dataset = dict((kind, []) for kind in
+                   ['microsite', 'manipulation', 'expired', 'archive'])
+    rows = []
+    for number in xrange(redirects):
+        guid = get_guid(number)
+        buid = number % buids
+        expired = number % expired_every == expired_every - 1
+        rows.append(RedirectFactory.build(
+            guid=guid, buid=buid, url=JOB_URL % number, new_date=new_date,
+            expired_date=expired_date if expired else None,
+            job_title='Job %d' % number))
+        if expired:
+            kind = 'expired'
+        elif buid % 2:
+            kind = 'manipulation'
+        else:
+            kind = 'microsite'
+        dataset[kind].append(guid)
+        if len(rows) == batch_size:
+            bulk_create(models.Redirect, rows, batch_size)
+            rows = []
+    bulk_create(models.Redirect, rows, batch_size)
+
+    rows = []
+    for number in xrange(redirects, redirects + archived):
+        guid = get_guid(number)
+        rows.append(RedirectArchiveFactory.build(
+            guid=guid, buid=number % buids, url=JOB_URL % number,
+            new_date=new_date - timedelta(days=60),
+            expired_date=expired_date - timedelta(days=30)))
+        dataset['archive'].append(guid)
+        if len(rows) == batch_size:
+            bulk_create(models.RedirectArchive, rows, batch_size)
+            rows = []
+    bulk_create(models.RedirectArchive, rows, batch_size)
+
+    for kind, guids in dataset.items():
+        dataset[kind] = [uuid.UUID(braced).hex for braced in guids]
+    dataset['site_id'] = Site.objects.create(
+        domain='syndication.example.jobs', name='Syndication').pk
+    return dataset
+
+
+def get_branches(dataset):
+    """
+    Outputs:
+    :branches: List of (name, guids, query string, extra request headers)
+        for each path through views.home
+    """
+    site = 'my.jobs.site.id=%s' % dataset['site_id']
+    missing = [uuid.UUID(int=(1 << 100) + number).hex
+               for number in xrange(1000)]
+    return [
+        ('microsite', dataset['microsite'], '', {}),
+        ('manipulations', dataset['manipulation'], '', {}),
+        ('custom_queries', dataset['manipulation'], 'z=1&src=bench', {}),
+        ('expired', dataset['expired'], '', {}),
+        ('archive', dataset['archive'], '', {}),
+        ('syndication', dataset['microsite'], site, {}),
+        ('opengraph', dataset['microsite'], '',
+         {'HTTP_USER_AGENT': 'facebookexternalhit/1.1'}),
+        ('not_found', missing, '', {}),
+    ]
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(latencies, queries):
+    """
+    Inputs:
+    :latencies: Milliseconds taken by each request
+    :queries: Total queries made by those requests
+
+    Outputs:
+    :result: Dictionary of requests, latency percentiles and maximum and
+        mean query count
+    """
+    latencies = sorted(latencies)
+    result = {'requests': len(latencies),
+              'max': latencies[-1],
+              'queries': float(queries) / len(latencies)}
+    for percent in PERCENTILES:
+        result['p%d' % percent] = percentile(latencies, percent)
+    return result
+
+
+def clear_caches():
+    cache.clear()
+    registry.reset_all()
+    guid_resolver.clear()
+    job_cache.clear()
+    credential_cache.clear()
+
+
+def time_request(request, guid):
+    """
+    Outputs:
+    :seconds, queries: Time taken by views.home and the number of queries
+        it made across all databases
+    """
+    contexts = [CaptureQueriesContext(connections[alias])
+                for alias in connections]
+    for context in contexts:
+        context.__enter__()
+    try:
+        start = time.time()
+        try:
+            home(request, guid, VIEW_SOURCE)
+        except Http404:
+            pass
+        seconds = time.time() - start
+    finally:
+        for context in contexts:
+            context.__exit__(None, None, None)
+    return seconds, sum(len(context) for context in contexts)
+
+
+def run_benchmark(dataset, iterations=200):
+    """
+    Times views.home for each branch
+
+    Each branch starts with empty caches and one untimed request to load
+    the lookup tables, then requests up to :iterations: other jobs once
+    each.
+
+    Outputs:
+    :results: Dictionary of branch name -> dictionary of requests, latency
+        percentiles and maximum (in milliseconds) and mean query count
+    """
+    factory = RequestFactory()
+    results = {}
+    for name, guids, query, headers in get_branches(dataset):
+        if len(guids) < 2:
+            continue
+        clear_caches()
+        path = '/%s%s' % (guids[0], VIEW_SOURCE)
+        time_request(factory.get(path, QUERY_STRING=query, **headers),
+                     guids[0])
+        step = max((len(guids) - 1) // iterations, 1)
+        guids = guids[1::step][:iterations]
+
+        latencies = []
+        queries = 0
+        for guid in guids:
+            path = '/%s%s' % (guid, VIEW_SOURCE)
+            request = factory.get(path, QUERY_STRING=query, **headers)
+            seconds, count = time_request(request, guid)
+            latencies.append(seconds * 1000)
+            queries += count
+        results[name] = summarize(latencies, queries)
+    return results
+
+
+def time_application(application, path):
+    """
+    Outputs:
+    :seconds, queries: Time taken by a GET for :path: through the WSGI
+        application, and the number of queries it made across all databases
+    """
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': '', 'HTTP_HOST': 'testserver'}
+    setup_testing_defaults(environ)
+    contexts = [CaptureQueriesContext(connections[alias])
+                for alias in connections]
+    for context in contexts:
+        context.__enter__()
+    try:
+        start = time.time()
+        body = application(environ, lambda status, headers: None)
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        seconds = time.time() - start
+    finally:
+        for context in contexts:
+            context.__exit__(None, None, None)
+    return seconds, sum(len(context) for context in contexts)
+
+
+def time_handlers(dataset, iterations=200):
+    """
+    Times microsite clicks through Django's WSGIHandler, with every
+    middleware, and through RedirectDispatcher
+
+    Both handlers get the same jobs, alternating request by request, after
+    one untimed request each to load middleware and lookup tables. Every
+    job is already in the resolver's cache, so that what differs is the
+    work done around the view.
+
+    Outputs:
+    :results: Dictionary like run_benchmark's, with 'handler_full' and
+        'handler_fast' entries
+    """
+    applications = [('handler_full', WSGIHandler()),
+                    ('handler_fast', RedirectDispatcher())]
+    guids = dataset['microsite'][:iterations + 1]
+    paths = ['/%s%s' % (hex_guid, VIEW_SOURCE) for hex_guid in guids]
+    clear_caches()
+    for guid in guids:
+        guid_resolver.resolve('{%s}' % uuid.UUID(guid))
+    latencies = dict((name, []) for name, _ in applications)
+    queries = dict.fromkeys(latencies, 0)
+    for number, path in enumerate(paths):
+        for name, application in applications:
+            seconds, count = time_application(application, path)
+            if number:
+                latencies[name].append(seconds * 1000)
+                queries[name] += count
+    return dict((name, summarize(latencies[name], queries[name]))
+                for name in latencies if latencies[name])
+
+
+def time_query_merges(iterations=200):
+    """
+    Times merging each of QUERIES into each of ATS_URLS with
+    old_replace_or_add_query and with redirect.querystring, alternating
+    pass by pass
+
+    Outputs:
+    :results: Dictionary like run_benchmark's, with 'querystring_old' and
+        'querystring_new' entries; each request is one pass over every
+        url and query
+    """
+    functions = [('querystring_old', old_replace_or_add_query),
+                 ('querystring_new', lambda url, query: merge_query(
+                     url, [get_merge(query)]))]
+    latencies = dict((name, []) for name, _ in functions)
+    for _ in xrange(iterations):
+        for name, function in functions:
+            start = time.time()
+            for url in ATS_URLS:
+                for query in QUERIES:
+                    function(url, query)
+            latencies[name].append((time.time() - start) * 1000)
+    return dict((name, summarize(latencies[name], 0))
+                for name in latencies)
+
+
+def old_is_authorized(username, password):
+    """
+    Webhook authorization as done before redirect.credentials
+    """
+    user = authenticate(username=username, password=password)
+    target = User.objects.get(email=WEBHOOK_USER_EMAIL)
+    return user is not None and user == target
+
+
+def time_authorization(iterations=200, password='benchmark'):
+    """
+    Times checking the webhook user's credentials with old_is_authorized
+    and with credential_cache, alternating call by call
+
+    Inputs:
+    :iterations: Number of times each is called
+    :password: Password given to the webhook user, who is created if
+        missing
+
+    Outputs:
+    :results: Dictionary like run_benchmark's, with 'authorization_old'
+        and 'authorization_new' entries
+    """
+    user, _ = User.objects.get_or_create(email=WEBHOOK_USER_EMAIL)
+    user.set_password(password)
+    user.save()
+    credential_cache.clear()
+
+    functions = [('authorization_old', old_is_authorized),
+                 ('authorization_new', credential_cache.verify)]
+    latencies = dict((name, []) for name, _ in functions)
+    queries = dict((name, 0) for name, _ in functions)
+    for _ in xrange(iterations):
+        for name, function in functions:
+            contexts = [CaptureQueriesContext(connections[alias])
+                        for alias in connections]
+            for context in contexts:
+                context.__enter__()
+            try:
+                start = time.time()
+                authorized = function(WEBHOOK_USER_EMAIL, password)
+                latencies[name].append((time.time() - start) * 1000)
+            finally:
+                for context in contexts:
+                    context.__exit__(None, None, None)
+            assert authorized, '%s rejected the webhook user' % name
+            queries[name] += sum(len(context) for context in contexts)
+    credential_cache.clear()
+    return dict((name, summarize(latencies[name], queries[name]))
+                for name in latencies)
+
+
+def compare(results, baseline, margin=0.25):
+    """
+    Checks benchmark results against a baseline
+
+    Inputs:
+    :results: Output of run_benchmark
+    :baseline: Earlier output of run_benchmark
+    :margin: Fraction by which latencies may exceed the baseline
+
+    Outputs:
+    :failures: List of messages, one per latency more than :margin: over
+        its baseline and per branch making more queries than its baseline
+    """
+    failures = []
+    for name, expected in sorted(baseline.items()):
+        result = results.get(name)
+        if result is None:
+            continue
+        for percent in PERCENTILES:
+            key = 'p%d' % percent
+            limit = expected[key] * (1 + margin)
+            if result[key] > limit:
+                failures.append('%s %s: %.2fms > %.2fms' % (
+                    name, key, result[key], limit))
+        if result['queries'] > expected['queries']:
+            failures.append('%s queries: %.2f > %.2f' % (
+                name, result['queries'], expected['queries']))
+    return failures
+
+
+def format_results(results):
+    lines = ['%-16s %8s %8s %8s %8s %8s %8s' % (
+        'branch', 'requests', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+        'queries')]
+    for name, result in sorted(results.items()):
+        lines.append('%-16s %8d %8.2f %8.2f %8.2f %8.2f %8.2f' % (
+            name, result['requests'], result['p50'], result['p90'],
+            result['p99'], result['max'], result['queries']))
+    return '\n'.join(lines)
@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import uuid
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from myjobs.models import User
+from redirect import batch, registry
+from redirect.helpers import clean_guid
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import (CanonicalMicrositeFactory,
+                                      DestinationManipulationFactory,
+                                      RedirectArchiveFactory, RedirectFactory)
+
+
+def make_guid():
+    return '{%s}' % uuid.uuid4()
+
+
+class BatchResolveTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.redirect = RedirectFactory(guid=make_guid())
+        self.archived = RedirectArchiveFactory(guid=make_guid())
+        CanonicalMicrositeFactory()
+        DestinationManipulationFactory(view_source=10,
+                                       value_1='&codes=DEjn')
+        self.guid = clean_guid(self.redirect.guid)
+        self.archived_guid = clean_guid(self.archived.guid)
+        self.missing_guid = uuid.uuid4().hex
+
+        self.pairs = [(self.guid, '0'), (self.guid, '10'),
+                      (self.guid.upper(), '1604'), (self.archived_guid, '0'),
+                      (self.missing_guid, '0')]
+        self.lines = [json.dumps({'guid': guid, 'vsid': vsid})
+                      for guid, vsid in self.pairs]
+        self.lines.extend(['', 'not json', json.dumps({'guid': 'abc'}),
+                           json.dumps({'guid': self.guid,
+                                       'vsid': u'\u0663'})])
+
+    def tearDown(self):
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def get_location(self, guid, vsid):
+        response = self.client.get(reverse('home', args=[guid, vsid]))
+        return response['Location'] if response.status_code == 301 else None
+
+    def check_results(self, results):
+        self.assertEqual(len(results), 8)
+        for (guid, vsid), result in zip(self.pairs[:3], results):
+            self.assertEqual(result['guid'], guid)
+            self.assertEqual(result['vsid'], vsid)
+            self.assertEqual(result['url'], self.get_location(guid, vsid))
+            self.assertEqual(result['buid'], self.redirect.buid)
+            self.assertFalse(result['expired'])
+        self.assertTrue('codes=DEjn' in results[1]['url'])
+
+        # Expired jobs get a page rather than a redirect, but the url it
+        # links to is the same
+        self.assertTrue(results[3]['expired'])
+        self.assertEqual(results[3]['url'], '%s%s/job/?vs=0' % (
+            CanonicalMicrositeFactory.canonical_microsite_url,
+            self.archived_guid.upper()))
+        self.assertEqual(results[4], {'guid': self.missing_guid, 'vsid': '0',
+                                      'error': 'not found'})
+        self.assertEqual(results[5], {'line': 'not json',
+                                      'error': 'invalid'})
+        self.assertEqual(results[6], {'guid': 'abc', 'vsid': '0',
+                                      'error': 'invalid'})
+        # Only ASCII digits make a view source
+        self.assertEqual(results[7], {'guid': self.guid, 'vsid': u'\u0663',
+                                      'error': 'invalid'})
+
+    def test_resolve(self):
+        self.check_results(list(batch.resolve(batch.parse_pairs(self.lines),
+                                              batch_size=3)))
+
+    def test_bulk_queries(self):
+        guids = [self.guid, self.archived_guid] + [uuid.uuid4().hex
+                                                   for _ in range(50)]
+        pairs = [(guid, '0') for guid in guids]
+        list(batch.resolve(pairs[:1]))
+
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['archive']) as archive:
+            results = list(batch.resolve(pairs))
+        self.assertEqual(len(default.captured_queries), 1)
+        self.assertEqual(len(archive.captured_queries), 1)
+        self.assertEqual([result.get('error') for result in results[:3]],
+                         [None, None, 'not found'])
+
+    def test_view(self):
+        response = self.client.post(reverse('resolve_batch'),
+                                    '\n'.join(self.lines),
+                                    content_type='application/x-ndjson')
+        self.assertTrue('Log in' in response.content)
+
+        User.objects.create_superuser(email='admin@example.com',
+                                      password='secret')
+        self.client.login(username='admin@example.com', password='secret')
+        self.assertEqual(
+            self.client.get(reverse('resolve_batch')).status_code, 405)
+        response = self.client.post(reverse('resolve_batch'),
+                                    '\n'.join(self.lines),
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.check_results([json.loads(line) for line in
+                            ''.join(response.streaming_content).splitlines()])
+
+        with self.settings(BATCH_RESOLVE_MAX_PAIRS=len(self.lines)):
+            response = self.client.post(reverse('resolve_batch'),
+                                        '\n'.join(self.lines),
+                                        content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        with self.settings(BATCH_RESOLVE_MAX_PAIRS=2):
+            response = self.client.post(reverse('resolve_batch'),
+                                        '\n'.join(self.lines),
+                                        content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'pairs.jsonl')
+            with open(path, 'w') as f:
+                f.write('\n'.join(self.lines))
+            stdout = StringIO()
+            call_command('resolve_redirects', path, stdout=stdout)
+            self.check_results([json.loads(line) for line in
+                                stdout.getvalue().splitlines()])
+        finally:
+            shutil.rmtree(directory)
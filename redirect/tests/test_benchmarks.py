@@ -0,0 +1,72 @@
+from django.test import TestCase
+
+from redirect.tests import benchmarks
+
+
+class BenchmarkTests(TestCase):
+    multi_db = True
+
+    def tearDown(self):
+        benchmarks.clear_caches()
+
+    def test_run_benchmark(self):
+        dataset = benchmarks.build_dataset(redirects=200, archived=20,
+                                           buids=40, batch_size=50)
+        self.assertEqual(len(dataset['expired']), 10)
+        self.assertEqual(len(dataset['archive']), 20)
+
+        results = benchmarks.run_benchmark(dataset, iterations=5)
+        self.assertEqual(
+            sorted(results),
+            ['archive', 'custom_queries', 'expired', 'manipulations',
+             'microsite', 'not_found', 'opengraph', 'syndication'])
+        for result in results.values():
+            self.assertEqual(result['requests'], 5)
+            percentiles = [result['p50'], result['p90'], result['p99'],
+                           result['max']]
+            self.assertEqual(percentiles, sorted(percentiles))
+        # Jobs in the archive are looked for in both databases
+        self.assertTrue(results['archive']['queries'] >= 2)
+        self.assertEqual(results['microsite']['queries'], 1)
+        self.assertTrue('microsite' in benchmarks.format_results(results))
+
+    def test_compare(self):
+        baseline = {'microsite': {'p50': 1.0, 'p90': 2.0, 'p99': 4.0,
+                                  'max': 9.0, 'queries': 1.0}}
+        results = {'microsite': {'p50': 1.2, 'p90': 2.6, 'p99': 4.0,
+                                 'max': 50.0, 'queries': 2.0},
+                   'expired': {'p50': 100.0, 'p90': 100.0, 'p99': 100.0,
+                               'max': 100.0, 'queries': 100.0}}
+        failures = benchmarks.compare(results, baseline, margin=0.25)
+        self.assertEqual(failures, ['microsite p90: 2.60ms > 2.50ms',
+                                    'microsite queries: 2.00 > 1.00'])
+        self.assertEqual(benchmarks.compare(results, baseline, margin=0.5),
+                         ['microsite queries: 2.00 > 1.00'])
+
+    def test_time_handlers(self):
+        dataset = benchmarks.build_dataset(redirects=20, archived=0,
+                                           buids=4, batch_size=50)
+        results = benchmarks.time_handlers(dataset, iterations=5)
+        self.assertEqual(sorted(results), ['handler_fast', 'handler_full'])
+        for result in results.values():
+            self.assertEqual(result['requests'], 5)
+            self.assertEqual(result['queries'], 0)
+
+    def test_time_query_merges(self):
+        results = benchmarks.time_query_merges(iterations=5)
+        self.assertEqual(sorted(results),
+                         ['querystring_new', 'querystring_old'])
+        for result in results.values():
+            self.assertEqual(result['requests'], 5)
+            self.assertEqual(result['queries'], 0)
+
+    def test_time_authorization(self):
+        results = benchmarks.time_authorization(iterations=5)
+        self.assertEqual(sorted(results),
+                         ['authorization_new', 'authorization_old'])
+        for result in results.values():
+            self.assertEqual(result['requests'], 5)
+        # After the first call, cached credentials need one query to check
+        # that the password is unchanged
+        self.assertLess(results['authorization_new']['queries'],
+                        results['authorization_old']['queries'])
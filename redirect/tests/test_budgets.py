@@ -0,0 +1,123 @@
+import base64
+import shutil
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from testfixtures import LogCapture, Replacer
+
+from myjobs.models import User
+from redirect import budgets, registry, timing
+from redirect.credentials import credential_cache
+from redirect.helpers import clean_guid
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import (CanonicalMicrositeFactory,
+                                      DestinationManipulationFactory,
+                                      RedirectArchiveFactory,
+                                      RedirectFactory)
+
+
+@override_settings(QUERY_BUDGET_CHECK='raise', REQUEST_TIMING=True)
+class QueryBudgetTests(TestCase):
+    """
+    Every branch in budgets.BUDGETS is exercised here; a change that makes
+    one of them query or hit the cache more fails with BudgetExceeded.
+    """
+    def setUp(self):
+        self.redirect = RedirectFactory(buid=1)
+        CanonicalMicrositeFactory(buid=1)
+        self.queue_dir = tempfile.mkdtemp()
+        timing.histograms.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.queue_dir)
+        timing.histograms.clear()
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def get(self, redirect, vsid='', **kwargs):
+        """
+        Requests :redirect: once to load the registries, then again with a
+        cold resolver and every registry due for a generation check, which
+        is what the budgets are for
+        """
+        path = reverse('home', args=[clean_guid(redirect.guid) + vsid])
+        # As if the fixtures' transaction had committed; otherwise the first
+        # request to finish bumps the generations and the second rebuilds
+        registry.invalidate_pending()
+        self.client.get(path, **kwargs)
+        guid_resolver.clear()
+        with override_settings(REGISTRY_CHECK_INTERVAL=0):
+            response = self.client.get(path, **kwargs)
+        self.assertEqual(timing.histograms.get_stats()['requests'], 2)
+        return response
+
+    def test_microsite(self):
+        response = self.get(self.redirect)
+        self.assertTrue('/job/?vs=' in response['Location'])
+
+    def test_manipulations(self):
+        # No view source 20 manipulation; falls back to view source 0
+        redirect = RedirectFactory(buid=2, guid='{%s}' % uuid.uuid4())
+        DestinationManipulationFactory(buid=2, view_source=0)
+        self.get(redirect, vsid='20')
+
+    def test_archive(self):
+        response = self.get(
+            RedirectArchiveFactory(guid='{%s}' % uuid.uuid4()))
+        self.assertEqual(response.status_code, 410)
+
+    def test_syndication(self):
+        site = Site.objects.get_current()
+        self.get(self.redirect, data={'my.jobs.site.id': site.id})
+
+    def test_opengraph(self):
+        with Replacer() as r:
+            r.replace('redirect.cards.job_cache.get_job',
+                      lambda guid, timeout=None: None)
+            self.get(self.redirect,
+                     HTTP_USER_AGENT='facebookexternalhit/1.1')
+
+    def test_email_redirect(self):
+        registry.exclusion_table.get()
+        credential_cache.clear()
+        user = User.objects.create(email='accounts@my.jobs')
+        user.set_password('secret')
+        user.save()
+        auth = 'Basic %s' % base64.b64encode('accounts%40my.jobs:secret')
+        with override_settings(EMAIL_QUEUE_DIR=self.queue_dir):
+            response = self.client.post(
+                reverse('email_redirect'), HTTP_AUTHORIZATION=auth,
+                data={'to': 'to@example.com', 'from': 'from@example.com',
+                      'text': '', 'html': '', 'subject': 'Hi',
+                      'attachments': 0})
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_buid(self):
+        registry.exclusion_table.get()
+        DestinationManipulationFactory(buid=1)
+        response = self.client.get(
+            reverse('update_buid'), {'key': settings.BUID_API_KEY,
+                                     'old_buid': 1, 'new_buid': 3})
+        self.assertEqual(response.status_code, 200)
+
+    def test_overrun(self):
+        zero = budgets.Budget(queries=0, cache=0)
+        with Replacer() as r:
+            r.replace('redirect.budgets.BUDGETS', {'microsite': zero})
+            self.assertRaises(budgets.BudgetExceeded, self.get,
+                              self.redirect)
+
+            guid_resolver.clear()
+            with override_settings(QUERY_BUDGET_CHECK='warn'):
+                with LogCapture('redirect.middleware') as log:
+                    self.client.get(reverse(
+                        'home', args=[clean_guid(self.redirect.guid)]))
+            self.assertTrue('microsite: 1 queries > 0' in
+                            str(log.records[0].getMessage()))
@@ -0,0 +1,112 @@
+from StringIO import StringIO
+
+import pysolr
+from testfixtures import Replacer
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from redirect.cards import CardCache, card_cache, get_bot_view_source
+from redirect.helpers import clean_guid
+from redirect.solr import job_cache
+from redirect.tests.factories import RedirectFactory
+
+
+class Results(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.hits = len(docs)
+
+
+class CardCacheTests(TestCase):
+    def setUp(self):
+        self.redirect = RedirectFactory()
+        self.guid = clean_guid(self.redirect.guid).upper()
+        self.cards = CardCache(timeout=60, stale=60, solr_timeout=0.5)
+        self.docs = [{'description': 'Weaves baskets',
+                      'company_exact': 'DirectEmployers'}]
+        self.queries = []
+        self.threads = []
+
+        def search(solr, q=None, **kwargs):
+            self.queries.append((q, solr.timeout))
+            if self.docs is None:
+                raise pysolr.SolrError('Solr is down')
+            return Results(self.docs)
+
+        def start_thread(function, *args):
+            self.threads.append(function)
+            function(*args)
+
+        self.r = Replacer()
+        self.r.replace('pysolr.Solr.search', search)
+        self.r.replace('redirect.cards.start_thread', start_thread)
+
+    def tearDown(self):
+        self.r.restore()
+        cache.clear()
+        job_cache.clear()
+
+    def test_bot_view_sources(self):
+        self.assertEqual(get_bot_view_source('facebookexternalhit/1.1'),
+                         '1593')
+        self.assertEqual(get_bot_view_source('Twitterbot/1.0'), '1596')
+        self.assertEqual(get_bot_view_source('LinkedInBot/1.0'), '1548')
+        self.assertIsNone(get_bot_view_source('Mozilla/5.0'))
+
+    def test_cards_are_cached(self):
+        body = self.cards.get(self.redirect, self.guid, '1596')
+        self.assertTrue('Weaves baskets' in body)
+        self.assertEqual(len(self.queries), 1)
+        # Bots wait at most solr_timeout seconds for a card
+        self.assertEqual(self.queries[0][1], 0.5)
+
+        job_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.cards.get(self.redirect, self.guid, '1596'), body)
+        self.assertEqual(len(self.queries), 1)
+
+        body = self.cards.get(self.redirect, self.guid, '1593')
+        self.assertTrue('My.jobs - Programmer - DirectEmployers' in body)
+        self.assertEqual(len(self.queries), 1)
+
+    def test_stale_cards_are_served_while_refreshing(self):
+        old = self.cards.get(self.redirect, self.guid, '1596')
+        key = self.cards.get_key(self.guid, '1596')
+        cache.set(key, (0, old))
+        self.docs[0]['description'] = 'Weaves better baskets'
+        job_cache.clear()
+
+        self.assertEqual(self.cards.get(self.redirect, self.guid, '1596'),
+                         old)
+        self.assertEqual(len(self.threads), 1)
+        self.assertTrue('Weaves better baskets' in
+                        self.cards.get(self.redirect, self.guid, '1596'))
+        self.assertEqual(len(self.threads), 1)
+
+    def test_solr_failure_falls_back(self):
+        self.docs = None
+        body = self.cards.get(self.redirect, self.guid, '1596')
+        self.assertTrue('Programmer in Indianapolis' in body)
+
+        # The fallback card is replaced as soon as Solr answers again
+        self.docs = [{'description': 'Weaves baskets'}]
+        self.assertEqual(self.cards.get(self.redirect, self.guid, '1596'),
+                         body)
+        self.assertEqual(len(self.threads), 1)
+        self.assertTrue('Weaves baskets' in
+                        self.cards.get(self.redirect, self.guid, '1596'))
+
+    def test_render_cards_command(self):
+        RedirectFactory(guid='{22345678-90ab-cdef-1234-567890abcdef}',
+                        job_title='Old job', new_date=self.redirect.new_date
+                        .replace(year=2000))
+        call_command('render_cards', hours=1, stdout=StringIO())
+
+        for view_source in ['1593', '1596', '1548']:
+            key = card_cache.get_key(self.guid, view_source)
+            self.assertIsNotNone(cache.get(key))
+        key = card_cache.get_key('22345678' + self.guid[8:], '1593')
+        self.assertIsNone(cache.get(key))
@@ -0,0 +1,195 @@
+from datetime import datetime
+from StringIO import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+from testfixtures import LogCapture, Replacer
+
+from myjobs.models import User
+from redirect import registry
+from redirect.clickcounts import (MAX_FLUSH_ATTEMPTS,
+                                  OUT_OF_RANGE_VIEW_SOURCE, ClickCounter,
+                                  _add_clicks, click_counter, get_hour,
+                                  get_merge_cutoff, merge_days)
+from redirect.helpers import clean_guid
+from redirect.models import ClickRollup
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import RedirectFactory
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def get_rollups(period=ClickRollup.HOUR):
+    return sorted(ClickRollup.objects.filter(period=period).values_list(
+        'start', 'buid', 'view_source', 'clicks'))
+
+
+class ClickCounterTests(TestCase):
+    def setUp(self):
+        # A long interval keeps the flusher thread out of the way
+        self.counter = ClickCounter(3600)
+
+    def tearDown(self):
+        self.counter.stop()
+        click_counter.stop()
+        click_counter.clear()
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def test_flush(self):
+        self.assertIsNone(self.counter.flush())
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 5))
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 55))
+        self.counter.increment(1, 0, datetime(2014, 6, 1, 10, 30))
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 11, 0))
+        self.assertEqual(self.counter.flush(), 3)
+        self.assertEqual(get_rollups(),
+                         [(utc(2014, 6, 1, 10), 1, 0, 1),
+                          (utc(2014, 6, 1, 10), 1, 20, 2),
+                          (utc(2014, 6, 1, 11), 1, 20, 1)])
+
+        # Later flushes add to the same hours
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 59))
+        self.counter.increment(2, 20, datetime(2014, 6, 1, 10, 59))
+        self.counter.flush()
+        self.assertEqual(get_rollups(),
+                         [(utc(2014, 6, 1, 10), 1, 0, 1),
+                          (utc(2014, 6, 1, 10), 1, 20, 3),
+                          (utc(2014, 6, 1, 10), 2, 20, 1),
+                          (utc(2014, 6, 1, 11), 1, 20, 1)])
+        self.assertEqual(self.counter.get_stats(),
+                         {'clicks': 6, 'flushes': 2, 'written': 5,
+                          'errors': 0, 'dropped': 0, 'pending': 0})
+
+    def test_failed_flush(self):
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 5))
+        with Replacer() as r, LogCapture('redirect.clickcounts') as log:
+            r.replace('redirect.clickcounts._add_clicks',
+                      lambda period, counts: 1 / 0)
+            self.assertIsNone(self.counter.flush())
+        self.assertEqual(len(log.records), 1)
+        self.assertEqual(self.counter.get_stats()['pending'], 1)
+
+        # The counts are kept for the next flush
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 6))
+        self.counter.flush()
+        self.assertEqual(get_rollups(), [(utc(2014, 6, 1, 10), 1, 20, 2)])
+
+    def test_out_of_range_view_source(self):
+        """
+        View sources too large for the column are counted under a sentinel
+        rather than failing every later flush.
+        """
+        self.counter.increment(1, 10 ** 20, datetime(2014, 6, 1, 10, 5))
+        self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 5))
+        self.assertEqual(self.counter.flush(), 2)
+        self.assertEqual(get_rollups(),
+                         [(utc(2014, 6, 1, 10), 1, OUT_OF_RANGE_VIEW_SOURCE,
+                           1),
+                          (utc(2014, 6, 1, 10), 1, 20, 1)])
+
+    def test_bad_row_is_dropped(self):
+        """
+        A row that can't be written doesn't hold up the others, and is
+        given up on after MAX_FLUSH_ATTEMPTS flushes.
+        """
+        def add_clicks(period, counts):
+            if (1, 99) in [key[1:] for key in counts]:
+                raise ValueError('bad row')
+            _add_clicks(period, counts)
+
+        with Replacer() as r, LogCapture('redirect.clickcounts') as log:
+            r.replace('redirect.clickcounts._add_clicks', add_clicks)
+            self.counter.increment(1, 99, datetime(2014, 6, 1, 10, 5))
+            for _ in range(MAX_FLUSH_ATTEMPTS):
+                self.counter.increment(1, 20, datetime(2014, 6, 1, 10, 5))
+                self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(get_rollups(),
+                         [(utc(2014, 6, 1, 10), 1, 20, MAX_FLUSH_ATTEMPTS)])
+        stats = self.counter.get_stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['errors'], MAX_FLUSH_ATTEMPTS)
+        self.assertEqual(log.records[-1].levelname, 'ERROR')
+        self.assertTrue('Dropped 1 clicks' in log.records[-1].getMessage())
+
+    def test_merge_days(self):
+        for hour, clicks in [(0, 1), (23, 2)]:
+            ClickRollup.objects.create(start=utc(2014, 6, 1, hour), buid=1,
+                                       view_source=20, clicks=clicks)
+        ClickRollup.objects.create(start=utc(2014, 6, 2, 5), buid=1,
+                                   view_source=20, clicks=4)
+        ClickRollup.objects.create(period=ClickRollup.DAY,
+                                   start=utc(2014, 6, 1), buid=1,
+                                   view_source=20, clicks=10)
+        self.assertEqual(merge_days(utc(2014, 6, 2)), (2, 1))
+        self.assertEqual(get_rollups(ClickRollup.DAY),
+                         [(utc(2014, 6, 1), 1, 20, 13)])
+        self.assertEqual(get_rollups(), [(utc(2014, 6, 2, 5), 1, 20, 4)])
+        self.assertEqual(merge_days(utc(2014, 6, 2)), (0, 0))
+
+        self.assertEqual(get_merge_cutoff(1, utc(2014, 6, 3, 12)),
+                         utc(2014, 6, 2))
+        stdout = StringIO()
+        call_command('merge_click_rollups', stdout=stdout)
+        self.assertTrue('Merged 1 hourly counts' in stdout.getvalue())
+        self.assertEqual(get_rollups(ClickRollup.DAY),
+                         [(utc(2014, 6, 1), 1, 20, 13),
+                          (utc(2014, 6, 2), 1, 20, 4)])
+
+    def test_merge_keeps_rows_added_meanwhile(self):
+        """
+        An hourly row a flush inserts while a merge runs wasn't read by it,
+        so it isn't deleted either.
+        """
+        ClickRollup.objects.create(start=utc(2014, 6, 1, 1), buid=1,
+                                   view_source=20, clicks=1)
+
+        def add_clicks(period, counts):
+            ClickRollup.objects.create(start=utc(2014, 6, 1, 2), buid=1,
+                                       view_source=20, clicks=5)
+            _add_clicks(period, counts)
+
+        with Replacer() as r:
+            r.replace('redirect.clickcounts.add_clicks', add_clicks)
+            self.assertEqual(merge_days(utc(2014, 6, 2)), (1, 1))
+        self.assertEqual(get_rollups(ClickRollup.DAY),
+                         [(utc(2014, 6, 1), 1, 20, 1)])
+        self.assertEqual(get_rollups(), [(utc(2014, 6, 1, 2), 1, 20, 5)])
+
+    def test_click(self):
+        redirect = RedirectFactory()
+        with Replacer() as r:
+            r.replace('redirect.clickcounts.click_counter.flush_interval',
+                      3600)
+            self.client.get(reverse('home', args=[clean_guid(redirect.guid),
+                                                  '20']))
+            self.client.get(reverse('home', args=[clean_guid(redirect.guid),
+                                                  '20']) + '+')
+            # Apply clicks count toward the view source they carry
+            self.client.get(reverse('home', args=[clean_guid(redirect.guid),
+                                                  '20']), {'vs': '30'})
+            click_counter.stop()
+        self.assertEqual(get_rollups(),
+                         [(get_hour(), redirect.buid, 20, 1),
+                          (get_hour(), redirect.buid, 30, 1)])
+
+    def test_admin(self):
+        ClickRollup.objects.create(start=utc(2014, 6, 1), buid=1,
+                                   view_source=20, clicks=5)
+        User.objects.create_superuser(email='admin@example.com',
+                                      password='secret')
+        self.client.login(username='admin@example.com', password='secret')
+        response = self.client.get(
+            reverse('admin:redirect_clickrollup_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.context['cl'].result_list[0].clicks, 5)
+        response = self.client.get(reverse('admin:redirect_clickrollup_add'))
+        self.assertEqual(response.status_code, 403)
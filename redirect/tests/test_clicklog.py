@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from testfixtures import LogCapture, Replacer
+
+from redirect import registry
+from redirect.clicklog import ClickLog, click_log, read_events
+from redirect.helpers import clean_guid
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import CanonicalMicrositeFactory, RedirectFactory
+
+
+class ClickLogTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # A long interval keeps the flusher thread out of the way
+        self.log = ClickLog(self.directory, 4, 3600)
+
+    def tearDown(self):
+        self.log.stop()
+        click_log.stop()
+        shutil.rmtree(self.directory)
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+        click_log.clear()
+
+    def test_flush(self):
+        self.assertIsNone(self.log.flush())
+        self.log.record({'guid': 'A', 'vsid': '0'})
+        self.log.record({'guid': 'B', 'vsid': '20'})
+        path = self.log.flush()
+        self.assertTrue(os.path.basename(path).startswith('clicks-'))
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+
+        self.log.record({'guid': 'C', 'vsid': '0'})
+        self.log.flush()
+        self.assertEqual([event['guid'] for event in
+                          read_events([self.directory])], ['A', 'B', 'C'])
+        self.assertEqual(list(read_events([path])),
+                         [{'guid': 'A', 'vsid': '0'},
+                          {'guid': 'B', 'vsid': '20'}])
+        self.assertEqual(self.log.get_stats(),
+                         {'recorded': 3, 'dropped': 0, 'written': 3,
+                          'segments': 2, 'errors': 0, 'buffered': 0})
+
+    def test_full_buffer(self):
+        for index in range(6):
+            self.log.record({'index': index})
+        stats = self.log.get_stats()
+        self.assertEqual((stats['recorded'], stats['dropped'],
+                          stats['buffered']), (4, 2, 4))
+        self.log.flush()
+        self.assertEqual([event['index'] for event in
+                          read_events([self.directory])], [0, 1, 2, 3])
+
+    def test_write_error(self):
+        self.log.directory = os.path.join(self.directory, 'missing')
+        self.log.record({'guid': 'A'})
+        with LogCapture('redirect.clicklog') as log:
+            self.assertIsNone(self.log.flush())
+        self.assertEqual(len(log.records), 1)
+        stats = self.log.get_stats()
+        self.assertEqual((stats['errors'], stats['written'],
+                          stats['buffered']), (1, 0, 0))
+
+    def test_click(self):
+        redirect = RedirectFactory()
+        microsite = CanonicalMicrositeFactory()
+        guid = clean_guid(redirect.guid).upper()
+        with Replacer() as r:
+            r.replace('redirect.clicklog.click_log.directory', self.directory)
+            r.replace('redirect.clicklog.click_log.flush_interval', 3600)
+            response = self.client.get(
+                reverse('home', args=[guid, '20']),
+                HTTP_REFERER='http://example.com/jobs')
+            click_log.stop()
+        events = list(read_events([self.directory]))
+        self.assertEqual(len(events), 1)
+        event = events[0]
+        self.assertEqual(event['guid'], guid)
+        self.assertEqual(event['buid'], redirect.buid)
+        self.assertEqual(event['vsid'], '20')
+        self.assertEqual(event['status'], 301)
+        self.assertEqual(event['url'], response['Location'])
+        self.assertTrue(event['url'].startswith(
+            microsite.canonical_microsite_url))
+        self.assertEqual(event['referer'], 'http://example.com/jobs')
+        self.assertEqual(event['aguid'], response.cookies['aguid'].value)
+        self.assertFalse(event['expired'])
+        self.assertIsNone(event['bot'])
+        self.assertTrue(event['latency'] >= 0)
+
+    def test_disabled(self):
+        self.assertFalse(click_log.enabled)
+        redirect = RedirectFactory()
+        self.client.get(reverse('home', args=[clean_guid(redirect.guid)]))
+        self.assertEqual(click_log.get_stats()['recorded'], 0)
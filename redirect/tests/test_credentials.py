@@ -0,0 +1,64 @@
+import uuid
+
+from django.contrib.auth import authenticate
+from django.test import TestCase
+from testfixtures import Replacer
+
+from myjobs.models import User
+from redirect.credentials import CredentialCache
+
+
+class CredentialCacheTests(TestCase):
+    def setUp(self):
+        self.cache = CredentialCache()
+        self.user = User.objects.create(email='accounts@my.jobs')
+        self.user.set_password('secret')
+        self.user.save()
+
+    def test_verify(self):
+        self.assertFalse(self.cache.verify('accounts@my.jobs', 'wrong'))
+        self.assertTrue(self.cache.verify('accounts@my.jobs', 'secret'))
+        # Cached credentials need one query instead of a password hash
+        with self.assertNumQueries(1):
+            self.assertTrue(self.cache.verify('accounts@my.jobs', 'secret'))
+        self.assertFalse(self.cache.verify('accounts@my.jobs', 'wrong'))
+        self.assertTrue(self.cache.verify('accounts@my.jobs', 'secret'))
+
+    def test_other_users_are_rejected(self):
+        user = User.objects.create(email='someone@example.com',
+                                   user_guid=uuid.uuid4().hex)
+        user.set_password('secret')
+        user.save()
+        self.assertFalse(self.cache.verify('someone@example.com', 'secret'))
+
+    def test_password_change_invalidates(self):
+        self.assertTrue(self.cache.verify('accounts@my.jobs', 'secret'))
+        # Changed by some other process, so no signals reach this cache
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new secret')
+        User.objects.filter(pk=user.pk).update(password=user.password)
+
+        self.assertFalse(self.cache.verify('accounts@my.jobs', 'secret'))
+        self.assertTrue(self.cache.verify('accounts@my.jobs', 'new secret'))
+
+    def test_cached_credentials_skip_hashing(self):
+        """
+        Once accepted, the same credentials are checked against the cached
+        HMAC rather than by hashing the password again.
+        """
+        calls = []
+
+        def counting_authenticate(**credentials):
+            calls.append(credentials['username'])
+            return authenticate(**credentials)
+
+        with Replacer() as r:
+            r.replace('redirect.credentials.authenticate',
+                      counting_authenticate)
+            for _ in range(5):
+                self.assertTrue(self.cache.verify('accounts@my.jobs',
+                                                  'secret'))
+            self.assertEqual(len(calls), 1)
+
+            self.assertFalse(self.cache.verify('accounts@my.jobs', 'wrong'))
+            self.assertEqual(len(calls), 2)
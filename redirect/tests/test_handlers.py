@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from wsgiref.util import setup_testing_defaults
+
+from redirect import registry
+from redirect.handlers import RedirectDispatcher, RedirectHandler
+from redirect.helpers import clean_guid
+from redirect.middleware import ExcludedViewSourceMiddleware
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import CanonicalMicrositeFactory, RedirectFactory
+
+
+def call(application, path, host='testserver'):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': '', 'HTTP_HOST': host}
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = dict(headers)
+
+    body = application(environ, start_response)
+    response['body'] = ''.join(body)
+    body.close()
+    return response
+
+
+class RedirectHandlerTests(TestCase):
+    def setUp(self):
+        self.redirect = RedirectFactory()
+        self.microsite = CanonicalMicrositeFactory()
+        self.path = '/%s' % clean_guid(self.redirect.guid)
+
+    def tearDown(self):
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def test_dispatch(self):
+        calls = []
+
+        def make_application(name):
+            def application(environ, start_response):
+                calls.append((name, environ['PATH_INFO']))
+                return []
+            return application
+
+        dispatcher = RedirectDispatcher(make_application('redirect'),
+                                        make_application('full'))
+        for path in [self.path, self.path + '20', self.path + '20+',
+                     '/email', '/ajax/', '/admin/', '/']:
+            dispatcher({'PATH_INFO': path}, None)
+        self.assertEqual(calls, [('redirect', self.path),
+                                 ('redirect', self.path + '20'),
+                                 ('full', self.path + '20+'),
+                                 ('full', '/email'), ('full', '/ajax/'),
+                                 ('full', '/admin/'), ('full', '/')])
+
+    def test_middleware(self):
+        handler = RedirectHandler()
+        handler.load_middleware()
+        self.assertEqual(
+            [method.im_class for method in handler._request_middleware][-1],
+            ExcludedViewSourceMiddleware)
+        # Timing and query budgets are off unless the settings ask for them
+        self.assertEqual(len(handler._request_middleware), 2)
+
+        with override_settings(REQUEST_TIMING=True,
+                               QUERY_BUDGET_CHECK='warn'):
+            handler.load_middleware()
+        self.assertEqual(len(handler._request_middleware), 4)
+
+    def test_redirect(self):
+        dispatcher = RedirectDispatcher()
+        with override_settings(DEBUG_PROPAGATE_EXCEPTIONS=True):
+            response = call(dispatcher, self.path)
+        self.assertEqual(response['status'], 301)
+        self.assertEqual(
+            response['headers']['Location'],
+            '%s%s/job/?vs=0' % (self.microsite.canonical_microsite_url,
+                                clean_guid(self.redirect.guid).upper()))
+        self.assertTrue('jcnlx.url=' in response['headers']['X-REDIRECT'])
+
+        # The full handler gives the same answer
+        self.assertEqual(call(dispatcher.handler, self.path)['headers'][
+            'Location'], response['headers']['Location'])
+
+        with override_settings(ALLOWED_HOSTS=['my.jobs']):
+            self.assertEqual(call(dispatcher, self.path)['status'], 400)
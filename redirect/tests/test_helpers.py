@@ -1,6 +1,7 @@
 from django.test import TestCase
 
 from redirect import helpers
+from redirect.registry import make_campaign
 
 
 class HelperTests(TestCase):
@@ -24,3 +25,45 @@ class HelperTests(TestCase):
                                      self.params['value']))
         body = self.add_part()
         self.assertEqual(body, expected)
+
+
+class CampaignTests(TestCase):
+    """
+    Campaign parameters appended directly must match what
+    replace_or_add_query produces.
+    """
+    urls = [
+        'http://www.my.jobs/1234/job/?vs=10',
+        u'http://www.my.jobs/1234/job/?vs=10',
+        'http://www.my.jobs/1234/job/',
+        'http://www.my.jobs/1234/job/?',
+        'https://example.com?vs=10&z=1&foo=',
+        u'http://example.com/\u044d\u0442\u043e/?vs=1',
+        'http://example.com/job/?vs=10&UTM_Source=other',
+        'http://example.com/job/?vs=10&utm_medium',
+        'http://example.com/job/?a=b%20c&vs=10',
+        'http://example.com/job/?a=b+c',
+        'http://example.com/job/?a=1?b=2',
+        'http://example.com/job/#anchor',
+        'http://example.com/job;params?vs=1',
+        'example.com/job/?vs=1',
+    ]
+    names = [('Indeed', 'Job Boards'), (u'Caf\xe9 & Co', 'a=b'),
+             ('100%', 'utm_source')]
+
+    def test_matches_replace_or_add_query(self):
+        for source, group in self.names:
+            campaign = make_campaign(source, group)
+            for url in self.urls:
+                expected = helpers.replace_or_add_query(url, campaign.query)
+                fast = helpers.append_campaign(url, campaign)
+                if fast is not None:
+                    self.assertEqual(fast, expected)
+                    self.assertEqual(type(fast), type(expected))
+
+    def test_simple_urls_skip_parsing(self):
+        campaign = make_campaign('Indeed', 'Job Boards')
+        for url in self.urls[:6]:
+            self.assertIsNotNone(helpers.append_campaign(url, campaign))
+        for url in self.urls[6:]:
+            self.assertIsNone(helpers.append_campaign(url, campaign))
@@ -0,0 +1,60 @@
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from redirect import importprofile
+from redirect.lazy import LazyModule
+
+
+class LazyModuleTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'lazy_example.py'), 'w') as f:
+            f.write('import lazy_nested\nVALUE = 1\n')
+        with open(os.path.join(self.directory, 'lazy_nested.py'), 'w') as f:
+            f.write('VALUE = 2\n')
+        sys.path.insert(0, self.directory)
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        shutil.rmtree(self.directory)
+        for name in ['lazy_example', 'lazy_nested']:
+            sys.modules.pop(name, None)
+
+    def test_lazy_module(self):
+        module = LazyModule('lazy_example')
+        self.assertFalse('lazy_example' in sys.modules)
+        self.assertEqual(module.VALUE, 1)
+        self.assertIs(module.load(), sys.modules['lazy_example'])
+
+        module.VALUE = 3
+        self.assertEqual(sys.modules['lazy_example'].VALUE, 3)
+
+    def test_import_profiler(self):
+        profiler = importprofile.ImportProfiler()
+        profiler.install()
+        try:
+            __import__('lazy_example')
+            # Already loaded, so not recorded again
+            __import__('lazy_example')
+        finally:
+            profiler.uninstall()
+        self.assertEqual(sorted(profiler.times),
+                         ['lazy_example', 'lazy_nested'])
+        inclusive, own = profiler.times['lazy_example']
+        self.assertTrue(inclusive >= profiler.times['lazy_nested'][0])
+        self.assertTrue(own <= inclusive)
+
+    def test_worker_skips_deferred_libraries(self):
+        out = StringIO()
+        call_command('profile_imports', limit=1000, stdout=out)
+        self.assertTrue('redirect.views' in out.getvalue())
+
+        self.assertRaises(CommandError, call_command, 'profile_imports',
+                          target=0.001, stdout=StringIO())
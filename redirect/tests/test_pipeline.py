@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import inspect
+
+from django.test import TestCase
+
+from redirect import actions, pipeline
+from redirect.models import DestinationManipulation, Redirect
+from redirect.registry import Manipulation
+
+
+URLS = [
+    'http://www.directemployers.org',
+    'http://www.directemployers.org/job?src=de&foo=bar',
+    'http://www.directemployers.org/job/?a=1&b=2#anchor',
+    'http://example.com/jobdetail.ftl?job=1#one#two',
+    u'http://example.com/это?q=%20%3d,%2b',
+    'jobsearch.lilly.com/ddddddd/job/&8888888&vs=43',
+    'http://ad.doubleclick.net/clk;2526;8138?http://example.com/job',
+    '',
+]
+
+VALUES = [
+    ('', ''),
+    ('?src=foo', '&codes=bar'),
+    ('&src=JB-DE', ''),
+    ('job', 'apply'),
+    ('/job!!!!/apply', '&src=foo'),
+    ('!!!!/apply', ''),
+    ('/job!!!!', '?x=1'),
+    ('a!!!!b!!!!c', 'd'),
+    ('=bad', '#'),
+    ('http://ad.doubleclick.net/clk;2613;950;s?', 'http://example.com/'),
+]
+
+
+def get_actions():
+    """
+    Every manipulation function that redirect.actions exposes
+    """
+    return [name for name, function
+            in inspect.getmembers(actions, inspect.isfunction)
+            if function.__module__ == actions.__name__]
+
+
+def run_old(action, url, value_1, value_2):
+    redirect = Redirect(url=url)
+    manipulation = DestinationManipulation(action=action, value_1=value_1,
+                                           value_2=value_2)
+    return getattr(actions, action)(redirect, manipulation)
+
+
+def run_compiled(action, url, value_1, value_2):
+    manipulation = Manipulation(1, action, value_1, value_2, 0)
+    return pipeline.compile_action(manipulation)(url)
+
+
+class CompiledActionTests(TestCase):
+    def test_actions_match_redirect_actions(self):
+        """
+        Every action produces the same url (or raises the same error) whether
+        it goes through redirect.actions or a compiled pipeline step.
+        """
+        self.assertTrue('cframe' in get_actions())
+        for action in get_actions():
+            for url in URLS:
+                for value_1, value_2 in VALUES:
+                    args = (action, url, value_1, value_2)
+                    try:
+                        expected = run_old(*args)
+                    except Exception as e:
+                        self.assertRaises(type(e), run_compiled, *args)
+                    else:
+                        self.assertEqual(run_compiled(*args), expected,
+                                         'Mismatch for %r' % (args, ))
+
+    def test_unknown_action(self):
+        for action in ['notanaction', None, 'redirect']:
+            manipulation = Manipulation(1, action, '', '', 0)
+            self.assertIsNone(pipeline.compile_action(manipulation))
+
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        self.url = 'http://www.directemployers.org/job'
+
+    def test_runs_steps_in_order(self):
+        compiled = pipeline.Pipeline([
+            Manipulation(1, 'sourcecodetag', '?src=foo', '', 0),
+            Manipulation(2, 'doubleclickwrap', 'http://dc.example/?', '', 0)])
+        self.assertEqual(compiled.run(self.url),
+                         'http://dc.example/?%s?src=foo' % self.url)
+
+    def test_custom_query_placement(self):
+        """
+        Custom queries are added before wrap actions and after the final
+        action otherwise, never twice.
+        """
+        compiled = pipeline.Pipeline([
+            Manipulation(1, 'sourcecodetag', '?src=foo', '', 0)])
+        self.assertEqual(compiled.run(self.url, '&z=1&foo=bar&vs=2'),
+                         self.url + '?src=foo&foo=bar')
+
+        compiled = pipeline.Pipeline([
+            Manipulation(1, 'doubleclickwrap', 'http://dc.example/?', '', 0)])
+        self.assertEqual(compiled.run(self.url, '&foo=bar'),
+                         'http://dc.example/?%s?foo=bar' % self.url)
+
+    def test_unknown_actions_are_skipped(self):
+        compiled = pipeline.Pipeline([
+            Manipulation(1, 'notanaction', '', '', 0)])
+        debug_content = ['GUID=test']
+        self.assertIsNone(compiled.run(self.url, None, debug_content))
+        self.assertEqual(debug_content[-1],
+                         'ActionTypeID=1 Action=notanaction')
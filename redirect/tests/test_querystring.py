@@ -0,0 +1,122 @@
+import random
+
+from django.test import TestCase
+
+from redirect.querystring import QueryMerge, get_merge, merge_query
+from redirect.tests.benchmarks import old_replace_or_add_query
+
+
+# Building blocks for generated urls; chosen to hit percent-encoding,
+# '+', ';', blank values, case differences and repeated keys
+SCHEMES = ['http://', 'https://', 'HTTP://', 'ftp://', '', '//']
+HOSTS = ['example.com', 'www.my.jobs', 'user@host:8080', '[::1]', '']
+PATHS = ['', '/', '/job/', '/a;b/c', '/a/b;p', '/%7Euser/', '/x y', '/?']
+KEYS = ['vs', 'VS', 'z', 'src', 'Src', 'a b', 'a+b', 'a%20b', 'k%2C',
+        'my.jobs.site.id', '', 'utm_source', '%', '%zz', 'caf%C3%A9']
+VALUES = ['', '1', 'x y', 'x+y', 'x%2By', '%2c', 'a,b', 'a=b', '%',
+          '%E2%82%AC', '/', '?', '~']
+SEPARATORS = ['&', '&', '&', ';', '&&']
+
+
+def random_query(rand, size):
+    pairs = []
+    for _ in range(size):
+        key = rand.choice(KEYS)
+        if rand.random() < 0.1:
+            pairs.append(key)
+        else:
+            pairs.append('%s=%s' % (key, rand.choice(VALUES)))
+    query = ''
+    for pair in pairs:
+        if query:
+            query += rand.choice(SEPARATORS)
+        query += pair
+    return query
+
+
+def random_url(rand):
+    url = rand.choice(SCHEMES) + rand.choice(HOSTS) + rand.choice(PATHS)
+    if rand.random() < 0.8:
+        url += '?' + random_query(rand, rand.randint(0, 5))
+    if rand.random() < 0.2:
+        url += rand.choice(['#', '#frag', '#a?b=c&d', '#x#y'])
+    if rand.random() < 0.2:
+        url = url.decode('utf-8')
+    if rand.random() < 0.1:
+        url += u'\u044d'
+    return url
+
+
+def random_merge(rand):
+    query = rand.choice(['&', '?', '', 'z', '#']) + random_query(
+        rand, rand.randint(0, 4))
+    if rand.random() < 0.2:
+        query = query.decode('utf-8')
+    exclusions = rand.choice([None, [], ['vs', 'z'], ['my.jobs.site.id'],
+                              ['src', 'Src']])
+    return query, exclusions
+
+
+def old_merges(url, merges):
+    for query, exclusions in merges:
+        url = old_replace_or_add_query(url, query, exclusions)
+    return url
+
+
+class QueryMergeTests(TestCase):
+    def test_examples(self):
+        url = 'http://example.com/job/?vs=1&SRC=a+b#top'
+        self.assertEqual(merge_query(url, [QueryMerge('&src=new')]),
+                         'http://example.com/job/?vs=1&SRC=new#top')
+        self.assertEqual(merge_query(url, [QueryMerge('&z=1')]),
+                         'http://example.com/job/?vs=1&SRC=a%20b&z=1#top')
+        self.assertEqual(
+            merge_query(url, [QueryMerge('&vs=2&z=1', exclusions=['vs'])]),
+            'http://example.com/job/?vs=1&SRC=a%20b&z=1#top')
+        self.assertEqual(merge_query(url, [QueryMerge('z=1')]),
+                         'http://example.com/job/?vs=1&SRC=a+bz=1#top')
+
+    def test_pairs_are_encoded_consistently(self):
+        url = ('https://example.com/apply?title=Nurse%20(RN)&'
+               'loc=Indianapolis%2C%20IN&src=x')
+        self.assertEqual(merge_query(url, [QueryMerge('&src=DE')]),
+                         'https://example.com/apply?title=Nurse%20%28RN%29&'
+                         'loc=Indianapolis,%20IN&src=DE')
+
+    def test_matches_old_implementation(self):
+        """
+        Merging randomly generated queries into randomly generated urls
+        gives what replace_or_add_query always has.
+        """
+        rand = random.Random(2014)
+        checked = 0
+        for _ in range(5000):
+            url = random_url(rand)
+            query, exclusions = random_merge(rand)
+            try:
+                expected = old_replace_or_add_query(url, query, exclusions)
+            except (UnicodeError, ValueError):
+                # The old function rejects these; nothing to compare
+                continue
+            actual = merge_query(url, [QueryMerge(query, exclusions)])
+            self.assertEqual(
+                (actual, type(actual)), (expected, type(expected)),
+                'url: %r, query: %r, exclusions: %r' % (url, query,
+                                                        exclusions))
+            checked += 1
+        self.assertTrue(checked > 4000)
+
+    def test_merges_match_repeated_calls(self):
+        rand = random.Random(6)
+        for _ in range(2000):
+            url = random_url(rand)
+            merges = [random_merge(rand)
+                      for _ in range(rand.randint(1, 4))]
+            try:
+                expected = old_merges(url, merges)
+            except (UnicodeError, ValueError):
+                continue
+            actual = merge_query(url, [get_merge(query, exclusions)
+                                       for query, exclusions in merges])
+            self.assertEqual(actual, expected,
+                             'url: %r, merges: %r' % (url, merges))
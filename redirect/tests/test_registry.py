@@ -0,0 +1,204 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.test import TestCase
+
+from redirect import registry
+from redirect.models import CompanyEmail, ExcludedViewSource
+from redirect.tests.factories import (CanonicalMicrositeFactory,
+                                      CustomExcludedViewSourceFactory,
+                                      DestinationManipulationFactory,
+                                      ViewSourceFactory,
+                                      ViewSourceGroupFactory)
+
+
+class ManipulationTableTests(TestCase):
+    def setUp(self):
+        self.table = registry.manipulation_table
+        self.manipulation = DestinationManipulationFactory(buid=1,
+                                                           view_source=10)
+        self.fallback = DestinationManipulationFactory(buid=1, view_source=0,
+                                                       value_1='?src=zero')
+
+    def tearDown(self):
+        cache.clear()
+        registry.reset_all()
+
+    def test_chain_with_fallback(self):
+        chain = self.table.get_pipeline(1, 10).manipulations
+        self.assertEqual([m.value_1 for m in chain],
+                         [self.manipulation.value_1])
+
+        # View sources without manipulations use those for view source 0
+        chain = self.table.get_pipeline(1, 20).manipulations
+        self.assertEqual([m.value_1 for m in chain], [self.fallback.value_1])
+
+        self.assertIsNone(self.table.get_pipeline(2, 10))
+
+    def test_chain_ordered_by_action_type(self):
+        DestinationManipulationFactory(buid=1, view_source=10, action_type=2,
+                                       value_1='?src=two')
+        chain = self.table.get_pipeline(1, 10).manipulations
+        self.assertEqual([m.action_type for m in chain], [1, 2])
+
+    def test_lookups_are_query_free(self):
+        self.table.get_pipeline(1, 10)
+        with self.assertNumQueries(0):
+            self.table.get_pipeline(1, 10)
+            self.table.get_pipeline(1, 20)
+
+    def test_signals_rebuild_table(self):
+        self.table.get_pipeline(1, 10)
+
+        self.manipulation.value_1 = '?src=changed'
+        self.manipulation.save()
+        chain = self.table.get_pipeline(1, 10).manipulations
+        self.assertEqual(chain[0].value_1, '?src=changed')
+
+        self.manipulation.delete()
+        chain = self.table.get_pipeline(1, 10).manipulations
+        self.assertEqual(chain[0].value_1, self.fallback.value_1)
+
+    def test_shared_generation_rebuilds_table(self):
+        """
+        Another process bumping the generation causes a rebuild once the
+        check interval has passed.
+        """
+        self.table.get_pipeline(1, 10)
+        # Simulate an edit made by a different process
+        registry.DestinationManipulation.objects.filter(
+            pk=self.manipulation.pk).update(value_1='?src=elsewhere')
+        cache.incr(settings.MANIPULATION_GENERATION_CACHE_KEY)
+
+        chain = self.table.get_pipeline(1, 10).manipulations
+        self.assertEqual(chain[0].value_1, self.manipulation.value_1)
+
+        self.table._checked -= settings.REGISTRY_CHECK_INTERVAL
+        chain = self.table.get_pipeline(1, 10).manipulations
+        self.assertEqual(chain[0].value_1, '?src=elsewhere')
+
+    def test_generation_bumped_after_commit(self):
+        """
+        A process that rebuilds between an edit's signal and the commit of
+        its transaction loads the old rows; the generation moves again once
+        the request finishes so that it rebuilds a second time.
+        """
+        registry.reset_all()
+        self.manipulation.save()
+        generation = self.table.get_generation()
+
+        request_finished.send(sender=self.__class__)
+        self.assertNotEqual(self.table.get_generation(), generation)
+
+        # Only once per edit
+        generation = self.table.get_generation()
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(self.table.get_generation(), generation)
+
+
+class ExclusionTableTests(TestCase):
+    def setUp(self):
+        self.table = registry.exclusion_table
+        self.excluded = ExcludedViewSource.objects.create(view_source=999999)
+
+    def tearDown(self):
+        cache.clear()
+        registry.reset_all()
+
+    def test_sets_are_not_modified(self):
+        """
+        Changes produce a new set; one that is already in use stays as it
+        was.
+        """
+        exclusions = self.table.get()
+        self.assertTrue(isinstance(exclusions, frozenset))
+        self.assertTrue(999999 in exclusions)
+
+        self.excluded.delete()
+        self.assertTrue(999999 in exclusions)
+        self.assertFalse(999999 in self.table.get())
+
+    def test_lookups_are_query_free(self):
+        self.table.get()
+        with self.assertNumQueries(0):
+            999999 in self.table.get()
+
+
+class PolicyTableTests(TestCase):
+    def setUp(self):
+        self.table = registry.policy_table
+        CanonicalMicrositeFactory(buid=1,
+                                  canonical_microsite_url='http://a.jobs/')
+        CustomExcludedViewSourceFactory(buid=1, view_source=20)
+        self.email = CompanyEmail.objects.create(buid=2,
+                                                 email='jobs@example.com')
+
+    def tearDown(self):
+        cache.clear()
+        registry.reset_all()
+
+    def test_policies(self):
+        policy = self.table.get_policy(1)
+        self.assertEqual(policy.microsite_url, 'http://a.jobs/')
+        self.assertEqual(policy.excluded_view_sources, frozenset([20]))
+        self.assertIsNone(policy.contact_email)
+        self.assertTrue(policy.is_excluded(20))
+        self.assertTrue(policy.is_excluded(10, frozenset([10])))
+        self.assertFalse(policy.is_excluded(10))
+
+        policy = self.table.get_policy(2)
+        self.assertIsNone(policy.microsite_url)
+        self.assertEqual(policy.contact_email, 'jobs@example.com')
+
+        self.assertEqual(self.table.get_policy(3),
+                         registry.BusinessUnitPolicy(3, None, frozenset(),
+                                                     None))
+
+    def test_signals_rebuild_table(self):
+        self.table.get()
+        CustomExcludedViewSourceFactory(buid=2, view_source=30)
+        self.assertTrue(self.table.get_policy(2).is_excluded(30))
+
+        self.email.delete()
+        self.assertIsNone(self.table.get_policy(2).contact_email)
+
+    def test_lookups_are_query_free(self):
+        self.table.get()
+        with self.assertNumQueries(0):
+            self.table.get_policy(1)
+            self.table.get_policy(3)
+
+
+class CampaignTableTests(TestCase):
+    def setUp(self):
+        self.table = registry.campaign_table
+        self.view_source = ViewSourceFactory(view_source_id=50, name='Indeed',
+                                             include_ga_params=True)
+        self.group = ViewSourceGroupFactory(name='Boards',
+                                            view_sources=[self.view_source])
+
+    def tearDown(self):
+        cache.clear()
+        registry.reset_all()
+
+    def test_campaigns(self):
+        campaign = self.table.get()[50]
+        self.assertEqual(campaign.suffix, 'utm_source=Indeed-DE'
+                                          '&utm_medium=Boards'
+                                          '&utm_campaign=Indeed')
+        self.assertEqual(campaign.keys, frozenset(['utm_source', 'utm_medium',
+                                                   'utm_campaign']))
+
+    def test_changes_rebuild_table(self):
+        self.table.get()
+        self.view_source.include_ga_params = False
+        self.view_source.save()
+        self.assertFalse(50 in self.table.get())
+
+        self.view_source.include_ga_params = True
+        self.view_source.save()
+        self.group.view_source.remove(self.view_source)
+        self.assertFalse(50 in self.table.get())
+
+        self.group.view_source.add(self.view_source)
+        self.assertTrue(50 in self.table.get())
@@ -0,0 +1,89 @@
+import gzip
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from redirect import registry, replay
+from redirect.helpers import clean_guid, quote_string
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import CanonicalMicrositeFactory, RedirectFactory
+
+
+LINE = ('2014-07-01 12:00:00 10.0.0.1 GET /%(path)s %(redirect)s 80 - '
+        '10.0.0.2 HTTP/1.1 "Mozilla/5.0 (\\"quoted\\")" - %(referer)s '
+        'r.my.jobs %(status)s 512 300 %(duration)s\n')
+
+
+def make_line(path, url=None, status=301, referer='-', duration=1500):
+    redirect = '-'
+    if url is not None:
+        redirect = ('jcnlx.ref=&jcnlx.url=%s&jcnlx.buid=0&jcnlx.vsid=1&'
+                    'jcnlx.aguid=%s&jcnlx.myguid=' % (quote_string(url),
+                                                      'a' * 32))
+    return LINE % {'path': path, 'redirect': redirect, 'status': status,
+                   'referer': referer, 'duration': duration}
+
+
+class ReplayTests(TestCase):
+    def setUp(self):
+        self.redirect = RedirectFactory()
+        self.microsite = CanonicalMicrositeFactory()
+        self.guid = clean_guid(self.redirect.guid).upper()
+        self.url = '%s%s/job/?vs=1' % (
+            self.microsite.canonical_microsite_url, self.guid)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def test_parse_line(self):
+        click = replay.parse_line(make_line(
+            '%s1' % self.guid, self.url, referer='http://example.com/a b'))
+        self.assertEqual(click.path, '/%s1' % self.guid)
+        self.assertEqual(click.query, '')
+        self.assertEqual(click.user_agent, 'Mozilla/5.0 ("quoted")')
+        self.assertEqual(click.referer, 'http://example.com/a b')
+        self.assertEqual(click.host, 'r.my.jobs')
+        self.assertEqual(click.status, 301)
+        self.assertEqual(click.duration, 0.0015)
+        self.assertEqual(click.redirect['jcnlx.url'], self.url)
+        self.assertEqual(click.redirect['jcnlx.aguid'], 'a' * 32)
+
+        click = replay.parse_line(make_line('%s?z=1' % self.guid))
+        self.assertEqual(click.query, 'z=1')
+        self.assertEqual(click.redirect, {})
+        self.assertIsNone(replay.parse_line('not a log line\n'))
+
+    def test_replay(self):
+        log = os.path.join(self.directory, 'redirect.log.gz')
+        with gzip.open(log, 'w') as f:
+            f.write(make_line('%s1' % self.guid, self.url))
+            f.write(make_line('%s1' % self.guid, 'http://example.com/old'))
+            f.write(make_line('%s1' % self.guid, self.url, status=302))
+            f.write(make_line('robots.txt', status=200))
+            f.write('garbage\n')
+
+        skipped = {}
+        report = replay.replay(replay.read_clicks([log], skipped))
+        self.assertEqual(skipped, {'path': 1, 'unparsed': 1})
+        self.assertEqual(len(report.latencies), 3)
+        self.assertEqual(report.errors, 0)
+        self.assertEqual(report.url_differences, 1)
+        self.assertEqual(report.status_differences, 1)
+        self.assertEqual(report.examples, [
+            '/%s1: url http://example.com/old -> %s' % (self.guid, self.url),
+            '/%s1: status 302 -> 301' % self.guid])
+
+        out = StringIO()
+        call_command('replay_logs', log, stdout=out)
+        self.assertTrue('Replayed 3 clicks' in out.getvalue())
+        self.assertTrue('1 status differences, 1 url differences'
+                        in out.getvalue())
@@ -0,0 +1,187 @@
+from multiprocessing import TimeoutError
+from uuid import uuid4
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError
+from django.test import TestCase
+from testfixtures import LogCapture, Replacer
+
+from redirect.models import Redirect, RedirectArchive
+from redirect.resolver import GuidResolver, guid_resolver
+from redirect.tests.factories import RedirectFactory, RedirectArchiveFactory
+
+
+class FailingResult(object):
+    def __init__(self, error):
+        self.error = error
+        self.timeouts = []
+
+    def get(self, timeout=None):
+        self.timeouts.append(timeout)
+        raise self.error
+
+
+class FailingPool(object):
+    """
+    Stands in for the archive lookup threads when the archive is down
+    (DatabaseError) or hanging (TimeoutError). Lookups run right away, but
+    their results can't be collected.
+    """
+    def __init__(self, error):
+        self.result = FailingResult(error)
+
+    def apply_async(self, function, args):
+        with Replacer() as r:
+            # Would close the test's connection
+            r.replace('redirect.resolver.close_old_connections',
+                      lambda: None)
+            function(*args)
+        return self.result
+
+
+class BusyPool(object):
+    """
+    Stands in for lookup threads that never get through their queue
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def apply_async(self, function, args):
+        self.calls += 1
+        return FailingResult(TimeoutError())
+
+
+class GuidResolverTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.resolver = GuidResolver(size=2, timeout=60, negative_timeout=60,
+                                     threads=0)
+        self.redirect = RedirectFactory(guid='{%s}' % uuid4())
+        self.archived = RedirectArchiveFactory(guid='{%s}' % uuid4())
+
+    def test_resolves_both_tables(self):
+        redirect = self.resolver.resolve(self.redirect.guid)
+        self.assertTrue(isinstance(redirect, Redirect))
+        self.assertEqual(redirect.url, self.redirect.url)
+
+        archived = self.resolver.resolve(self.archived.guid)
+        self.assertTrue(isinstance(archived, RedirectArchive))
+        self.assertEqual(archived.expired_date, self.archived.expired_date)
+
+    def test_repeat_lookups_are_cached(self):
+        for guid in [self.redirect.guid, '{%s}' % uuid4()]:
+            try:
+                self.resolver.resolve(guid)
+            except ObjectDoesNotExist:
+                pass
+        with self.assertNumQueries(0):
+            self.resolver.resolve(self.redirect.guid)
+            with self.assertRaises(ObjectDoesNotExist):
+                self.resolver.resolve(self.resolver._missing.keys()[0])
+
+        stats = self.resolver.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['negative_hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_returns_new_instances(self):
+        """
+        Callers modify the instances they receive; that must not leak into
+        later lookups.
+        """
+        redirect = self.resolver.resolve(self.redirect.guid)
+        redirect.url = 'http://example.com'
+        self.assertEqual(self.resolver.resolve(self.redirect.guid).url,
+                         self.redirect.url)
+
+    def test_least_recently_used_is_dropped(self):
+        other = RedirectFactory(guid='{%s}' % uuid4())
+        for guid in [self.redirect.guid, self.archived.guid,
+                     self.redirect.guid, other.guid]:
+            self.resolver.resolve(guid)
+        self.assertEqual(set(self.resolver._found.keys()),
+                         set([self.redirect.guid, other.guid]))
+
+    def test_expired_entries_are_refetched(self):
+        self.resolver.timeout = 0
+        self.resolver.resolve(self.redirect.guid)
+        self.resolver.resolve(self.redirect.guid)
+        self.assertEqual(self.resolver.get_stats()['hits'], 0)
+
+    def test_evict(self):
+        guid = '{%s}' % uuid4()
+        self.assertRaises(ObjectDoesNotExist, self.resolver.resolve, guid)
+        RedirectFactory(guid=guid)
+        self.resolver.evict(guid)
+        self.resolver.resolve(guid)
+
+    def test_uppercase_guids_are_evicted(self):
+        """
+        Saving a redirect evicts it from the cache whatever the case of its
+        stored guid.
+        """
+        redirect = RedirectFactory(guid='{%s}' % str(uuid4()).upper())
+        resolver = guid_resolver
+        self.addCleanup(resolver.clear)
+        resolver.resolve(redirect.guid)
+        redirect.url = 'http://example.com/changed'
+        redirect.save()
+        self.assertEqual(resolver.resolve(redirect.guid).url, redirect.url)
+
+    def make_threaded_resolver(self, pool):
+        resolver = GuidResolver(size=2, timeout=60, negative_timeout=60,
+                                threads=1, archive_timeout=0.5)
+        resolver._pool = pool
+        return resolver
+
+    def test_archive_errors(self):
+        resolver = self.make_threaded_resolver(
+            FailingPool(DatabaseError('gone away')))
+
+        # Jobs in Redirect don't wait on the archive at all
+        with LogCapture('redirect.resolver') as log:
+            redirect = resolver.resolve(self.redirect.guid)
+        self.assertTrue(isinstance(redirect, Redirect))
+        self.assertEqual(resolver._pool.result.timeouts, [])
+        self.assertEqual(len(log.records), 0)
+
+        # Other jobs wait a bounded time, and aren't remembered as missing
+        with LogCapture('redirect.resolver') as log:
+            self.assertRaises(ObjectDoesNotExist, resolver.resolve,
+                              self.archived.guid)
+        self.assertEqual(resolver._pool.result.timeouts, [0.5])
+        self.assertEqual(len(log.records), 1)
+        self.assertEqual(resolver._missing, {})
+        self.assertEqual(resolver.get_stats()['archive_errors'], 1)
+
+    def test_archive_timeouts(self):
+        """
+        An archived job whose background lookup times out is looked up
+        directly rather than treated as missing.
+        """
+        resolver = self.make_threaded_resolver(FailingPool(TimeoutError()))
+        with LogCapture('redirect.resolver') as log:
+            archived = resolver.resolve(self.archived.guid)
+        self.assertTrue(isinstance(archived, RedirectArchive))
+        self.assertEqual(resolver._pool.result.timeouts, [0.5])
+        self.assertEqual(len(log.records), 1)
+        stats = resolver.get_stats()
+        self.assertEqual(stats['archive_timeouts'], 1)
+        self.assertEqual(stats['archive_errors'], 0)
+        self.assertEqual(resolver._in_flight, 0)
+
+    def test_busy_threads_are_not_queued_for(self):
+        """
+        Lookups abandoned because Redirect had the job keep the thread busy;
+        no more are queued behind them until it is free.
+        """
+        resolver = self.make_threaded_resolver(BusyPool())
+        resolver.resolve(self.redirect.guid)
+        self.assertEqual(resolver._pool.calls, 1)
+
+        archived = resolver.resolve(self.archived.guid)
+        self.assertTrue(isinstance(archived, RedirectArchive))
+        self.assertEqual(resolver._pool.calls, 1)
+        self.assertEqual(resolver.get_stats()['archive_timeouts'], 0)
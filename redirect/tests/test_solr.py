@@ -0,0 +1,95 @@
+import threading
+
+import pysolr
+from testfixtures import Replacer
+
+from django.test import TestCase
+
+from redirect.solr import JobCache
+
+
+GUID = 'A' * 32
+
+
+class Results(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.hits = len(docs)
+
+
+class JobCacheTests(TestCase):
+    def setUp(self):
+        self.cache = JobCache('http://127.0.0.1:1/solr', size=10, timeout=60,
+                              request_timeout=1)
+        self.docs = [{'guid': GUID, 'title': 'Title', 'description': 'Job',
+                      'company_exact': 'Company', 'uid': 1}]
+        self.queries = []
+
+        def search(solr, q=None, **kwargs):
+            self.queries.append((q, solr.timeout))
+            return Results(self.docs)
+        self.r = Replacer()
+        self.r.replace('pysolr.Solr.search', search)
+
+    def tearDown(self):
+        self.r.restore()
+
+    def test_fields_are_cached(self):
+        job = self.cache.get_job(GUID.lower())
+        self.assertEqual(job, {'title': 'Title', 'description': 'Job',
+                               'company_exact': 'Company'})
+        self.cache.get_job(GUID)
+        self.assertEqual(self.queries, [('guid:%s' % GUID, 1)])
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+
+        # Callers may modify what they get back
+        job['title'] = 'Changed'
+        self.assertEqual(self.cache.get_job(GUID)['title'], 'Title')
+
+    def test_unique(self):
+        self.docs.append(dict(self.docs[0]))
+        self.assertIsNone(self.cache.get_job(GUID, unique=True))
+        self.assertEqual(self.cache.get_job(GUID)['title'], 'Title')
+
+    def test_not_found(self):
+        self.docs = []
+        self.assertIsNone(self.cache.get_job(GUID))
+
+    def test_errors_are_not_cached(self):
+        def fail(solr, q=None, **kwargs):
+            self.queries.append(q)
+            raise pysolr.SolrError('Connection timed out')
+        self.r.replace('pysolr.Solr.search', fail)
+
+        self.assertIsNone(self.cache.get_job(GUID, timeout=0.5))
+        self.assertIsNone(self.cache.get_job(GUID))
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(self.cache.get_stats()['errors'], 2)
+
+    def test_concurrent_misses_share_one_query(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_search(solr, q=None, **kwargs):
+            self.queries.append(q)
+            started.set()
+            release.wait(5)
+            return Results(self.docs)
+        self.r.replace('pysolr.Solr.search', slow_search)
+
+        jobs = []
+        first = threading.Thread(
+            target=lambda: jobs.append(self.cache.get_job(GUID)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(
+            target=lambda: jobs.append(self.cache.get_job(GUID)))
+        second.start()
+        while not self.cache.get_stats()['coalesced']:
+            second.join(0.01)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual([job['title'] for job in jobs], ['Title', 'Title'])
@@ -1,14 +1,21 @@
 from datetime import date, timedelta
+import os
+import tempfile
 from uuid import uuid4
 
 from django.test import TestCase
+from testfixtures import Replacer
 
 from redirect.tests.factories import RedirectFactory, RedirectArchiveFactory
 from redirect.models import Redirect, RedirectArchive
 from redirect import tasks
+from redirect.resolver import guid_resolver
 
 
 class TaskTests(TestCase):
+    def tearDown(self):
+        guid_resolver.clear()
+
     def test_expired_to_archive_table(self):
         """
         Redirects that have been expired for 30 or more days should be moved
@@ -76,3 +83,66 @@ class TaskTests(TestCase):
         # The redirect should've been updated to match the one that was
         # in the Redirect table.
         self.assertEqual(redirect.job_title, expired_redirect.job_title)
+
+    def test_expired_moved_in_batches(self):
+        thirty_one = date.today() - timedelta(31)
+        expired = [RedirectFactory(expired_date=thirty_one,
+                                   guid='{%s}' % uuid4())
+                   for _ in range(5)]
+
+        stats = tasks.expired_to_archive_table(batch_size=2,
+                                               checkpoint_file='')
+        self.assertEqual(stats['rows'], 5)
+        self.assertEqual(stats['batches'], 3)
+
+        self.assertEqual(Redirect.objects.count(), 0)
+        for redirect in expired:
+            archived = RedirectArchive.objects.get(guid=redirect.guid)
+            self.assertEqual(archived.url, redirect.url)
+            self.assertEqual(archived.new_date, redirect.new_date)
+
+    def test_resumes_from_checkpoint(self):
+        """
+        A run that finds a checkpoint for the same cutoff date continues
+        after the last guid it records.
+        """
+        thirty_one = date.today() - timedelta(31)
+        first = RedirectFactory(expired_date=thirty_one, guid='{A}')
+        second = RedirectFactory(expired_date=thirty_one, guid='{B}')
+
+        checkpoint_file = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+        tasks.write_checkpoint(checkpoint_file,
+                               date.today() - timedelta(30), first.guid)
+        tasks.expired_to_archive_table(checkpoint_file=checkpoint_file)
+
+        Redirect.objects.get(guid=first.guid)
+        RedirectArchive.objects.get(guid=second.guid)
+        self.assertFalse(os.path.exists(checkpoint_file))
+
+    def test_throttle(self):
+        thirty_one = date.today() - timedelta(31)
+        for _ in range(4):
+            RedirectFactory(expired_date=thirty_one, guid='{%s}' % uuid4())
+
+        sleeps = []
+        with Replacer() as r:
+            r.replace('redirect.tasks.time.sleep', sleeps.append)
+            tasks.expired_to_archive_table(batch_size=2, rows_per_second=1,
+                                           checkpoint_file='')
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(sum(sleeps) > 3)
+
+    def test_archived_redirects_are_evicted(self):
+        """
+        Deleting without signals still drops this process's cached copy of
+        each moved redirect, so it is looked up in the archive afterwards.
+        """
+        thirty_one = date.today() - timedelta(31)
+        redirect = RedirectFactory(expired_date=thirty_one,
+                                   guid='{%s}' % uuid4())
+        self.assertEqual(guid_resolver.resolve(redirect.guid).__class__,
+                         Redirect)
+
+        tasks.expired_to_archive_table(checkpoint_file='')
+        self.assertEqual(guid_resolver.resolve(redirect.guid).__class__,
+                         RedirectArchive)
@@ -0,0 +1,93 @@
+import json
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from myjobs.models import User
+from redirect import registry, timing
+from redirect.helpers import clean_guid
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import RedirectFactory
+
+
+@override_settings(REQUEST_TIMING=True)
+class TimingTests(TestCase):
+    def setUp(self):
+        self.redirect = RedirectFactory()
+        self.path = reverse('home', args=[clean_guid(self.redirect.guid)])
+        timing.histograms.clear()
+
+    def tearDown(self):
+        timing.histograms.clear()
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def test_stage_outside_request(self):
+        self.assertIs(timing.stage('lookup'), timing.NO_STAGE)
+        self.assertIsNone(timing.stop())
+
+        with override_settings(REQUEST_TIMING=False):
+            timing.start()
+        self.assertIs(timing.stage('lookup'), timing.NO_STAGE)
+
+    def test_stages(self):
+        timing.start()
+        for _ in range(2):
+            with timing.stage('db'):
+                pass
+        timer = timing.stop()
+        self.assertEqual(sorted(timer.stages), ['db', timing.TOTAL])
+        self.assertEqual(timer.stages['db'][1], 2)
+
+        timer.stages = {'db': [0.0125, 2], 'total': [0.5, 1]}
+        self.assertEqual(timing.get_header(timer),
+                         'db;dur=12.50;desc="2", total;dur=500.00;desc="1"')
+
+        timing.histograms.record(timer)
+        stats = timing.histograms.get_stats()
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['stages']['db']['calls'], 2)
+        self.assertEqual(stats['stages']['db']['milliseconds'], 12.5)
+        # 12.5ms falls in the (10, 25] bucket
+        self.assertEqual(
+            stats['stages']['db']['buckets'][timing.BUCKETS.index(25)], 1)
+        self.assertEqual(stats['stages']['total']['buckets'][-1], 0)
+
+    def test_home_is_timed(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 301)
+        self.assertFalse(response.has_header('Server-Timing'))
+        stages = timing.histograms.get_stats()['stages']
+        for name in ['exclusions', 'lookup', 'db', 'syndication',
+                     'opengraph', 'microsite', 'cookie', timing.TOTAL]:
+            self.assertEqual(stages[name]['requests'], 1, name)
+
+        with override_settings(SERVER_TIMING_HEADER=True):
+            response = self.client.get(self.path)
+        names = [entry.split(';')[0]
+                 for entry in response['Server-Timing'].split(', ')]
+        self.assertTrue('lookup' in names)
+        self.assertTrue(timing.TOTAL in names)
+
+    def test_other_views_are_not_timed(self):
+        with override_settings(SERVER_TIMING_HEADER=True):
+            response = self.client.get(reverse('stats'))
+            self.client.get('/no/such/page/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(timing.histograms.get_stats()['requests'], 0)
+
+    def test_stats(self):
+        self.client.get(self.path)
+        User.objects.create_superuser(email='admin@example.com',
+                                      password='secret')
+        self.client.login(username='admin@example.com', password='secret')
+        response = self.client.get(reverse('stats'))
+        content = json.loads(response.content)
+        self.assertEqual(content['timing']['requests'], 1)
+        self.assertEqual(content['timing']['buckets_ms'],
+                         list(timing.BUCKETS))
+        self.assertEqual(content['timing']['stages']['lookup']['requests'],
+                         1)
@@ -3,29 +3,42 @@ import HTMLParser
 import base64
 import datetime
 import json
+import os
 import re
+import shutil
+import smtplib
+import socket
+from StringIO import StringIO
+import tempfile
 from urllib import unquote
 import urlparse
 import uuid
 
 from jira.client import JIRA
 import markdown
-from testfixtures import Replacer
+from testfixtures import LogCapture, Replacer
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.test import TestCase
 from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
 from django.utils import timezone
 from django.utils.http import urlquote_plus
 
 from myjobs.models import User
+from redirect import mail_queue, registry
 from redirect.actions import sourcecodetag
 from redirect.models import (DestinationManipulation, ExcludedViewSource,
-                             CompanyEmail)
+                             CompanyEmail, EmailRedirectLog)
+from redirect.resolver import guid_resolver
+from redirect.solr import job_cache
 from redirect.tests.factories import (RedirectFactory, RedirectArchiveFactory,
                                       CanonicalMicrositeFactory,
                                       DestinationManipulationFactory,
@@ -47,7 +60,7 @@ JOB = {
 }
 
 
-def mock_search(self, q=None, kwargs=None):
+def mock_search(self, q=None, **kwargs):
     """
     Helper method that mocks a solr search result
     """
@@ -84,6 +97,9 @@ class ViewSourceViewTests(TestCase):
         The cache is not cleared between tests. We need to do it manually.
         """
         cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+        job_cache.clear()
 
     def test_get_with_bad_vsid(self):
         """
@@ -471,6 +487,25 @@ class ViewSourceViewTests(TestCase):
         self.assertTrue(self.redirect.url in response.content)
         self.assertTrue('google-analytics' in response.content)
 
+    def test_expired_page_cached(self):
+        self.redirect.expired_date = datetime.datetime.now(tz=timezone.utc)
+        self.redirect.save()
+        response = self.client.get(reverse('home',
+                                           args=[self.redirect_guid, '12']))
+        self.assertTemplateUsed(response, 'redirect/expired.html')
+        self.assertTrue('var source = "12";' in response.content)
+
+        response = self.client.get(reverse('home',
+                                           args=[self.redirect_guid, '34']))
+        self.assertEqual(response.status_code, 410)
+        self.assertTemplateNotUsed(response, 'redirect/expired.html')
+        self.assertTrue('var source = "34";' in response.content)
+        self.assertEqual(response.content.count('class="drill-search"'), 3)
+        # Analytics still get the error code and age for every request
+        self.assertTrue('&jcnlx.err=XIN&jcnlx.xhr=0' in
+                        response['X-REDIRECT'])
+        self.assertTrue('jcnlx.vsid=34' in response['X-REDIRECT'])
+
     def test_expired_job_with_unicode(self):
         self.redirect.expired_date = datetime.datetime.now(tz=timezone.utc)
         self.redirect.job_title = u'это юникода'
@@ -691,43 +726,39 @@ class ViewSourceViewTests(TestCase):
                           self.manipulation.view_source]))
         self.assertTrue('%c3%81=%20%3d,%2b' in response['Location'].lower())
 
-    def test_cache_gets_set_on_view(self):
+    def test_exclusions_loaded_on_view(self):
         """
-        Viewing any page when the cache is empty should populate a list of
-        excluded view sources
+        Viewing any page when no exclusions are loaded should load the
+        excluded view sources, after which they are served from memory
         """
-        cache_key = settings.EXCLUDED_VIEW_SOURCE_CACHE_KEY
-        cache.delete(cache_key)
-
-        self.assertFalse(cache.get(cache_key))
-
+        registry.reset_all()
         self.client.get(reverse('home',
                                 args=[self.redirect_guid]))
+        self.assertTrue(registry.exclusion_table._table)
 
-        self.assertTrue(cache.get(cache_key))
+        with self.assertNumQueries(0):
+            registry.exclusion_table.get()
 
-    def test_cache_gets_cleared_on_save(self):
+    def test_exclusions_rebuilt_on_save(self):
         """
-        Saving an ExpiredViewSource object should remove the list of
-        excluded view sources, which will be replaced on the next request
+        Saving or deleting an ExcludedViewSource object should replace the
+        set of excluded view sources
         """
-        cache_key = settings.EXCLUDED_VIEW_SOURCE_CACHE_KEY
         self.client.get(reverse('home',
                                 args=[self.redirect_guid]))
 
         new_evs = ExcludedViewSource.objects.all().order_by('-view_source')[0]
         new_evs = new_evs.view_source + 1
+        self.assertFalse(
+            new_evs in registry.exclusion_table.get())
 
-        self.assertFalse(new_evs in cache.get(cache_key))
-
-        ExcludedViewSource(view_source=new_evs).save()
+        excluded = ExcludedViewSource.objects.create(view_source=new_evs)
+        self.assertTrue(
+            new_evs in registry.exclusion_table.get())
 
-        self.assertFalse(cache.get(cache_key))
-
-        self.client.get(reverse('home',
-                                args=[self.redirect_guid]))
-
-        self.assertTrue(new_evs in cache.get(cache_key))
+        excluded.delete()
+        self.assertFalse(
+            new_evs in registry.exclusion_table.get())
 
     def test_custom_microsite_exclusion(self):
         custom_exclusion = CustomExcludedViewSourceFactory()
@@ -736,9 +767,8 @@ class ViewSourceViewTests(TestCase):
             reverse('home',
                     args=[self.redirect_guid,
                           custom_exclusion.view_source]))
-        self.assertTrue((custom_exclusion.buid,
-                         custom_exclusion.view_source) in
-                        settings.CUSTOM_EXCLUSIONS)
+        policy = registry.policy_table.get_policy(custom_exclusion.buid)
+        self.assertTrue(policy.is_excluded(custom_exclusion.view_source))
         self.assertFalse(response['Location'].startswith(
             self.microsite.canonical_microsite_url))
 
@@ -979,13 +1009,22 @@ class EmailForwardTests(TestCase):
         self.r = Replacer()
         self.r.replace('pysolr.Solr.search', mock_search)
 
+        self.queue_dir = tempfile.mkdtemp()
+        self.queue_settings = override_settings(EMAIL_QUEUE_DIR=self.queue_dir)
+        self.queue_settings.enable()
+
     def tearDown(self):
         self.r.restore()
+        guid_resolver.clear()
+        job_cache.clear()
+        self.queue_settings.disable()
+        shutil.rmtree(self.queue_dir)
 
     def submit_email(self, use_data=True):
         """
         Helper method for submitting parsed emails. Ensures that the request
-        returns a status of 200.
+        returns a status of 200, then processes the queued email, storing
+        the outcome in self.stats.
 
         Inputs:
         :use_data: Should we include post data; Default: True
@@ -1000,6 +1039,7 @@ class EmailForwardTests(TestCase):
         response = self.client.post(reverse('email_redirect'),
                                     **kwargs)
         self.assertEqual(response.status_code, 200)
+        self.stats = mail_queue.process_queue()
 
         return response
 
@@ -1145,8 +1185,8 @@ class EmailForwardTests(TestCase):
             # if it appears as a BCC
             self.post_dict['envelope'] = '{"to":["%s"]}' % email
 
-            response = self.submit_email()
-            self.assertEqual(response.content, 'reposted')
+            self.submit_email()
+            self.assertEqual(self.stats, {'reposted': 1})
             self.assertEqual(len(mail.outbox), 0)
 
         del self.post_dict['envelope']
@@ -1154,10 +1194,113 @@ class EmailForwardTests(TestCase):
         for email in prm_list:
             self.post_dict['to'] = email
 
-            response = self.submit_email()
-            self.assertEqual(response.content, 'reposted')
+            self.submit_email()
+            self.assertEqual(self.stats, {'reposted': 1})
             self.assertEqual(len(mail.outbox), 0)
 
+    def test_webhook_only_queues_email(self):
+        self.post_dict['to'] = ['%s@my.jobs' % self.redirect_guid]
+        response = self.client.post(reverse('email_redirect'),
+                                    data=self.post_dict,
+                                    HTTP_AUTHORIZATION=self.auth['good'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(len(mail_queue.get_queued()), 1)
+
+        self.assertEqual(mail_queue.process_queue(), {'forwarded': 1})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail_queue.get_queued(), [])
+
+    def test_missing_attachment(self):
+        self.post_dict['attachments'] = 1
+        self.submit_email()
+        self.assertEqual(self.stats, {'attachment_failure': 1})
+
+    def test_failed_email_is_kept(self):
+        self.submit_email()
+        self.r.replace('redirect.helpers.process_email', None)
+        self.submit_email()
+        self.assertEqual(self.stats, {'failed': 1})
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.queue_dir, 'failed'))), 1)
+
+        self.r.restore()
+        self.r = Replacer()
+        self.r.replace('pysolr.Solr.search', mock_search)
+        self.assertEqual(mail_queue.requeue(), 1)
+        self.assertEqual(mail_queue.process_queue(), {'ignored': 1})
+        self.assertEqual(
+            os.listdir(os.path.join(self.queue_dir, 'failed')), [])
+
+    def test_attachments_are_queued(self):
+        self.post_dict['to'] = ['%s@my.jobs' % self.redirect_guid]
+        self.post_dict['attachments'] = 1
+        self.post_dict['attachment1'] = StringIO('\x00\xffbinary')
+        self.post_dict['attachment1'].name = 'resume.pdf'
+        self.submit_email()
+        self.assertEqual(self.stats, {'forwarded': 1})
+        forward = mail.outbox[1]
+        self.assertEqual(forward.attachments[0][:2],
+                         ('resume.pdf', '\x00\xffbinary'))
+
+    def test_retry_skips_sent_mail(self):
+        """
+        If forwarding fails after the reply went out, the retry only
+        forwards
+        """
+        class FailingEmail(EmailMultiAlternatives):
+            def send(self, *args, **kwargs):
+                raise smtplib.SMTPServerDisconnected()
+
+        self.post_dict['to'] = ['%s@my.jobs' % self.redirect_guid]
+        self.client.post(reverse('email_redirect'), data=self.post_dict,
+                         HTTP_AUTHORIZATION=self.auth['good'])
+        with Replacer() as r:
+            r.replace('redirect.helpers.EmailMultiAlternatives',
+                      FailingEmail)
+            self.assertRaises(smtplib.SMTPException,
+                              mail_queue.process_queue)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(len(mail_queue.get_queued()), 1)
+
+        self.assertEqual(mail_queue.process_queue(), {'forwarded': 1})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[1].to, [self.contact.email])
+        self.assertEqual(EmailRedirectLog.objects.count(), 1)
+
+    def test_worker_survives_mail_server_outage(self):
+        class Stop(Exception):
+            pass
+
+        results = [smtplib.SMTPConnectError(421, 'down'), socket.error(),
+                   {}]
+        sleeps = []
+
+        def process_queue(limit):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if not results:
+                raise Stop()
+
+        with Replacer() as r, LogCapture('redirect.mail_queue') as log:
+            r.replace('redirect.mail_queue.process_queue', process_queue)
+            r.replace('time.sleep', sleep)
+            self.assertRaises(Stop, call_command, 'process_email_queue',
+                              poll=5, verbosity=0)
+        self.assertEqual(sleeps, [10, 20, 5])
+        self.assertEqual(len(log.records), 2)
+
+        results.append(socket.error())
+        with Replacer() as r:
+            r.replace('redirect.mail_queue.process_queue', process_queue)
+            self.assertRaises(CommandError, call_command,
+                              'process_email_queue', verbosity=0)
+
 
 class UpdateBUIDTests(TestCase):
     def setUp(self):
@@ -1222,4 +1365,17 @@ class RedirectViewTests(TestCase):
 
         # Don't follow a bad redirect.
         response = self.client.get(reverse('home', args=['1'*32]), follow=True)
-        self.assertEqual(response.status_code, 404)
\ No newline at end of file
+        self.assertEqual(response.status_code, 404)
+
+
+class StatsViewTests(TestCase):
+    def test_staff_only(self):
+        response = self.client.get(reverse('stats'))
+        self.assertTrue('Log in' in response.content)
+
+        User.objects.create_superuser(email='admin@example.com',
+                                      password='secret')
+        self.client.login(username='admin@example.com', password='secret')
+        response = self.client.get(reverse('stats'))
+        content = json.loads(response.content)
+        self.assertTrue('hit_ratio' in content['guid_resolver'])
@@ -0,0 +1,85 @@
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from testfixtures import LogCapture, Replacer
+
+from redirect import registry, warmup
+from redirect.handlers import RedirectDispatcher
+from redirect.helpers import clean_guid
+from redirect.resolver import guid_resolver
+from redirect.tests.factories import CanonicalMicrositeFactory, RedirectFactory
+from redirect.tests.test_replay import make_line
+
+
+class WarmUpTests(TestCase):
+    def setUp(self):
+        self.redirect = RedirectFactory()
+        CanonicalMicrositeFactory()
+        self.guid = clean_guid(self.redirect.guid)
+        self.directory = tempfile.mkdtemp()
+        self.hot_guids = os.path.join(self.directory, 'hot_guids')
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        cache.clear()
+        registry.reset_all()
+        guid_resolver.clear()
+
+    def test_warm_up(self):
+        with open(self.hot_guids, 'w') as f:
+            f.write('%s 10\n%s 5\nnot-a-guid\n' % (self.guid, '0' * 32))
+        application = RedirectDispatcher()
+        with LogCapture('redirect.warmup') as log:
+            timings = warmup.warm_up(application, self.hot_guids, 10)
+        self.assertEqual([record.levelname for record in log.records],
+                         ['INFO'])
+        self.assertEqual(list(timings),
+                         ['middleware', 'urls', 'templates', 'tables',
+                          'guids', 'total', 'guids_found'])
+        self.assertEqual(timings['guids_found'], 1)
+        self.assertEqual(warmup.last_warm_up, timings)
+        self.assertIsNotNone(application.redirect_handler._request_middleware)
+        self.assertIsNotNone(application.handler._request_middleware)
+
+        # The first click needs nothing that warm-up could have loaded
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home', args=[self.guid]))
+        self.assertEqual(response.status_code, 301)
+
+    def test_failed_step(self):
+        def fail():
+            raise ValueError('broken template')
+
+        with Replacer() as r:
+            r.replace('redirect.warmup.load_templates', fail)
+            with LogCapture('redirect.warmup') as log:
+                timings = warmup.warm_up(hot_guids_file='')
+        self.assertTrue('tables' in timings)
+        self.assertFalse('guids' in timings)
+        self.assertEqual(log.records[0].getMessage(),
+                         'Warm-up step templates failed')
+
+    def test_write_hot_guids(self):
+        log = os.path.join(self.directory, 'redirect.log')
+        other = 'a' * 32
+        with open(log, 'w') as f:
+            f.write(make_line(self.guid.upper() + '20'))
+            f.write(make_line(other))
+            f.write(make_line(self.guid + '+'))
+            f.write(make_line('robots.txt'))
+
+        out = StringIO()
+        call_command('write_hot_guids', log, stdout=out)
+        self.assertEqual(out.getvalue(), '%s 2\n%s 1\n' % (self.guid, other))
+
+        call_command('write_hot_guids', log, limit=1, output=self.hot_guids)
+        self.assertEqual(warmup.read_hot_guids(self.hot_guids, 10),
+                         [self.redirect.guid])
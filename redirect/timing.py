@@ -0,0 +1,194 @@
+"""
+Lightweight timing of the stages of a redirect.
+
+TimingMiddleware gives each timed request a RequestTimer in a thread-local.
+Code on the redirect path wraps its stages in stage(name), which adds the
+time spent and one call to that stage; outside a timed request, or with
+settings.REQUEST_TIMING off, stage() costs one attribute lookup. The
+database and cache stages overlap the stages they happen in.
+
+When a request finishes, its stage times are added to per-process
+histograms that the stats view reports, and, with
+settings.SERVER_TIMING_HEADER on, sent back in a Server-Timing header.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+
+# Upper bounds, in milliseconds, of the histogram buckets; the last bucket
+# takes everything slower
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Name of the stage covering a whole timed request
+TOTAL = 'total'
+
+# Only requests for these urls are timed
+TIMED_URL_NAMES = frozenset(['home', 'email_redirect', 'update_buid'])
+
+_local = threading.local()
+
+
+class RequestTimer(object):
+    """
+    Stage times and call counts for one request
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.stages = {}
+        # Name of the branch this request took; see redirect.budgets
+        self.branch = None
+
+    def get_calls(self, name):
+        stage = self.stages.get(name)
+        return stage[1] if stage is not None else 0
+
+    def add(self, name, seconds):
+        stage = self.stages.get(name)
+        if stage is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            stage[0] += seconds
+            stage[1] += 1
+
+
+class Stage(object):
+    """
+    Context manager timing one stage of the current request
+    """
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, time.time() - self.start)
+
+
+class NoStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+def stage(name):
+    """
+    Times a stage of the current request:
+
+        with timing.stage('lookup'):
+            ...
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        return NO_STAGE
+    return Stage(timer, name)
+
+
+def current():
+    """
+    Outputs:
+    :timer: RequestTimer for the current thread's request, or None if it
+        isn't being timed
+    """
+    return getattr(_local, 'timer', None)
+
+
+def start():
+    """
+    Starts timing the current thread's request, if timing is enabled
+    """
+    if settings.REQUEST_TIMING:
+        _local.timer = RequestTimer()
+
+
+def stop():
+    """
+    Stops timing the current thread's request
+
+    Outputs:
+    :timer: RequestTimer with the stages that ran, or None if this request
+        wasn't being timed
+    """
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    if timer is not None:
+        timer.add(TOTAL, time.time() - timer.start)
+    return timer
+
+
+def get_header(timer):
+    """
+    Outputs:
+    :header: Server-Timing header value for :timer:'s stages
+    """
+    return ', '.join('%s;dur=%.2f;desc="%d"' % (name, seconds * 1000, calls)
+                     for name, (seconds, calls) in sorted(
+                         timer.stages.items()))
+
+
+class Histograms(object):
+    """
+    Per-process distribution of stage times across requests
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self.requests = 0
+
+    def record(self, timer):
+        with self._lock:
+            self.requests += 1
+            for name, (seconds, calls) in timer.stages.items():
+                stage = self._stages.get(name)
+                if stage is None:
+                    stage = self._stages[name] = {
+                        'requests': 0, 'calls': 0, 'seconds': 0.0,
+                        'buckets': [0] * (len(BUCKETS) + 1)}
+                stage['requests'] += 1
+                stage['calls'] += calls
+                stage['seconds'] += seconds
+                milliseconds = seconds * 1000
+                index = 0
+                while (index < len(BUCKETS) and
+                       milliseconds > BUCKETS[index]):
+                    index += 1
+                stage['buckets'][index] += 1
+
+    def get_stats(self):
+        """
+        Outputs:
+        :stats: Dictionary with the number of timed requests, the bucket
+            bounds and, per stage, the requests it ran in, its total calls
+            and milliseconds, and a count per bucket
+        """
+        with self._lock:
+            stages = {}
+            for name, stage in self._stages.items():
+                stages[name] = {
+                    'requests': stage['requests'],
+                    'calls': stage['calls'],
+                    'milliseconds': round(stage['seconds'] * 1000, 3),
+                    'buckets': list(stage['buckets'])}
+            return {'requests': self.requests,
+                    'buckets_ms': list(BUCKETS),
+                    'stages': stages}
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self.requests = 0
+
+
+histograms = Histograms()
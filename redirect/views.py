@@ -1,28 +1,31 @@
-from email.utils import getaddresses
 from datetime import datetime
+import itertools
 import json
+import os
+import time
 from urllib import unquote
 import uuid
 
 from django.conf import settings
-from django.core import mail
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import EmailMultiAlternatives
+from django.contrib.admin.views.decorators import staff_member_required
 from django.http import (HttpResponseGone, HttpResponsePermanentRedirect,
-                         HttpResponse)
+                         HttpResponse, StreamingHttpResponse)
 from django.shortcuts import render_to_response
 from django.template import RequestContext
-from django.template.loader import render_to_string
 from django.utils import text, timezone
 from django.views.decorators.csrf import csrf_exempt
 
-from redirect.models import (Redirect, CanonicalMicrosite,
-                             DestinationManipulation, CompanyEmail,
-                             EmailRedirectLog)
-from redirect import helpers
+from redirect.clickcounts import click_counter
+from redirect.clicklog import click_log, make_event
+from redirect.models import (CanonicalMicrosite, DestinationManipulation,
+                             RedirectArchive)
+from redirect import batch, budgets, helpers, mail_queue, timing, warmup
+from redirect.resolver import guid_resolver
+from redirect.solr import job_cache
 
 
 def home(request, guid, vsid=None, debug=None):
+    start = time.time()
     if vsid is None:
         vsid = '0'
     guid = '{%s}' % uuid.UUID(guid)
@@ -31,6 +34,8 @@ def home(request, guid, vsid=None, debug=None):
     enable_custom_queries = request.REQUEST.get('z') == '1'
     expired = False
     user_agent_vs = None
+    redirect_url = None
+    attributed_vs = vsid
 
     if debug:
         # On localhost ip will always be empty unless you've got a setup
@@ -41,7 +46,8 @@ def home(request, guid, vsid=None, debug=None):
             debug_content.append('CustomParameters=%s' %
                                  request.META.get('QUERY_STRING'))
 
-    guid_redirect = helpers.get_redirect_or_404(guid=guid)
+    with timing.stage('lookup'):
+        guid_redirect = helpers.get_redirect_or_404(guid=guid)
     cleaned_guid = helpers.clean_guid(guid_redirect.guid).upper()
 
     syndication_params = {'request': request, 'redirect': guid_redirect,
@@ -53,54 +59,38 @@ def home(request, guid, vsid=None, debug=None):
         debug_content.append('RetLink(original)=%s' % guid_redirect.url)
         syndication_params['debug_content'] = debug_content
 
-    response = helpers.get_syndication_redirect(**syndication_params)
+    with timing.stage('syndication'):
+        response = helpers.get_syndication_redirect(**syndication_params)
+    if response is not None:
+        budgets.set_branch('syndication')
 
     if response is None:
-        user_agent_vs, response = helpers.get_opengraph_redirect(
-            request, guid_redirect, cleaned_guid)
+        with timing.stage('opengraph'):
+            user_agent_vs, response = helpers.get_opengraph_redirect(
+                request, guid_redirect, cleaned_guid)
+        if response is not None:
+            budgets.set_branch('opengraph')
 
     if response is None:
-        if vsid == '1604':
-            # msccn redirect
-
-            company_name = guid_redirect.company_name
-            company_name = helpers.quote_string(company_name)
-            redirect_url = ('http://us.jobs/msccn-referral.asp?gi='
-                            '%s%s&cp=%s' %
-                            (cleaned_guid,
-                             vsid,
-                             company_name))
-        else:
-            args = {'request': request, 'guid_redirect': guid_redirect,
-                    'vsid': vsid, 'guid': cleaned_guid}
-            if debug:
-                args['debug_content'] = debug_content
-            returned_dict = helpers.get_redirect_url(**args)
-            redirect_url = returned_dict.get('redirect_url', '')
-            facebook = returned_dict.get('facebook', False)
-            expired = returned_dict.get('expired', False)
-            browse_url = returned_dict.get('browse_url', '')
-        if not redirect_url:
-            redirect_url = guid_redirect.url
-            params = {'request': request, 'url': redirect_url,
-                      'exclude': True}
-            if debug:
-                debug_content.append(
-                    'ManipulatedLink(No Manipulation)=%s' % redirect_url)
-                params['debug_content'] = debug_content
-            if enable_custom_queries:
-                redirect_url = helpers.add_custom_queries(**params)
-        redirect_url = helpers.get_hosted_state_url(guid_redirect,
-                                                    redirect_url)
+        args = {'request': request, 'guid_redirect': guid_redirect,
+                'vsid': vsid, 'guid': cleaned_guid}
+        if debug:
+            args['debug_content'] = debug_content
+        returned_dict = helpers.get_destination(**args)
+        redirect_url = returned_dict['redirect_url']
+        expired = returned_dict.get('expired', False)
+        attributed_vs = returned_dict.get('view_source', vsid)
+        browse_url = returned_dict.get('browse_url', '')
+        if isinstance(guid_redirect, RedirectArchive):
+            # Whatever get_redirect_url decided, this job cost an extra
+            # lookup in the archive
+            budgets.set_branch('archive')
 
         if debug:
             debug_content.append('RetLink=%s' % redirect_url)
 
         if expired:
             err = '&jcnlx.err=XIN'
-            data = {'job': guid_redirect,
-                    'expired_url': original_url,
-                    'view_source': vsid}
             if (guid_redirect.buid in [1228, 5480] or
                     2650 <= guid_redirect.buid <= 2703):
                 if guid_redirect.buid in [1228, 5480]:
@@ -108,13 +98,12 @@ def home(request, guid, vsid=None, debug=None):
                 else:
                     err = '&jcnlx.err=XST'
 
-            if browse_url:
-                data['browse_url'] = browse_url
-            else:
-                data['browse_url'] = 'http://www.my.jobs/%s/careers/' % \
+            if not browse_url:
+                browse_url = 'http://www.my.jobs/%s/careers/' % \
                     text.slugify(guid_redirect.company_name)
-            response = HttpResponseGone(
-                render_to_string('redirect/expired.html', data))
+            with timing.stage('render'):
+                response = HttpResponseGone(helpers.get_expired_page(
+                    guid_redirect, original_url, browse_url, vsid))
         else:
             response = HttpResponsePermanentRedirect(redirect_url)
 
@@ -138,9 +127,19 @@ def home(request, guid, vsid=None, debug=None):
             qs += '%s&jcnlx.xhr=%s' % (err, d_hours)
         response['X-REDIRECT'] = qs
 
-        response = helpers.set_aguid_cookie(response,
-                                            request.get_host(),
-                                            aguid)
+        with timing.stage('cookie'):
+            response = helpers.set_aguid_cookie(response,
+                                                request.get_host(),
+                                                aguid)
+
+    if click_counter.enabled and not debug and not user_agent_vs:
+        # Apply clicks count toward the view source in their vs= parameter
+        click_counter.increment(guid_redirect.buid, int(attributed_vs))
+
+    if click_log.enabled and not debug:
+        click_log.record(make_event(request, guid_redirect, cleaned_guid,
+                                    vsid, response, redirect_url, expired,
+                                    user_agent_vs, start))
 
     if debug and not user_agent_vs:
         data = {'debug_content': debug_content}
@@ -163,132 +162,15 @@ def email_redirect(request):
 
     Authentication issues return a status code of 403
     All other paths return a 200 to prevent SendGrid from sending the same
-        email repeatedly
+        email repeatedly; the email itself is queued and handled later by
+        helpers.process_email
     """
     if not helpers.is_authorized(request):
         return HttpResponse(status=403)
 
-    try:
-        to_email = request.POST.get('to', None)
-        if to_email and type(to_email) != list:
-            to_email = [to_email]
-        elif not to_email:
-            to_email = []
-        body = request.POST.get('text', '')
-        html_body = request.POST.get('html', '')
-        from_email = request.POST.get('from', '')
-        cc = request.POST.get('cc', None)
-        if cc and type(cc) != list:
-            cc = [cc]
-        elif not cc:
-            cc = []
-        subject = request.POST.get('subject', '')
-        num_attachments = int(request.POST['attachments'])
-    except (KeyError, ValueError):
-        # KeyError: key was not in POST dict
-        # ValueError: num_attachments could not be cast
-        #     to int
-        return HttpResponse(status=200)
-
-    attachment_data = []
-    for file_number in range(1, num_attachments+1):
-        try:
-            file_ = request.FILES['attachment%s' % file_number]
-        except KeyError:
-            # Upload problem?
-            helpers.log_failure(request.POST.copy(),
-                                'My.jobs Attachment Failure')
-            return HttpResponse(status=200)
-        name = file_.name
-        content = file_.read()
-        content_type = file_.content_type
-        attachment_data.append((name, content, content_type))
-
-    addresses = getaddresses(to_email + cc)
-    addresses = [addr[1].lower() for addr in addresses]
-
-    prm_bcc = False
-    try:
-        # prm@my.jobs appears in the 'envelope' parameter
-        # posted from SendGrid if prm@my.jobs was added
-        # via BCC
-        envelope = json.loads(request.POST.get('envelope',
-                                               ''))
-    except ValueError:
-        # envelope was not valid JSON or was not provided
-        pass
-    else:
-        if 'prm@my.jobs' in [env_email.lower()
-                             for env_email
-                             in envelope.get('to', [])]:
-            prm_bcc = True
-
-    if prm_bcc or 'prm@my.jobs' in addresses:
-        # post to my.jobs
-        helpers.repost_to_mj(request.POST.copy(),
-                             attachment_data)
-        if hasattr(mail, 'outbox'):
-            return HttpResponse(content='reposted')
-        return HttpResponse(status=200)
-    if len(addresses) != 1:
-        # >1 recipients
-        # or 0 recipients (everyone is bcc)
-        # Probably not a guid@my.jobs email
-        return HttpResponse(status=200)
-    hex_guid = addresses[0].split('@')[0]
-
-    # shouldn't happen, but if someone somehow sends an
-    # email with a view source attached, we should
-    # remove it
-    hex_guid = hex_guid[:32]
-
-    email_dict = {'new_to': from_email,
-                  'old_to': to_email,
-                  'guid': hex_guid}
-
-    try:
-        to_guid = '{%s}' % uuid.UUID(hex_guid)
-        job = Redirect.objects.get_any(guid=to_guid)
-    except ValueError:
-        # Not a guid
-        return HttpResponse(status=200)
-    except ObjectDoesNotExist:
-        email_dict['email_type'] = 'no_job'
-        helpers.send_response_to_sender(**email_dict)
-        return HttpResponse(status=200)
-
-    email_dict['job'] = job
-
-    try:
-        ce = CompanyEmail.objects.get(buid=job.buid)
-        new_to = ce.email
-    except CompanyEmail.DoesNotExist:
-        email_dict['email_type'] = 'no_contact'
-        helpers.send_response_to_sender(**email_dict)
-        return HttpResponse(status=200)
-
-    email_dict['email_type'] = 'contact'
-    helpers.send_response_to_sender(**email_dict)
-
-    sg_headers = {
-        'X-SMTPAPI': '{"category": "My.jobs email redirect"}'
-    }
-
-    # We reached this point; the data should be good
-    email = EmailMultiAlternatives(
-        to=[new_to], from_email=from_email, subject=subject,
-        body=body, cc=cc, headers=sg_headers)
-    email.attach_alternative(html_body, 'text/html')
-    for attachment in attachment_data:
-        email.attach(*attachment)
-    email.send()
-
-    log = {'from_addr': from_email,
-           'to_guid': to_guid,
-           'buid': job.buid,
-           'to_addr': new_to}
-    EmailRedirectLog.objects.create(**log)
-
+    # Forwarding involves Solr, SMTP and sometimes JIRA or My.jobs; leave
+    # that to the process_email_queue command.
+    mail_queue.enqueue(request.POST, request.FILES)
     return HttpResponse(status=200)
 
 
@@ -353,3 +235,52 @@ def update_buid(request):
     data['new_bu'] = new
     return HttpResponse(json.dumps(data),
                         content_type='application/json')
+
+
+@csrf_exempt
+@staff_member_required
+def resolve_batch(request):
+    """
+    Resolves the (guid, view source) pairs posted as JSON lines and streams
+    back one JSON line per pair; see redirect.batch
+
+    Only reads data, so it is exempt from CSRF checks for the sake of
+    scripts logged in as staff.
+    """
+    if request.method != 'POST':
+        data = {'error': 'POST JSON lines of {"guid": ..., "vsid": ...}'}
+        return HttpResponse(json.dumps(data),
+                            content_type='application/json',
+                            status=405)
+
+    # Read line by line, so that an oversized post is turned away after
+    # one line past the limit instead of being read into memory whole
+    lines = list(itertools.islice(request,
+                                  settings.BATCH_RESOLVE_MAX_PAIRS + 1))
+    if len(lines) > settings.BATCH_RESOLVE_MAX_PAIRS:
+        data = {'error': 'At most %d pairs may be resolved at once' %
+                settings.BATCH_RESOLVE_MAX_PAIRS}
+        return HttpResponse(json.dumps(data),
+                            content_type='application/json',
+                            status=400)
+
+    results = batch.resolve(batch.parse_pairs(lines))
+    return StreamingHttpResponse(batch.format_results(results),
+                                 content_type='application/x-ndjson')
+
+
+@staff_member_required
+def stats(request):
+    """
+    Reports cache statistics, stage timings, warm-up time, click log and
+    click count statistics for the process that serves this request
+    """
+    data = {'pid': os.getpid(),
+            'guid_resolver': guid_resolver.get_stats(),
+            'solr': job_cache.get_stats(),
+            'timing': timing.histograms.get_stats(),
+            'warm_up': warmup.last_warm_up,
+            'click_log': click_log.get_stats(),
+            'click_counts': click_counter.get_stats()}
+    return HttpResponse(json.dumps(data),
+                        content_type='application/json')
@@ -0,0 +1,182 @@
+"""
+Warms up a new worker process before it takes any traffic.
+
+Workers are recycled every few thousand requests. Without this, the first
+clicks each one serves pay for loading middleware, compiling the urlconf
+and templates, building the registry tables and looking up jobs that every
+other worker already has cached. wsgi.py calls warm_up() when the process
+starts (apache2.conf preloads it with WSGIImportScript), and the stats view
+reports how long that took.
+
+The hottest GUIDs can be preloaded from a file listing one GUID per line,
+hottest first, optionally followed by a click count; the write_hot_guids
+command makes one from access logs.
+"""
+from collections import OrderedDict
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core import urlresolvers
+from django.core.exceptions import ObjectDoesNotExist
+from django.template.loader import get_template
+
+from redirect.registry import REGISTRIES
+from redirect.resolver import guid_resolver
+
+
+logger = logging.getLogger(__name__)
+
+# Templates rendered on the redirect path; kept compiled where the cached
+# template loader is on
+TEMPLATES = ['redirect/expired.html', 'redirect/opengraph.html',
+             'redirect/twitter.html']
+
+# Timings of this process's warm-up, for the stats view
+last_warm_up = None
+
+
+def load_middleware(application):
+    """
+    Loads the middleware of every handler behind :application: (a
+    RedirectDispatcher or a single WSGIHandler)
+    """
+    handlers = [getattr(application, 'redirect_handler', None),
+                getattr(application, 'handler', application)]
+    for handler in handlers:
+        if (getattr(handler, 'load_middleware', None) and
+                handler._request_middleware is None):
+            handler.load_middleware()
+
+
+def load_urls():
+    """
+    Compiles every url pattern and resolves a job click
+    """
+    resolver = urlresolvers.get_resolver(None)
+    resolver.reverse('home', guid='0' * 32)
+    resolver.resolve('/%s' % ('0' * 32))
+
+
+def load_templates():
+    for name in TEMPLATES:
+        get_template(name)
+
+
+def load_tables():
+    """
+    Builds every registry table: exclusions, microsite policies,
+    manipulation pipelines and campaigns
+    """
+    for registry in REGISTRIES:
+        registry.get()
+
+
+def read_hot_guids(path, limit):
+    """
+    Outputs:
+    :guids: Up to :limit: GUIDs from the hot GUIDs file at :path:, as
+        stored in the database
+    """
+    guids = []
+    with open(path) as f:
+        for line in f:
+            if len(guids) >= limit:
+                break
+            fields = line.split()
+            if not fields:
+                continue
+            try:
+                guids.append('{%s}' % uuid.UUID(fields[0]))
+            except ValueError:
+                continue
+    return guids
+
+
+def load_guids(guids):
+    """
+    Looks up :guids: so that they are in the resolver's cache
+
+    Outputs:
+    :found: Number of GUIDs that exist
+    """
+    found = 0
+    for guid in guids:
+        try:
+            guid_resolver.resolve(guid)
+        except ObjectDoesNotExist:
+            continue
+        found += 1
+    return found
+
+
+def count_hot_guids(clicks, limit):
+    """
+    Inputs:
+    :clicks: Iterable of redirect.replay.Click
+    :limit: Number of GUIDs to return
+
+    Outputs:
+    :guids: List of (guid, clicks) for the :limit: most clicked GUIDs, most
+        clicked first
+    """
+    counts = {}
+    for click in clicks:
+        guid = click.path[1:33].lower()
+        counts[guid] = counts.get(guid, 0) + 1
+    guids = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return guids[:limit]
+
+
+def warm_up(application=None, hot_guids_file=None, hot_guids=None):
+    """
+    Runs each warm-up step, logging rather than raising failures so that a
+    worker always starts
+
+    Inputs:
+    :application: WSGI application whose middleware should be loaded
+    :hot_guids_file: File of GUIDs to preload; default:
+        settings.WARMUP_HOT_GUIDS_FILE
+    :hot_guids: Number of GUIDs to preload; default:
+        settings.WARMUP_HOT_GUIDS
+
+    Outputs:
+    :timings: Ordered dictionary of step -> milliseconds, plus 'total' and,
+        when GUIDs were preloaded, 'guids_found'
+    """
+    global last_warm_up
+    if hot_guids_file is None:
+        hot_guids_file = settings.WARMUP_HOT_GUIDS_FILE
+    if hot_guids is None:
+        hot_guids = settings.WARMUP_HOT_GUIDS
+
+    steps = [('middleware', lambda: load_middleware(application)),
+             ('urls', load_urls),
+             ('templates', load_templates),
+             ('tables', load_tables)]
+    if hot_guids_file and hot_guids:
+        steps.append(('guids', lambda: load_guids(
+            read_hot_guids(hot_guids_file, hot_guids))))
+
+    timings = OrderedDict()
+    found = None
+    start = time.time()
+    for name, step in steps:
+        step_start = time.time()
+        try:
+            result = step()
+        except Exception:
+            logger.exception('Warm-up step %s failed', name)
+        else:
+            if name == 'guids':
+                found = result
+        timings[name] = round((time.time() - step_start) * 1000, 3)
+    timings['total'] = round((time.time() - start) * 1000, 3)
+    if found is not None:
+        timings['guids_found'] = found
+
+    logger.info('Warmed up in %.1fms (%s)', timings['total'], ', '.join(
+        '%s %s' % item for item in timings.items() if item[0] != 'total'))
+    last_warm_up = timings
+    return timings
@@ -1,7 +1,8 @@
 from django.conf.urls import patterns, include, url
 from django.views.generic.base import RedirectView
 
-from redirect.views import myjobs_redirect, home, email_redirect, update_buid
+from redirect.views import (myjobs_redirect, home, email_redirect, update_buid,
+                            resolve_batch, stats)
 
 # Uncomment the next two lines to enable the admin:
 from django.contrib import admin
@@ -23,6 +24,12 @@ urlpatterns = patterns('',
     # View for updating buids
     url(r'^update_buid/$', update_buid, name='update_buid'),
 
+    # Final destinations of many jobs at once, for staff
+    url(r'^resolve/$', resolve_batch, name='resolve_batch'),
+
+    # Per-process cache statistics for staff
+    url(r'^stats/$', stats, name='stats'),
+
     url(r'^ajax/', include('automation.urls')),
 
     # Potential www.my.jobs redirect, catches root and anything not caught
@@ -1,4 +1,5 @@
-import os, sys
+import os
+import sys
 
 import newrelic.agent
 newrelic.agent.initialize('/home/web/MyJobs/MyJobs-urls/newrelic.ini')
@@ -14,6 +15,14 @@ if PROJECT_DIR not in sys.path:
 if PARENT_DIR not in sys.path:
     sys.path.append(PARENT_DIR)
 
-import django.core.handlers.wsgi
-application = django.core.handlers.wsgi.WSGIHandler()
-application = newrelic.agent.wsgi_application()(application)
+
+def get_application():
+    # Imported here, once the project is on sys.path
+    from redirect.handlers import RedirectDispatcher
+    from redirect.warmup import warm_up
+    application = RedirectDispatcher()
+    warm_up(application)
+    return application
+
+
+application = newrelic.agent.wsgi_application()(get_application())